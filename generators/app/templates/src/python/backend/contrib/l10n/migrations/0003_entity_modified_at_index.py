@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('l10n', '0002_auto_20230401_2159'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='language',
+            name='modified_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='name',
+            name='modified_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -8,7 +8,7 @@ class Entity(models.Model):
         primary_key=True, default=uuid4, editable=False, db_index=True
     )
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
-    modified_at = models.DateTimeField(auto_now=True)
+    modified_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         abstract = True
@@ -0,0 +1,3 @@
+from .limiter import RateLimiter, rate_limit
+
+__all__ = ["RateLimiter", "rate_limit"]
@@ -0,0 +1,102 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+_RESERVE_THREADS = 4
+
+
+class RateLimitBackend(ABC):
+    """Keeps the token buckets of rate limiters.
+
+    A bucket holds up to burst tokens and refills at rate tokens per second.
+    Callers take a token in advance and then wait for it to be refilled, so
+    concurrent callers queue up instead of polling.
+    """
+
+    @abstractmethod
+    def reserve(self, key: str, rate: float, burst: int) -> float:
+        """Take a token, return how many seconds to wait before using it."""
+
+
+def _take(tokens: float, elapsed: float, rate: float, burst: int) -> float:
+    return min(burst, tokens + elapsed * rate) - 1
+
+
+def _wait(tokens: float, rate: float) -> float:
+    return -tokens / rate if tokens < 0 else 0
+
+
+class LocalRateLimitBackend(RateLimitBackend):
+    """Keep buckets in memory, limiting calls made by this process only."""
+
+    def __init__(self):
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+        self.lock = threading.Lock()
+
+    def reserve(self, key: str, rate: float, burst: int) -> float:
+        with self.lock:
+            now = time.monotonic()
+            tokens, updated_at = self.buckets.get(key, (burst, now))
+            tokens = _take(tokens, now - updated_at, rate, burst)
+            self.buckets[key] = (tokens, now)
+
+        return _wait(tokens, rate)
+
+
+class DatabaseRateLimitBackend(RateLimitBackend):
+    """Keep buckets in the database, limiting calls across every instance.
+
+    Each reservation locks the bucket's row for the duration of a short
+    transaction. Callers inside a transaction reserve from a thread of their
+    own, over a separate connection, as the lock would otherwise be held until
+    the caller's transaction commits.
+    """
+
+    def __init__(self, using: str = "default"):
+        self.using = using
+        self._executor = ThreadPoolExecutor(
+            max_workers=_RESERVE_THREADS,
+            thread_name_prefix="ratelimit-reserve",
+        )
+
+    def reserve(self, key: str, rate: float, burst: int) -> float:
+        if not connections[self.using].in_atomic_block:
+            return self._reserve(key, rate, burst)
+
+        return self._executor.submit(self._reserve_in_thread, key, rate, burst).result()
+
+    def _reserve_in_thread(self, key: str, rate: float, burst: int) -> float:
+        try:
+            return self._reserve(key, rate, burst)
+        finally:
+            # Nothing would close the connection of a worker thread otherwise
+            connections[self.using].close()
+
+    def _reserve(self, key: str, rate: float, burst: int) -> float:
+        # Inline import to support importing this module before Django is initialized
+        from .models import TokenBucket
+
+        with transaction.atomic(using=self.using):
+            bucket, _ = (
+                TokenBucket.objects.using(self.using)
+                .select_for_update()
+                .get_or_create(
+                    key=key,
+                    defaults={"tokens": burst, "updated_at": timezone.now()},
+                )
+            )
+
+            # Read the time once the row is locked, as other instances may
+            # have updated the bucket while we waited for the lock
+            now = timezone.now()
+            elapsed = max(0, (now - bucket.updated_at).total_seconds())
+            bucket.tokens = _take(bucket.tokens, elapsed, rate, burst)
+            bucket.updated_at = now
+            bucket.save(using=self.using, update_fields=["tokens", "updated_at"])
+
+        return _wait(bucket.tokens, rate)
@@ -0,0 +1,99 @@
+import functools
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+from backend.contrib.tasks import metrics
+from django.conf import settings
+from django.utils.module_loading import import_string
+from structlog.stdlib import get_logger
+
+from .backends import RateLimitBackend
+
+_logger = get_logger(__name__)
+
+_DEFAULT_BACKEND = "backend.contrib.ratelimit.backends.DatabaseRateLimitBackend"
+
+
+@functools.lru_cache(maxsize=None)
+def _get_backend(backend_path: str) -> RateLimitBackend:
+    return import_string(backend_path)()
+
+
+def get_backend() -> RateLimitBackend:
+    """Return the backend configured by settings.RATE_LIMIT_BACKEND."""
+    return _get_backend(getattr(settings, "RATE_LIMIT_BACKEND", _DEFAULT_BACKEND))
+
+
+class RateLimiter:
+    """Limit calls to rate per second, allowing bursts of up to burst calls.
+
+    Limiters sharing a key share the same limit. Use as a context manager
+    around each call, or as a decorator.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        rate: float,
+        burst: int = 1,
+        backend: Optional[RateLimitBackend] = None,
+    ):
+        assert rate > 0 and burst > 0, "Rate and burst must be positive."
+
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self.backend = backend
+
+    def acquire(self) -> float:
+        """Block until a call is allowed, return how many seconds it waited."""
+        backend = self.backend or get_backend()
+        wait = backend.reserve(self.key, self.rate, self.burst)
+
+        if wait:
+            _logger.debug("rate_limit_wait", key=self.key, wait_seconds=wait)
+            time.sleep(wait)
+
+            execution = metrics.current_execution()
+            if execution:
+                execution.rate_limit_wait += wait
+
+        return wait
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+class _NoLimit:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def rate_limit(url_or_host: str):
+    """Return the rate limiter of an upstream host, from settings.RATE_LIMITS.
+
+    RATE_LIMITS maps host names to {"RATE": calls per second, "BURST": calls}.
+    Calls to hosts without a rate limit are not limited.
+    """
+    host = urlsplit(url_or_host).hostname or url_or_host
+    config = getattr(settings, "RATE_LIMITS", {}).get(host)
+    if not config:
+        return _NoLimit()
+
+    return RateLimiter(host, config["RATE"], config.get("BURST", 1))
@@ -0,0 +1,9 @@
+from django.db import models
+
+
+class TokenBucket(models.Model):
+    """The state of a rate limit shared by every instance, see backends.py."""
+
+    key = models.CharField(max_length=255, primary_key=True)
+    tokens = models.FloatField()
+    updated_at = models.DateTimeField()
@@ -1,5 +1,23 @@
-from .decorators import task_only, task_or_superuser_only
-from .schema import TaskOptions
-from .tasks import defer
+from .decorators import bearer_token_only, task_only, task_or_superuser_only
+from .groups import Group, defer_group
+from .iteration import defer_iteration
+from .registry import register_task
+from .resumable import ResumableTask
+from .schema import DeferResult, TaskOptions
+from .tasks import defer, defer_async, defer_many
 
-__all__ = [defer, TaskOptions, task_only, task_or_superuser_only]
+__all__ = [
+    bearer_token_only,
+    defer,
+    defer_async,
+    defer_group,
+    defer_iteration,
+    defer_many,
+    DeferResult,
+    Group,
+    register_task,
+    ResumableTask,
+    TaskOptions,
+    task_only,
+    task_or_superuser_only,
+]
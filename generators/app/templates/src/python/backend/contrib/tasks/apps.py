@@ -1,6 +1,20 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.utils.module_loading import autodiscover_modules
 
 
 class TasksConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "backend.contrib.tasks"
+
+    def ready(self):
+        # Register the tasks defined in the tasks module of every app, so
+        # their IDs resolve in task handlers, see registry.py
+        autodiscover_modules("tasks")
+
+        if getattr(settings, "TASKS_OUTBOX_DISPATCHER_THREAD", False):
+            # Enqueue outbox tasks as soon as they commit, rather than on the
+            # next dispatch-task-outbox cron run
+            from .outbox import start_outbox_dispatcher
+
+            start_outbox_dispatcher()
@@ -0,0 +1,351 @@
+"""Run the jobs of cron.yaml locally, like App Engine's cron service.
+
+Schedules follow the App Engine cron grammar, e.g. "every 5 minutes",
+"every 2 hours from 10:00 to 14:00", "every 12 hours synchronized",
+"every monday 09:00", "2nd,third mon,wed of jan,feb 17:00" or
+"1 of month 00:00". Jobs are requested with the X-Appengine-Cron header,
+in process through the Django test client or from a running server.
+
+The schedule runs on a simulated clock which can be sped up, so a day of cron
+load is replayed in minutes. The application itself still sees the real time.
+"""
+
+import datetime
+import heapq
+import re
+import time
+from typing import Callable, Iterator, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+import requests
+from django.test import Client
+from pydantic import BaseModel
+from structlog.stdlib import get_logger
+
+from .middleware import _APPENGINE_CRON_HEADER
+from .tasks_emulator import _meta_to_header
+
+_logger = get_logger(__name__)
+
+_INTERVAL_RE = re.compile(
+    r"^every (\d+) (minutes?|mins?|hours?)"
+    r"(?: from (\d\d?:\d\d) to (\d\d?:\d\d)| (synchronized))?$"
+)
+_WEEKDAYS = {
+    name: index
+    for index, names in enumerate(
+        (
+            ("monday", "mon"),
+            ("tuesday", "tue"),
+            ("wednesday", "wed"),
+            ("thursday", "thu"),
+            ("friday", "fri"),
+            ("saturday", "sat"),
+            ("sunday", "sun"),
+        )
+    )
+    for name in names
+}
+_MONTHS = {
+    name: index + 1
+    for index, names in enumerate(
+        (
+            ("january", "jan"),
+            ("february", "feb"),
+            ("march", "mar"),
+            ("april", "apr"),
+            ("may",),
+            ("june", "jun"),
+            ("july", "jul"),
+            ("august", "aug"),
+            ("september", "sep"),
+            ("october", "oct"),
+            ("november", "nov"),
+            ("december", "dec"),
+        )
+    )
+    for name in names
+}
+_ORDINALS = {
+    "1st": 1,
+    "first": 1,
+    "2nd": 2,
+    "second": 2,
+    "3rd": 3,
+    "third": 3,
+    "4th": 4,
+    "fourth": 4,
+    "5th": 5,
+    "fifth": 5,
+}
+# Long enough to find the next run of "29 of feb" schedules
+_MAX_SEARCH_DAYS = 8 * 366
+
+
+class InvalidScheduleError(ValueError):
+    """Raised when a cron schedule does not follow the App Engine grammar."""
+
+
+class CronJobError(Exception):
+    """Raised when a cron job responds with a non-2xx status code."""
+
+
+class CronJob(BaseModel):
+    url: str
+    schedule: str
+    description: str = ""
+    timezone: str = "UTC"
+
+
+class _IntervalSchedule:
+    """Runs every interval, within a daily window if any.
+
+    Without a window, runs are spaced from the previous run. With a window,
+    runs are aligned on its start ("synchronized" is 00:00 to 23:59).
+    """
+
+    def __init__(
+        self,
+        interval: datetime.timedelta,
+        window: Optional[Tuple[datetime.time, datetime.time]],
+        tz: ZoneInfo,
+    ):
+        self.interval = interval
+        self.window = window
+        self.tz = tz
+
+    def next_run(self, after: datetime.datetime) -> datetime.datetime:
+        if self.window is None:
+            return after + self.interval
+
+        after = after.astimezone(self.tz)
+        # Start from the day before, in case its window runs past midnight
+        day = after.date() - datetime.timedelta(days=1)
+        while True:
+            start = datetime.datetime.combine(day, self.window[0], tzinfo=self.tz)
+            end = datetime.datetime.combine(day, self.window[1], tzinfo=self.tz)
+            if end < start:
+                end += datetime.timedelta(days=1)
+
+            if after < start:
+                return start
+
+            run = start + self.interval * ((after - start) // self.interval + 1)
+            if run <= end:
+                return run
+
+            day += datetime.timedelta(days=1)
+
+
+class _TimedSchedule:
+    """Runs at a time of the day, on the days matching the schedule."""
+
+    def __init__(
+        self,
+        at: datetime.time,
+        months: Set[int],
+        weekdays: Set[int],
+        ordinals: Optional[Set[int]],
+        days_of_month: Optional[Set[int]],
+        tz: ZoneInfo,
+    ):
+        self.at = at
+        self.months = months
+        self.weekdays = weekdays
+        self.ordinals = ordinals
+        self.days_of_month = days_of_month
+        self.tz = tz
+
+    def _matches(self, day: datetime.date) -> bool:
+        if day.month not in self.months:
+            return False
+        if self.days_of_month is not None:
+            return day.day in self.days_of_month
+        if day.weekday() not in self.weekdays:
+            return False
+        # The 1st monday of the month falls in its first 7 days, and so on
+        return self.ordinals is None or (day.day - 1) // 7 + 1 in self.ordinals
+
+    def next_run(self, after: datetime.datetime) -> datetime.datetime:
+        after = after.astimezone(self.tz)
+        day = after.date()
+        for _ in range(_MAX_SEARCH_DAYS):
+            if self._matches(day):
+                run = datetime.datetime.combine(day, self.at, tzinfo=self.tz)
+                if run > after:
+                    return run
+            day += datetime.timedelta(days=1)
+
+        raise InvalidScheduleError("The schedule never runs")
+
+
+def _parse_time(value: str, schedule: str) -> datetime.time:
+    try:
+        return datetime.datetime.strptime(value, "%H:%M").time()
+    except ValueError:
+        raise InvalidScheduleError("Invalid time in schedule: {0}".format(schedule))
+
+
+def _parse_names(value: str, names: dict, schedule: str) -> Set[int]:
+    try:
+        return {names[name] for name in value.split(",")}
+    except KeyError:
+        raise InvalidScheduleError("Invalid schedule: {0}".format(schedule))
+
+
+def parse_schedule(schedule: str, timezone: str = "UTC"):
+    """Parse an App Engine cron schedule.
+
+    Return an object whose next_run(after) method returns the first run of
+    the schedule after the given (timezone aware) datetime.
+    """
+    tz = ZoneInfo(timezone)
+    normalized = " ".join(schedule.lower().replace(", ", ",").split())
+
+    match = _INTERVAL_RE.match(normalized)
+    if match:
+        count, unit, start, end, synchronized = match.groups()
+        if not int(count):
+            raise InvalidScheduleError("Invalid interval: {0}".format(schedule))
+
+        interval = datetime.timedelta(
+            **{"hours" if unit.startswith("hour") else "minutes": int(count)}
+        )
+        window = None
+        if start:
+            window = (_parse_time(start, schedule), _parse_time(end, schedule))
+        elif synchronized:
+            window = (datetime.time(0, 0), datetime.time(23, 59))
+        return _IntervalSchedule(interval, window, tz)
+
+    words = normalized.split()
+    if len(words) < 2:
+        raise InvalidScheduleError("Invalid schedule: {0}".format(schedule))
+
+    at = _parse_time(words.pop(), schedule)
+
+    months = set(_MONTHS.values())
+    if len(words) >= 3 and words[-2] == "of":
+        if words[-1] != "month":
+            months = _parse_names(words[-1], _MONTHS, schedule)
+        words = words[:-2]
+
+    if len(words) == 1 and words[0] != "every":
+        # "1,15 of month 00:00": days of the month
+        try:
+            days_of_month = {int(day) for day in words[0].split(",")}
+        except ValueError:
+            raise InvalidScheduleError("Invalid schedule: {0}".format(schedule))
+        return _TimedSchedule(at, months, set(), None, days_of_month, tz)
+
+    if len(words) != 2:
+        raise InvalidScheduleError("Invalid schedule: {0}".format(schedule))
+
+    scope, days = words
+    ordinals = None if scope == "every" else _parse_names(scope, _ORDINALS, schedule)
+    weekdays = (
+        set(_WEEKDAYS.values())
+        if days == "day"
+        else _parse_names(days, _WEEKDAYS, schedule)
+    )
+    return _TimedSchedule(at, months, weekdays, ordinals, None, tz)
+
+
+def load_cron_jobs(path: str) -> List[CronJob]:
+    """Load the jobs of a cron.yaml file, checking their schedules."""
+    # Inline import, PyYAML is only a development dependency
+    import yaml
+
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+
+    jobs = [CronJob(**entry) for entry in config.get("cron") or []]
+    for job in jobs:
+        parse_schedule(job.schedule, job.timezone)
+    return jobs
+
+
+def cron_dispatcher(http_target: Optional[str] = None) -> Callable[[CronJob], None]:
+    """Return a function requesting a job's URL like App Engine's cron service.
+
+    Jobs are requested through the Django test client by default, or from a
+    running server if http_target (e.g. http://localhost:8000) is given.
+    """
+    headers = {_meta_to_header(_APPENGINE_CRON_HEADER): "true"}
+
+    def dispatch(job: CronJob):
+        if http_target:
+            status_code = requests.get(
+                http_target + job.url, headers=headers
+            ).status_code
+        else:
+            status_code = (
+                Client(raise_request_exception=False)
+                .get(job.url, headers=headers, follow=True)
+                .status_code
+            )
+
+        if not 200 <= status_code < 300:
+            raise CronJobError(
+                "Cron job {0} failed with status {1}".format(job.url, status_code)
+            )
+
+    return dispatch
+
+
+class CronScheduler:
+    """Dispatch cron jobs on their schedules.
+
+    The schedules run on a simulated clock, starting at start (now by
+    default) and running speed times faster than real time.
+    """
+
+    def __init__(
+        self,
+        jobs: List[CronJob],
+        dispatch: Callable[[CronJob], None],
+        speed: float = 1.0,
+        start: Optional[datetime.datetime] = None,
+    ):
+        assert speed > 0, "Speed must be positive."
+
+        self.jobs = jobs
+        self.dispatch = dispatch
+        self.speed = speed
+        self.start = start or datetime.datetime.now(datetime.timezone.utc)
+
+    def runs(
+        self, until: Optional[datetime.datetime] = None
+    ) -> Iterator[Tuple[datetime.datetime, CronJob]]:
+        """Yield the (simulated time, job) of every run, in order."""
+        schedules = [parse_schedule(job.schedule, job.timezone) for job in self.jobs]
+        # The index breaks ties between jobs due at the same time
+        heap = [
+            (schedule.next_run(self.start), index)
+            for index, schedule in enumerate(schedules)
+        ]
+        heapq.heapify(heap)
+
+        while heap:
+            run_at, index = heapq.heappop(heap)
+            if until is not None and run_at > until:
+                return
+
+            yield run_at, self.jobs[index]
+            heapq.heappush(heap, (schedules[index].next_run(run_at), index))
+
+    def run(self, until: Optional[datetime.datetime] = None):
+        """Dispatch jobs as they fall due, until the simulated time until."""
+        started = time.monotonic()
+
+        for run_at, job in self.runs(until):
+            elapsed = (time.monotonic() - started) * self.speed
+            delay = (run_at - self.start).total_seconds() - elapsed
+            if delay > 0:
+                time.sleep(delay / self.speed)
+
+            _logger.info("Running cron job", url=job.url, scheduled_for=run_at)
+            try:
+                self.dispatch(job)
+            except Exception:
+                _logger.exception("Cron job failed", url=job.url)
@@ -1,5 +1,7 @@
+import hmac
 from functools import wraps
 
+from django.conf import settings
 from django.http import HttpResponseForbidden
 
 from .environment import is_in_cron, is_in_task
@@ -41,3 +43,27 @@ def task_or_superuser_only(view_function):
         return view_function(request, *args, **kwargs)
 
     return replacement
+
+
+def bearer_token_only(setting_name: str):
+    """Restrict access to requests bearing the token held by the given setting,
+    in their Authorization header. Every request is denied while the setting
+    is empty.
+
+    Used as a decorator factory."""
+
+    def decorator(view_function):
+        @wraps(view_function)
+        def replacement(request, *args, **kwargs):
+            token = getattr(settings, setting_name, None)
+            authorization = request.headers.get("Authorization", "")
+            if not token or not hmac.compare_digest(
+                authorization.encode(), "Bearer {0}".format(token).encode()
+            ):
+                return HttpResponseForbidden("Access denied.")
+
+            return view_function(request, *args, **kwargs)
+
+        return replacement
+
+    return decorator
@@ -1,8 +1,35 @@
+import contextvars
 import os
-import threading
 from typing import Optional
 
-_TASK_ENV = threading.local()
+
+class _TaskEnvironment:
+    """Task (and cron) metadata of the current request, see middleware.py."""
+
+    def __init__(
+        self,
+        task_name: Optional[str] = None,
+        queue_name: Optional[str] = None,
+        task_execution_count: Optional[str] = None,
+        task_retry_count: Optional[str] = None,
+        is_cron: bool = False,
+        task_eta: Optional[str] = None,
+        task_created_at: Optional[str] = None,
+    ):
+        self.task_name = task_name
+        self.queue_name = queue_name
+        self.task_execution_count = task_execution_count
+        self.task_retry_count = task_retry_count
+        self.is_cron = is_cron
+        self.task_eta = task_eta
+        self.task_created_at = task_created_at
+
+
+# A context variable rather than a thread local, so the environment follows
+# requests across threads and coroutines when served over ASGI
+_TASK_ENV: contextvars.ContextVar[Optional[_TaskEnvironment]] = contextvars.ContextVar(
+    "task_environment", default=None
+)
 
 
 def google_cloud_project() -> Optional[str]:
@@ -23,23 +50,23 @@ def gae_version() -> Optional[str]:
 
 def is_in_task() -> bool:
     """Return True if the request is a task, False otherwise."""
-    return bool(getattr(_TASK_ENV, "task_name", False))
+    return bool(getattr(_TASK_ENV.get(), "task_name", False))
 
 
 def is_in_cron() -> bool:
     """Return True if the request is in a cron, False otherwise."""
-    return bool(getattr(_TASK_ENV, "is_cron", False))
+    return bool(getattr(_TASK_ENV.get(), "is_cron", False))
 
 
 def task_name() -> Optional[str]:
     """Return the name of the current task if any, else None."""
-    return getattr(_TASK_ENV, "task_name", None)
+    return getattr(_TASK_ENV.get(), "task_name", None)
 
 
 def task_retry_count() -> Optional[int]:
     """Return the task retry count or None if this isn't a task."""
     try:
-        return int(getattr(_TASK_ENV, "task_retry_count", None))
+        return int(getattr(_TASK_ENV.get(), "task_retry_count", None))
     except (TypeError, ValueError):
         return None
 
@@ -47,16 +74,33 @@ def task_retry_count() -> Optional[int]:
 def task_queue_name() -> Optional[str]:
     """Return the name of the current task queue else 'default'."""
     if is_in_task():
-        return getattr(_TASK_ENV, "queue_name", "default")
+        return getattr(_TASK_ENV.get(), "queue_name", "default")
     return None
 
 
 def task_execution_count() -> Optional[int]:
     if is_in_task():
-        return getattr(_TASK_ENV, "task_execution_count", 0)
+        return getattr(_TASK_ENV.get(), "task_execution_count", 0)
     return None
 
 
+def _timestamp(attr: str) -> Optional[float]:
+    try:
+        return float(getattr(_TASK_ENV.get(), attr, None))
+    except (TypeError, ValueError):
+        return None
+
+
+def task_eta() -> Optional[float]:
+    """Return when the current task was scheduled to run (UNIX timestamp)."""
+    return _timestamp("task_eta")
+
+
+def task_created_at() -> Optional[float]:
+    """Return when the current task was deferred (UNIX timestamp)."""
+    return _timestamp("task_created_at")
+
+
 def tasks_location() -> Optional[str]:
     """Get the Cloud Tasks location based on the application ID prefix."""
     lookup = {
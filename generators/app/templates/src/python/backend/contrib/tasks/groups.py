@@ -0,0 +1,263 @@
+"""Fan-out/fan-in groups of tasks.
+
+A group runs its member tasks in parallel and defers a callback task as soon
+as the last of them finishes. The members still running are counted in a
+TaskGroup row, decremented atomically as each member finishes, so exactly one
+member sees the group complete and the callback is deferred exactly once.
+"""
+
+import functools
+import json
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from structlog.stdlib import get_logger
+
+from . import metrics, serialization
+from .schema import DeferResult, TaskOptions
+from .tasks import (
+    _DEFAULT_MAX_CONCURRENT_CREATES,
+    PermanentTaskError,
+    defer,
+    defer_many,
+)
+
+_logger = get_logger(__name__)
+
+FAILURE_POLICY_IGNORE = "ignore"
+FAILURE_POLICY_FAIL = "fail"
+
+# Members still running this long after their group was deferred are failed
+# by sweep_groups()
+_DEFAULT_GROUP_DEADLINE = timedelta(days=1)
+
+# Options applying to the callback as well as to the members
+_CALLBACK_OPTIONS = {
+    "small_task",
+    "using",
+    "routing",
+    "handler_url",
+    "extra_task_headers",
+    "queue",
+}
+
+
+class Group:
+    """Tasks to run in parallel, followed by an (optional) callback task.
+
+    Members may themselves be groups, in which case the nested group finishes
+    once its own callback has been deferred.
+
+    A member fails by raising PermanentTaskError (any other exception is
+    retried). Members which fail to enqueue are failed straight away. A member
+    retried until Cloud Tasks gives up on it never finishes, so sweep_groups(),
+    run by a cron job, fails the members still running a day after their group
+    was deferred.
+
+    With the "ignore" failure policy the callback runs once every member
+    finished, failed or not. With the "fail" policy the group fails as soon
+    as a member fails: the errback runs instead of the callback and the
+    failure propagates to the enclosing group.
+    """
+
+    def __init__(
+        self,
+        tasks: Iterable[object],
+        callback: Optional[object] = None,
+        errback: Optional[object] = None,
+        failure_policy: str = FAILURE_POLICY_IGNORE,
+    ):
+        assert failure_policy in (FAILURE_POLICY_IGNORE, FAILURE_POLICY_FAIL)
+
+        self.tasks = list(tasks)
+        self.callback = callback
+        self.errback = errback
+        self.failure_policy = failure_policy
+
+
+class _GroupMember:
+    """Task body running a member of a group, then marking it finished."""
+
+    def __init__(self, member_id: int, task: object, using: str):
+        self.member_id = member_id
+        self.task = task
+        self.using = using
+
+    def run(self):
+        execution = metrics.current_execution()
+        if execution:
+            execution.task_class = self.task.__class__.__qualname__
+
+        try:
+            self.task.run()
+        except PermanentTaskError:
+            _logger.exception("Task group member failed", member_id=self.member_id)
+            _finish_member(self.member_id, True, self.using)
+        else:
+            _finish_member(self.member_id, False, self.using)
+
+
+def _encode(task: Optional[object]) -> Optional[bytes]:
+    return serialization.encode(task) if task is not None else None
+
+
+def _create_group(
+    group: Group,
+    options: TaskOptions,
+    parent_member_id: Optional[int],
+    members: List[Tuple[int, object]],
+) -> int:
+    # Inline import to support importing this module before Django is initialized
+    from .models import TaskGroup, TaskGroupMember
+
+    task_group = TaskGroup.objects.using(options.using).create(
+        pending=len(group.tasks),
+        failure_policy=group.failure_policy,
+        callback=_encode(group.callback),
+        errback=_encode(group.errback),
+        callback_options=json.loads(options.json(include=_CALLBACK_OPTIONS)),
+        parent_member_id=parent_member_id,
+    )
+    rows = TaskGroupMember.objects.using(options.using).bulk_create(
+        TaskGroupMember(group=task_group) for _ in group.tasks
+    )
+
+    for row, task in zip(rows, group.tasks):
+        if isinstance(task, Group):
+            _create_group(task, options, row.pk, members)
+        else:
+            members.append((row.pk, task))
+
+    if not group.tasks:
+        _complete(task_group, False, options.using)
+
+    return task_group.pk
+
+
+def _complete(task_group, failed: bool, using: str):
+    from .models import TaskGroup
+
+    # Only the first member to complete the group gets to run the callback
+    pending = TaskGroup.objects.using(using).filter(
+        pk=task_group.pk,
+        completed_at__isnull=True,
+    )
+    if not pending.update(completed_at=timezone.now(), succeeded=not task_group.failed):
+        return
+
+    _logger.info("Task group completed", group_id=task_group.pk, failed=failed)
+
+    payload = task_group.errback if failed else task_group.callback
+    if payload is not None:
+        options = TaskOptions.parse_obj(task_group.callback_options)
+        options.transactional = True
+        defer(serialization.decode(bytes(payload)), options)
+
+    if task_group.parent_member_id:
+        _finish_member(task_group.parent_member_id, failed, using)
+
+
+def _finish_member(member_id: int, failed: bool, using: str):
+    from .models import TaskGroup, TaskGroupMember
+
+    with transaction.atomic(using=using):
+        # Tasks are delivered at least once, only count the first run
+        running = TaskGroupMember.objects.using(using).filter(
+            pk=member_id,
+            finished_at__isnull=True,
+        )
+        if not running.update(finished_at=timezone.now(), failed=failed):
+            return
+
+        group_id = (
+            TaskGroupMember.objects.using(using)
+            .values_list("group_id", flat=True)
+            .get(pk=member_id)
+        )
+
+        # The update locks the group row until commit, so concurrent members
+        # finish one after the other and see each other's decrements
+        TaskGroup.objects.using(using).filter(pk=group_id).update(
+            pending=F("pending") - 1,
+            failed=F("failed") + int(failed),
+        )
+        task_group = TaskGroup.objects.using(using).get(pk=group_id)
+
+        if task_group.failure_policy == FAILURE_POLICY_FAIL and task_group.failed:
+            _complete(task_group, True, using)
+        elif task_group.pending <= 0:
+            _complete(task_group, False, using)
+
+
+def _fail_unenqueued(
+    members: List[Tuple[int, object]], results: List[DeferResult], using: str
+):
+    for (member_id, _), result in zip(members, results):
+        if result.success is False:
+            _logger.error(
+                "Failed to enqueue task group member",
+                member_id=member_id,
+                error=repr(result.error),
+            )
+            _finish_member(member_id, True, using)
+
+
+def sweep_groups(
+    deadline: timedelta = _DEFAULT_GROUP_DEADLINE,
+    now: Optional[datetime] = None,
+    using: str = "default",
+) -> int:
+    """Fail the members of groups deferred more than deadline ago which are
+    still running, and return their number.
+
+    Members finishing after being failed are ignored, like repeated runs.
+    """
+    from .models import TaskGroupMember
+
+    stale = TaskGroupMember.objects.using(using).filter(
+        finished_at__isnull=True,
+        group__completed_at__isnull=True,
+        group__created_at__lt=(now or timezone.now()) - deadline,
+    )
+    member_ids = list(stale.values_list("pk", flat=True))
+    for member_id in member_ids:
+        _logger.warning("Task group member timed out", member_id=member_id)
+        _finish_member(member_id, True, using)
+
+    return len(member_ids)
+
+
+def defer_group(
+    group: Group,
+    task_options: Optional[TaskOptions] = None,
+    max_concurrency: int = _DEFAULT_MAX_CONCURRENT_CREATES,
+) -> int:
+    """Defer the tasks of a group (and of its nested groups).
+
+    Members are deferred with defer_many() and the callback with the same
+    queue and routing options. Members which fail to enqueue are failed, once
+    the transaction commits if the members are transactional. Return the ID of
+    the TaskGroup row tracking the group.
+    """
+    options = task_options or TaskOptions()
+    members: List[Tuple[int, object]] = []
+
+    with transaction.atomic(using=options.using):
+        group_id = _create_group(group, options, None, members)
+
+    results = defer_many(
+        [_GroupMember(member_id, task, options.using) for member_id, task in members],
+        task_options,
+        max_concurrency=max_concurrency,
+    )
+    # Transactional results are filled in on commit, by a callback registered
+    # before this one
+    transaction.on_commit(
+        functools.partial(_fail_unenqueued, members, results, options.using),
+        using=options.using,
+    )
+
+    return group_id
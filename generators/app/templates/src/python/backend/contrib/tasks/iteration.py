@@ -0,0 +1,143 @@
+"""Iterate over large querysets across many tasks.
+
+defer_iteration() splits a queryset into contiguous ranges of a key (the
+primary key by default) and runs a callback on every instance, one task per
+range. A task running out of time re-defers itself to carry on from the last
+instance it processed, so no task ever runs into the request deadline.
+"""
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+from django.db import models, transaction
+from django.db.models import Q
+from structlog.stdlib import get_logger
+
+from .groups import Group, _create_group, _finish_member
+from .schema import TaskOptions
+from .tasks import defer, defer_many
+
+_logger = get_logger(__name__)
+
+_DEFAULT_SHARDS = 8
+_DEFAULT_TIME_BUDGET = 5 * 60
+_ITERATOR_CHUNK_SIZE = 500
+
+
+class _IterationShard:
+    """Task running the callback over a range of the queryset."""
+
+    def __init__(
+        self,
+        queryset: models.QuerySet,
+        callback: Callable[[Any], None],
+        key: str,
+        start: Any,
+        end: Any,
+        time_budget: float,
+        task_options: Optional[TaskOptions],
+    ):
+        # Querysets are evaluated when pickled, unlike their query
+        self.model = queryset.model
+        self.query = queryset.query
+        self.using = queryset.db
+        self.callback = callback
+        self.key = key
+        self.start = start
+        self.end = end
+        self.time_budget = time_budget
+        self.task_options = task_options
+        # (key, pk) of the last instance processed
+        self.after: Optional[Tuple[Any, Any]] = None
+        # The member of the group tracking the shards, if any
+        self.member_id: Optional[int] = None
+
+    def _queryset(self) -> models.QuerySet:
+        queryset = self.model._default_manager.db_manager(self.using).all()
+        queryset.query = self.query
+
+        if self.start is not None:
+            queryset = queryset.filter(**{"{0}__gte".format(self.key): self.start})
+        if self.end is not None:
+            queryset = queryset.filter(**{"{0}__lt".format(self.key): self.end})
+
+        if self.after is not None:
+            last_key, last_pk = self.after
+            if self.key == "pk":
+                queryset = queryset.filter(pk__gt=last_pk)
+            else:
+                queryset = queryset.filter(
+                    Q(**{"{0}__gt".format(self.key): last_key})
+                    | Q(**{self.key: last_key, "pk__gt": last_pk})
+                )
+
+        return queryset.order_by(self.key, "pk")
+
+    def run(self):
+        deadline = time.monotonic() + self.time_budget
+
+        for instance in self._queryset().iterator(chunk_size=_ITERATOR_CHUNK_SIZE):
+            self.callback(instance)
+            key = instance.pk if self.key == "pk" else getattr(instance, self.key)
+            self.after = (key, instance.pk)
+
+            if time.monotonic() >= deadline:
+                _logger.info(
+                    "Iteration shard out of time, continuing in a new task",
+                    model=self.model._meta.label,
+                    after=self.after,
+                )
+                defer(self, self.task_options)
+                return
+
+        if self.member_id is not None:
+            _finish_member(self.member_id, False, self.using)
+
+
+def _split(queryset: models.QuerySet, key: str, shards: int) -> List[Tuple]:
+    """Split the queryset into contiguous [start, end) ranges of the key."""
+    count = queryset.count()
+    if not count:
+        return [(None, None)]
+
+    values = queryset.order_by(key).values_list(key, flat=True)
+
+    # Instances sharing a key always end up in the same range
+    bounds = sorted({values[count * i // shards] for i in range(1, shards)})
+    edges = [None, *bounds, None]
+    return list(zip(edges, edges[1:]))
+
+
+def defer_iteration(
+    queryset: models.QuerySet,
+    callback: Callable[[Any], None],
+    shards: int = _DEFAULT_SHARDS,
+    key: str = "pk",
+    finalize: Optional[object] = None,
+    time_budget: float = _DEFAULT_TIME_BUDGET,
+    task_options: Optional[TaskOptions] = None,
+):
+    """Call callback(instance) for every instance of the queryset, in tasks.
+
+    The queryset is split into (up to) shards ranges of key, which must be
+    the primary key or an indexed, non-null field such as created_at. Each
+    range is processed in order by its own task, which re-defers itself after
+    time_budget seconds. The callback must be picklable (e.g. a module level
+    function). If given, the finalize task is deferred once every range has
+    been processed.
+    """
+    assert shards > 0, "At least one shard is required."
+
+    tasks = [
+        _IterationShard(queryset, callback, key, start, end, time_budget, task_options)
+        for start, end in _split(queryset, key, shards)
+    ]
+
+    if finalize is not None:
+        options = task_options or TaskOptions()
+        members: List[Tuple[int, Any]] = []
+        with transaction.atomic(using=options.using):
+            _create_group(Group(tasks, callback=finalize), options, None, members)
+        for member_id, task in members:
+            task.member_id = member_id
+
+    defer_many(tasks, task_options)
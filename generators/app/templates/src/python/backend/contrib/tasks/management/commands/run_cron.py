@@ -0,0 +1,74 @@
+import datetime
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...cron import CronScheduler, cron_dispatcher, load_cron_jobs
+
+# cron.yaml sits next to app.yaml, at the root of the project
+_DEFAULT_CRON_FILE = os.path.normpath(
+    os.path.join(settings.BASE_DIR, "..", "..", "..", "cron.yaml")
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Dispatch the jobs of cron.yaml on their schedules, like App Engine's "
+        "cron service does in production."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cron-file", default=_DEFAULT_CRON_FILE)
+        parser.add_argument(
+            "--speed",
+            type=float,
+            default=1.0,
+            help="Time acceleration factor, e.g. 288 replays a day in 5 minutes",
+        )
+        parser.add_argument(
+            "--hours",
+            type=float,
+            help="Stop after this many hours of simulated time",
+        )
+        parser.add_argument(
+            "--target",
+            help=(
+                "Base URL of a running server, e.g. http://localhost:8000. Jobs "
+                "run in this process, with the tasks emulator, by default."
+            ),
+        )
+        parser.add_argument(
+            "--url",
+            action="append",
+            help="Only dispatch the jobs with this URL (repeatable)",
+        )
+
+    def handle(self, *args, **options):
+        # Invalid schedules and entries raise ValueErrors
+        try:
+            jobs = load_cron_jobs(options["cron_file"])
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+
+        if options["url"]:
+            jobs = [job for job in jobs if job.url in options["url"]]
+        if not jobs:
+            raise CommandError("No cron jobs to run")
+
+        scheduler = CronScheduler(
+            jobs,
+            cron_dispatcher(options["target"]),
+            speed=options["speed"],
+        )
+        until = None
+        if options["hours"]:
+            until = scheduler.start + datetime.timedelta(hours=options["hours"])
+
+        self.stdout.write(
+            "Running {0} cron jobs at {1}x speed".format(len(jobs), options["speed"])
+        )
+        try:
+            scheduler.run(until)
+        except KeyboardInterrupt:
+            pass
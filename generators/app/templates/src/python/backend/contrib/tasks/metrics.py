@@ -0,0 +1,274 @@
+"""Execution metrics for deferred tasks.
+
+Every task execution is logged as a "task_executed" event and aggregated into
+in-process histograms, labelled by task class and queue. The sizes of encoded
+payloads are recorded at defer time, labelled by task class and codec.
+render_metrics() exports them in the Prometheus text format. Metrics are kept
+per process, so each instance reports its own executions.
+"""
+import contextlib
+import contextvars
+import math
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from django.db import connections
+from structlog.stdlib import get_logger
+
+_logger = get_logger(__name__)
+
+_SECONDS_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    300,
+    600,
+    1800,
+    3600,
+)
+_BYTES_BUCKETS = tuple(256 * 4**i for i in range(10))  # 256B to 64MiB
+_QUERIES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+_current_execution: contextvars.ContextVar[Optional["TaskExecution"]] = (
+    contextvars.ContextVar("current_task_execution", default=None)
+)
+
+
+class _Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+_METRICS = {
+    "task_wall_seconds": ("Wall time spent running the task", _SECONDS_BUCKETS),
+    "task_cpu_seconds": ("CPU time spent running the task", _SECONDS_BUCKETS),
+    "task_db_queries": ("Database queries made by the task", _QUERIES_BUCKETS),
+    "task_payload_bytes": ("Size of the encoded task", _BYTES_BUCKETS),
+    "task_created_lag_seconds": (
+        "Time from the task being deferred to it starting",
+        _SECONDS_BUCKETS,
+    ),
+    "task_schedule_lag_seconds": (
+        "Time from the task's scheduled time to it starting",
+        _SECONDS_BUCKETS,
+    ),
+    "task_rate_limit_wait_seconds": (
+        "Time the task spent waiting for rate limiters",
+        _SECONDS_BUCKETS,
+    ),
+    "task_encoded_raw_bytes": (
+        "Size of deferred task payloads before compression",
+        _BYTES_BUCKETS,
+    ),
+    "task_encoded_bytes": (
+        "Size of deferred task payloads after compression",
+        _BYTES_BUCKETS,
+    ),
+}
+
+_Labels = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_histograms: Dict[Tuple[str, _Labels], _Histogram] = {}
+_outcomes: Dict[Tuple[str, str, str], int] = {}
+
+
+class TaskExecution:
+    """The measurements of a single task execution."""
+
+    def __init__(
+        self,
+        queue: Optional[str],
+        payload_bytes: int,
+        created_at: Optional[float] = None,
+        eta: Optional[float] = None,
+    ):
+        self.task_class = "unknown"
+        self.queue = queue or "default"
+        self.payload_bytes = payload_bytes
+        self.created_at = created_at
+        self.eta = eta
+        self.queries = 0
+        self.rate_limit_wait = 0.0
+        self.outcome: Optional[str] = None
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+def current_execution() -> Optional[TaskExecution]:
+    """Return the task execution being tracked in this context, if any."""
+    return _current_execution.get()
+
+
+def _observe_values(labels: _Labels, values: Dict[str, float]):
+    # Callers hold _lock
+    for metric, value in values.items():
+        key = (metric, labels)
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram(_METRICS[metric][1])
+        histogram.observe(value)
+
+
+def _observe(task_class: str, queue: str, values: Dict[str, float], outcome: str):
+    with _lock:
+        _observe_values((("task_class", task_class), ("queue", queue)), values)
+
+        key = (task_class, queue, outcome)
+        _outcomes[key] = _outcomes.get(key, 0) + 1
+
+
+def observe_encoded(task_class: str, codec: str, raw_bytes: int, encoded_bytes: int):
+    """Record the size of a task payload encoded by a codec."""
+    with _lock:
+        _observe_values(
+            (("task_class", task_class), ("codec", codec)),
+            {
+                "task_encoded_raw_bytes": raw_bytes,
+                "task_encoded_bytes": encoded_bytes,
+            },
+        )
+
+
+@contextlib.contextmanager
+def track_execution(
+    queue: Optional[str],
+    payload_bytes: int,
+    created_at: Optional[float] = None,
+    eta: Optional[float] = None,
+) -> Iterator[TaskExecution]:
+    """Measure the task executed in the block.
+
+    created_at and eta are UNIX timestamps. The caller is expected to set
+    task_class on the yielded execution once the task is decoded.
+    """
+    execution = TaskExecution(queue, payload_bytes, created_at, eta)
+    token = _current_execution.set(execution)
+
+    started_at = time.time()
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+
+    try:
+        with contextlib.ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(execution.count_query))
+            yield execution
+        execution.outcome = "success"
+    except BaseException:
+        execution.outcome = "error"
+        raise
+    finally:
+        _current_execution.reset(token)
+
+        values = {
+            "task_wall_seconds": time.perf_counter() - wall_start,
+            "task_cpu_seconds": time.thread_time() - cpu_start,
+            "task_db_queries": execution.queries,
+            "task_payload_bytes": execution.payload_bytes,
+            "task_rate_limit_wait_seconds": execution.rate_limit_wait,
+        }
+        if execution.created_at:
+            values["task_created_lag_seconds"] = max(
+                0, started_at - execution.created_at
+            )
+        if execution.eta:
+            values["task_schedule_lag_seconds"] = max(0, started_at - execution.eta)
+
+        _observe(execution.task_class, execution.queue, values, execution.outcome)
+        _logger.info(
+            "task_executed",
+            task_class=execution.task_class,
+            queue=execution.queue,
+            outcome=execution.outcome,
+            **values,
+        )
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: str) -> str:
+    return _format_labels(tuple(labels.items()))
+
+
+def _format_labels(labels: _Labels) -> str:
+    return ",".join('{0}="{1}"'.format(name, _escape(value)) for name, value in labels)
+
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if math.isinf(bound) else repr(float(bound))
+
+
+def render_metrics() -> str:
+    """Return the collected metrics in the Prometheus text exposition format."""
+    with _lock:
+        histograms = sorted(
+            (key, histogram.buckets, list(histogram.counts), histogram.sum)
+            for key, histogram in _histograms.items()
+        )
+        outcomes = sorted(_outcomes.items())
+
+    lines: List[str] = []
+    for metric, (help_text, _) in _METRICS.items():
+        lines.append("# HELP {0} {1}".format(metric, help_text))
+        lines.append("# TYPE {0} histogram".format(metric))
+
+        for (name, label_values), buckets, counts, total in histograms:
+            if name != metric:
+                continue
+
+            labels = _format_labels(label_values)
+            cumulative = 0
+            for bound, count in zip((*buckets, math.inf), counts):
+                cumulative += count
+                lines.append(
+                    '{0}_bucket{{{1},le="{2}"}} {3}'.format(
+                        metric, labels, _format_bound(bound), cumulative
+                    )
+                )
+            lines.append("{0}_sum{{{1}}} {2}".format(metric, labels, total))
+            lines.append("{0}_count{{{1}}} {2}".format(metric, labels, cumulative))
+
+    lines.append("# HELP tasks_total Task executions by outcome")
+    lines.append("# TYPE tasks_total counter")
+    for (task_class, queue, outcome), count in outcomes:
+        labels = _labels(task_class=task_class, queue=queue, outcome=outcome)
+        lines.append("tasks_total{{{0}}} {1}".format(labels, count))
+
+    return "\n".join(lines) + "\n"
+
+
+def reset_metrics():
+    """Drop every collected metric."""
+    with _lock:
+        _histograms.clear()
+        _outcomes.clear()
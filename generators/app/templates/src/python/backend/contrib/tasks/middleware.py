@@ -1,35 +1,50 @@
-from .environment import _TASK_ENV
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+
+from .environment import _TASK_ENV, _TaskEnvironment
 
 _TASK_NAME_HEADER = "HTTP_X_APPENGINE_TASKNAME"
 _QUEUE_NAME_HEADER = "HTTP_X_APPENGINE_QUEUENAME"
 _TASK_EXECUTION_COUNT_HEADER = "HTTP_X_APPENGINE_TASKEXECUTIONCOUNT"
 _TASK_RETRY_COUNT_HEADER = "HTTP_X_APPENGINE_TASKRETRYCOUNT"
 _APPENGINE_CRON_HEADER = "HTTP_X_APPENGINE_CRON"
+_TASK_ETA_HEADER = "HTTP_X_APPENGINE_TASKETA"
+_TASK_CREATED_AT_HEADER = "HTTP_X_TASK_CREATED_AT"
+
 
+def _task_environment(request) -> _TaskEnvironment:
+    # Make sure we set the appengine headers in the environment from the
+    # request.
+    return _TaskEnvironment(
+        task_name=request.META.get(_TASK_NAME_HEADER),
+        queue_name=request.META.get(_QUEUE_NAME_HEADER),
+        task_execution_count=request.META.get(_TASK_EXECUTION_COUNT_HEADER),
+        task_retry_count=request.META.get(_TASK_RETRY_COUNT_HEADER),
+        is_cron=bool(request.META.get(_APPENGINE_CRON_HEADER)),
+        task_eta=request.META.get(_TASK_ETA_HEADER),
+        task_created_at=request.META.get(_TASK_CREATED_AT_HEADER),
+    )
 
+
+@sync_and_async_middleware
 def _task_environment_middleware(get_response):
+    if iscoroutinefunction(get_response):
+
+        async def async_middleware(request):
+            token = _TASK_ENV.set(_task_environment(request))
+            try:
+                return await get_response(request)
+            finally:
+                _TASK_ENV.reset(token)
+
+        return async_middleware
+
     def middleware(request):
-        # Make sure we set the appengine headers in the environment from the
-        # request.
+        token = _TASK_ENV.set(_task_environment(request))
         try:
-            _TASK_ENV.task_name = request.META.get(_TASK_NAME_HEADER)
-            _TASK_ENV.queue_name = request.META.get(_QUEUE_NAME_HEADER)
-            _TASK_ENV.task_execution_count = request.META.get(
-                _TASK_EXECUTION_COUNT_HEADER
-            )
-            _TASK_ENV.task_retry_count = request.META.get(_TASK_RETRY_COUNT_HEADER)
-            _TASK_ENV.is_cron = bool(request.META.get(_APPENGINE_CRON_HEADER))
-
             return get_response(request)
         finally:
-            for attr in (
-                "task_name",
-                "queue_name",
-                "task_execution_count",
-                "task_retry_count",
-                "is_cron",
-            ):
-                setattr(_TASK_ENV, attr, None)
+            _TASK_ENV.reset(token)
 
     return middleware
 
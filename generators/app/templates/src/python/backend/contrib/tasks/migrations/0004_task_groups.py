@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0003_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskGroup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pending', models.IntegerField(help_text='Number of members still running')),
+                ('failed', models.IntegerField(default=0)),
+                ('failure_policy', models.CharField(choices=[('ignore', 'Run the callback once every member finished'), ('fail', 'Fail the group as soon as a member fails')], default='ignore', max_length=16)),
+                ('callback', models.BinaryField(null=True)),
+                ('errback', models.BinaryField(null=True)),
+                ('callback_options', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(null=True)),
+                ('succeeded', models.BooleanField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TaskGroupMember',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('failed', models.BooleanField(default=False)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='members', to='tasks.taskgroup')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='taskgroup',
+            name='parent_member',
+            field=models.OneToOneField(help_text='The member of the enclosing group this group stands for', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='child_group', to='tasks.taskgroupmember'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def reference_stored_payloads(apps, schema_editor):
+    # Tasks enqueued before this migration don't know their reference, keep
+    # their payloads until they expire and sweep() deletes them
+    PayloadBlob = apps.get_model('tasks', 'PayloadBlob')
+    PayloadReference = apps.get_model('tasks', 'PayloadReference')
+    PayloadReference.objects.bulk_create(
+        PayloadReference(key='legacy-{0}'.format(digest[:57]), blob_id=digest)
+        for digest in PayloadBlob.objects.filter(refs__gt=0).values_list(
+            'digest', flat=True
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0005_task_checkpoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayloadReference',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='references', to='tasks.payloadblob')),
+            ],
+        ),
+        migrations.RunPython(reference_stored_payloads, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='payloadblob',
+            name='refs',
+        ),
+    ]
@@ -1,5 +1,103 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
 
 
-class LargeDeferredTask(models.Model):
+class PayloadBlob(models.Model):
+    """A task payload too large to be sent to Cloud Tasks directly."""
+
+    digest = models.CharField(max_length=64, primary_key=True)
+    size = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+
+class PayloadReference(models.Model):
+    """An enqueued task still referencing a payload, see storage.py."""
+
+    key = models.CharField(max_length=64, primary_key=True)
+    blob = models.ForeignKey(
+        PayloadBlob,
+        on_delete=models.CASCADE,
+        related_name="references",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class PayloadChunk(models.Model):
+    blob = models.ForeignKey(
+        PayloadBlob,
+        on_delete=models.CASCADE,
+        related_name="chunks",
+    )
+    index = models.PositiveIntegerField()
     data = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("blob", "index"),
+                name="unique_for_blob_index",
+            )
+        ]
+
+
+class OutboxTask(models.Model):
+    """A task waiting to be sent to Cloud Tasks by the outbox dispatcher.
+
+    Rows are inserted in the same transaction as the changes that deferred the
+    task, so the task is only (and always) enqueued if the transaction commits.
+    """
+
+    payload = models.BinaryField()
+    options = models.JSONField(help_text="The TaskOptions to enqueue with")
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+
+class TaskGroup(models.Model):
+    """Tracks the members of a group of tasks still to finish, see groups.py."""
+
+    pending = models.IntegerField(help_text="Number of members still running")
+    failed = models.IntegerField(default=0)
+    failure_policy = models.CharField(
+        max_length=16,
+        choices=[
+            ("ignore", "Run the callback once every member finished"),
+            ("fail", "Fail the group as soon as a member fails"),
+        ],
+        default="ignore",
+    )
+    callback = models.BinaryField(null=True)
+    errback = models.BinaryField(null=True)
+    callback_options = models.JSONField(default=dict)
+    parent_member = models.OneToOneField(
+        "TaskGroupMember",
+        null=True,
+        on_delete=models.CASCADE,
+        related_name="child_group",
+        help_text="The member of the enclosing group this group stands for",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True)
+    succeeded = models.BooleanField(null=True)
+
+
+class TaskGroupMember(models.Model):
+    group = models.ForeignKey(
+        TaskGroup,
+        on_delete=models.CASCADE,
+        related_name="members",
+    )
+    finished_at = models.DateTimeField(null=True)
+    failed = models.BooleanField(default=False)
+
+
+class TaskCheckpoint(models.Model):
+    """The cursor of a resumable task, saved after each batch it processes."""
+
+    key = models.CharField(max_length=500, primary_key=True)
+    cursor = models.JSONField(encoder=DjangoJSONEncoder)
+    updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,141 @@
+"""Dispatch tasks deferred with TaskOptions(outbox=True) to Cloud Tasks.
+
+The outbox is drained in batches: each batch is claimed with
+SELECT ... FOR UPDATE SKIP LOCKED, so any number of dispatchers (cron
+requests, background threads) can run at the same time without sending a
+task twice. Tasks that fail to enqueue are retried with exponential backoff.
+"""
+import threading
+from datetime import timedelta
+from typing import Optional
+
+from django.db import connections, transaction
+from django.utils import timezone
+from structlog.stdlib import get_logger
+
+from .schema import DeferResult, TaskOptions
+from .tasks import _DEFAULT_MAX_CONCURRENT_CREATES, _outbox_wakeup, _schedule_many
+
+_logger = get_logger(__name__)
+
+_DEFAULT_BATCH_SIZE = 100
+_DEFAULT_INTERVAL = 5
+_MIN_BACKOFF = 1
+_MAX_BACKOFF = 3600
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(_MIN_BACKOFF * 2 ** min(attempts, 16), _MAX_BACKOFF))
+
+
+def _dispatch_batch(using: str, batch_size: int, max_concurrency: int):
+    """Claim and enqueue a batch of tasks, return (claimed, dispatched)."""
+    from .models import OutboxTask
+
+    with transaction.atomic(using=using):
+        now = timezone.now()
+        entries = list(
+            OutboxTask.objects.using(using)
+            .select_for_update(skip_locked=True)
+            .filter(available_at__lte=now)
+            .order_by("id")[:batch_size]
+        )
+        if not entries:
+            return 0, 0
+
+        tasks = [
+            (bytes(entry.payload), TaskOptions.parse_obj(entry.options))
+            for entry in entries
+        ]
+        results = [DeferResult(name=options.name) for _, options in tasks]
+        _schedule_many(tasks, results, max_concurrency)
+
+        sent, failed = [], []
+        for entry, result in zip(entries, results):
+            if result.success:
+                sent.append(entry.pk)
+            else:
+                entry.attempts += 1
+                entry.last_error = repr(result.error)
+                entry.available_at = now + _backoff(entry.attempts)
+                failed.append(entry)
+
+        OutboxTask.objects.using(using).filter(pk__in=sent).delete()
+        OutboxTask.objects.using(using).bulk_update(
+            failed,
+            ["attempts", "last_error", "available_at"],
+        )
+
+    return len(entries), len(sent)
+
+
+def dispatch_outbox(
+    using: str = "default",
+    batch_size: int = _DEFAULT_BATCH_SIZE,
+    max_concurrency: int = _DEFAULT_MAX_CONCURRENT_CREATES,
+) -> int:
+    """Enqueue every task in the outbox which is due, return how many were sent.
+
+    Each batch is enqueued with up to max_concurrency requests in flight and
+    committed on its own, so a dispatcher interrupted halfway only leaves the
+    current batch in the outbox.
+    """
+    dispatched = 0
+    while True:
+        claimed, sent = _dispatch_batch(using, batch_size, max_concurrency)
+        dispatched += sent
+        if claimed < batch_size:
+            break
+
+    if dispatched:
+        _logger.info("Dispatched outbox tasks", dispatched=dispatched)
+    return dispatched
+
+
+class OutboxDispatcherThread(threading.Thread):
+    """Drain the outbox from a background thread.
+
+    The thread wakes up every interval seconds, and as soon as a transaction
+    adding tasks to the outbox commits in this process.
+    """
+
+    def __init__(self, interval: float = _DEFAULT_INTERVAL, **dispatch_kwargs):
+        super().__init__(name="tasks-outbox-dispatcher", daemon=True)
+        self.interval = interval
+        self.dispatch_kwargs = dispatch_kwargs
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            _outbox_wakeup.wait(self.interval)
+            _outbox_wakeup.clear()
+            if self._stopped.is_set():
+                break
+
+            try:
+                dispatch_outbox(**self.dispatch_kwargs)
+            except Exception:
+                _logger.exception("Failed to dispatch outbox tasks")
+            finally:
+                connections.close_all()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stopped.set()
+        _outbox_wakeup.set()
+        self.join(timeout)
+
+
+_dispatcher_thread: Optional[OutboxDispatcherThread] = None
+_dispatcher_lock = threading.Lock()
+
+
+def start_outbox_dispatcher(**kwargs) -> OutboxDispatcherThread:
+    """Start the dispatcher thread of this process, unless it's running."""
+    global _dispatcher_thread
+
+    with _dispatcher_lock:
+        if _dispatcher_thread is None or not _dispatcher_thread.is_alive():
+            _dispatcher_thread = OutboxDispatcherThread(**kwargs)
+            _dispatcher_thread.start()
+
+        return _dispatcher_thread
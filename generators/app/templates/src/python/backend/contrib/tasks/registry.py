@@ -0,0 +1,47 @@
+"""Registry of task types, referenced in payloads by stable string IDs.
+
+Payloads of registered tasks only hold the task's ID and field values, see
+serialization.RegistryCodec. They don't depend on where the task class is
+defined, so moving or renaming it doesn't break tasks already enqueued.
+
+Tasks are registered when their module is imported. The tasks module of every
+installed app is imported at startup (see apps.py), so that is where
+registered tasks should be defined, or imported.
+"""
+from typing import Callable, Dict, Optional, Type, TypeVar
+
+from pydantic import BaseModel
+
+_TaskType = TypeVar("_TaskType", bound=Type[BaseModel])
+
+_TASKS_BY_ID: Dict[str, Type[BaseModel]] = {}
+_IDS_BY_TASK: Dict[Type[BaseModel], str] = {}
+
+
+def register_task(task_id: str) -> Callable[[_TaskType], _TaskType]:
+    """Register a task class under a stable ID.
+
+    The class must be a pydantic model, whose fields are all its task needs to
+    run. Subclasses are not registered along with it.
+    """
+
+    def decorator(klass: _TaskType) -> _TaskType:
+        assert issubclass(klass, BaseModel), "Registered tasks must be pydantic models."
+        assert callable(getattr(klass, "run", None)), "Tasks must have a run() method."
+        assert _TASKS_BY_ID.get(task_id, klass) is klass, "Duplicate task ID."
+
+        _TASKS_BY_ID[task_id] = klass
+        _IDS_BY_TASK[klass] = task_id
+        return klass
+
+    return decorator
+
+
+def get_task_id(klass: type) -> Optional[str]:
+    """Return the ID of a registered task class, or None."""
+    return _IDS_BY_TASK.get(klass)
+
+
+def get_task_type(task_id: str) -> Optional[Type[BaseModel]]:
+    """Return the task class registered under an ID, or None."""
+    return _TASKS_BY_ID.get(task_id)
@@ -0,0 +1,135 @@
+"""Tasks working through large jobs in batches, across several task requests.
+
+A resumable task saves a cursor after each batch it processes. Before its time
+budget runs out, it re-defers itself to carry on from the cursor in a new
+request, so it never runs into the request deadline. If a request is killed
+anyway, the retried task resumes from the last saved cursor instead of
+starting over.
+"""
+
+import hashlib
+import json
+import time
+import uuid
+from abc import abstractmethod
+from typing import Any, Optional
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from pydantic import BaseModel
+from structlog.stdlib import get_logger
+
+from .environment import task_name
+from .schema import TaskOptions
+from .tasks import defer
+
+_logger = get_logger(__name__)
+
+_DEFAULT_TIME_BUDGET = 5 * 60
+
+# Options a continuation is deferred with, like the task it continues
+_CONTINUATION_OPTIONS = {
+    "small_task",
+    "using",
+    "transactional",
+    "routing",
+    "handler_url",
+    "extra_task_headers",
+    "queue",
+}
+
+
+class ResumableTask(BaseModel):
+    """Base class for resumable tasks.
+
+    Subclasses implement process_batch(cursor), which is called with the
+    cursor returned by the previous batch (None for the first one) and returns
+    the next cursor, or None once the job is done. Cursors can be any JSON
+    value but None, such as the primary key of the last instance processed.
+    They are saved with DjangoJSONEncoder, so UUIDs and datetimes are loaded
+    back as strings.
+
+    The cursor is saved in the same transaction as the database writes of its
+    batch, so a batch and its cursor are committed together.
+
+    defer() keeps the queue, routing, handler and headers the task is deferred
+    with in task_options, and continuations are deferred with the same ones.
+    """
+
+    # Seconds after which the task re-defers itself, checked between batches
+    time_budget: float = _DEFAULT_TIME_BUDGET
+    # Key of the saved cursor, set when the task re-defers itself. The first
+    # request uses its task name, which is kept by retries. Without one, e.g.
+    # when run directly by a cron handler, cursors are only saved to continue
+    # in a new task.
+    checkpoint_key: Optional[str] = None
+    # Options to defer continuations with, set by defer()
+    task_options: Optional[TaskOptions] = None
+
+    # Pydantic's model metaclass derives from ABCMeta
+    @abstractmethod
+    def process_batch(self, cursor: Optional[Any]) -> Optional[Any]:
+        pass
+
+    def with_task_options(self, options: TaskOptions) -> "ResumableTask":
+        """Return a copy of the task keeping the options it's deferred with."""
+        return self.copy(
+            update={
+                "task_options": TaskOptions.parse_obj(
+                    options.dict(include=_CONTINUATION_OPTIONS)
+                )
+            }
+        )
+
+    def run(self):
+        # Inline import to support importing this module before Django is initialized
+        from .models import TaskCheckpoint
+
+        key = self.checkpoint_key or task_name()
+        checkpoint = TaskCheckpoint.objects.filter(key=key).first() if key else None
+        cursor = checkpoint.cursor if checkpoint else None
+        if cursor is not None:
+            _logger.info("Resuming task from checkpoint", key=key, cursor=cursor)
+
+        deadline = time.monotonic() + self.time_budget
+        while True:
+            with transaction.atomic():
+                cursor = self.process_batch(cursor)
+                if cursor is None:
+                    if key:
+                        TaskCheckpoint.objects.filter(key=key).delete()
+                    return
+
+                # Nothing would ever resume from a checkpoint without a stable
+                # key, so none is left behind
+                if key:
+                    TaskCheckpoint.objects.update_or_create(
+                        key=key,
+                        defaults={"cursor": cursor},
+                    )
+
+            if time.monotonic() >= deadline:
+                break
+
+        _logger.info(
+            "Task out of time, continuing in a new task", key=key, cursor=cursor
+        )
+        with transaction.atomic():
+            options = (self.task_options or TaskOptions()).copy()
+            if not key:
+                # The continuation reads the cursor from a new checkpoint, both
+                # are committed together through the outbox
+                key = uuid.uuid4().hex
+                TaskCheckpoint.objects.create(key=key, cursor=cursor)
+                options.outbox = True
+
+            # Named after the checkpoint, so a retry of this request running
+            # out of time at the same cursor doesn't defer a second
+            # continuation
+            digest = hashlib.sha256(
+                "{0}:{1}".format(
+                    key, json.dumps(cursor, sort_keys=True, cls=DjangoJSONEncoder)
+                ).encode()
+            ).hexdigest()[:32]
+            options.name = "resume-{0}".format(digest)
+            defer(self.copy(update={"checkpoint_key": key}), options)
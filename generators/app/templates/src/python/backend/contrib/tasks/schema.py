@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional
 
-from pydantic import BaseModel, conint, validator
+from pydantic import BaseModel, confloat, conint, validator
 
 from .environment import gae_version
 
@@ -28,6 +28,15 @@ class TaskOptions(BaseModel):
     handler_url: str = _DEFAULT_HANDLER_NAME
     extra_task_headers: dict = {}
     queue: str = _DEFAULT_QUEUE
+    # Name the task after its type and arguments (unless a name is given), so
+    # duplicates are dropped locally or rejected by Cloud Tasks
+    idempotent: bool = False
+    # Collapse all defers of the same task (type and arguments) within a
+    # window of this many seconds into a single run at the end of the window
+    coalesce_window: Optional[conint(gt=0)]
+    # Write the task to the outbox table (in the current transaction, if any)
+    # and leave enqueuing it to the outbox dispatcher, see outbox.py
+    outbox: bool = False
 
     @validator("using")
     def using_has_valid_connection_name(cls, v):
@@ -41,3 +50,38 @@ class TaskOptions(BaseModel):
             )
 
         return v
+
+
+class DeferResult(BaseModel):
+    """The outcome of enqueuing a single task with defer_many().
+
+    success is None while the task is waiting for its transaction to commit.
+    duplicate is True if an idempotent task was dropped because it had
+    recently been enqueued.
+    """
+
+    name: Optional[str] = None
+    success: Optional[bool] = None
+    duplicate: bool = False
+    error: Optional[Exception] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+
+class QueueOptions(BaseModel):
+    """Dispatch settings of an emulated queue.
+
+    These mirror the rate limits and retry config of a Cloud Tasks queue, so
+    queue settings can be tuned locally before they are applied in production.
+    By default tasks are dispatched one at a time, without any rate limit, and
+    failed tasks are not retried.
+    """
+
+    max_concurrent_dispatches: conint(gt=0) = 1
+    max_dispatches_per_second: Optional[confloat(gt=0)] = None
+    max_burst_size: Optional[conint(gt=0)] = None
+    max_attempts: conint(gt=0) = 1
+    min_backoff: confloat(ge=0) = 0.1
+    max_backoff: confloat(ge=0) = 3600
+    max_doublings: conint(ge=0) = 16
@@ -0,0 +1,233 @@
+"""Task payload codecs.
+
+Every payload starts with a header byte: the low nibble identifies the codec
+that encoded the task, the high nibble the compression applied on top of it.
+Headers never collide with the first byte of a pickle (0x80), so payloads
+enqueued before codecs were introduced are still decoded as raw pickles.
+"""
+import functools
+import importlib
+import json
+import pickle
+import zlib
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Dict, List, Optional
+
+from pydantic import BaseModel
+from structlog.stdlib import get_logger
+
+from . import metrics
+from .registry import get_task_id, get_task_type
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+_logger = get_logger(__name__)
+
+_LEGACY_PICKLE_HEADER = 0x80
+_COMPRESSION_THRESHOLD = 1024
+
+_COMPRESSION_NONE = 0
+_COMPRESSION_ZLIB = 1
+_COMPRESSION_ZSTD = 2
+
+
+class PayloadDecodeError(Exception):
+    """Raised when a payload cannot be decoded."""
+
+
+class Codec(ABC):
+    """Base class for task payload codecs."""
+
+    format_id: int
+    name: str
+
+    @abstractmethod
+    def encode(self, obj: object) -> Optional[bytes]:
+        """Return the encoded task, or None if this codec can't encode it."""
+
+    @abstractmethod
+    def decode(self, data: bytes) -> object:
+        pass
+
+
+class PickleCodec(Codec):
+    """Fallback codec, able to encode any picklable task."""
+
+    format_id = 1
+    name = "pickle"
+
+    def encode(self, obj: object) -> Optional[bytes]:
+        return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data: bytes) -> object:
+        return pickle.loads(data)
+
+
+@functools.lru_cache(maxsize=None)
+def _resolve_type(type_ref: str) -> type:
+    module_name, _, qualname = type_ref.partition(":")
+    obj = importlib.import_module(module_name)
+    for attr in qualname.split("."):
+        obj = getattr(obj, attr)
+    return obj
+
+
+class PydanticJsonCodec(Codec):
+    """Encode pydantic tasks as their type reference and field values."""
+
+    format_id = 2
+    name = "json"
+
+    def type_ref(self, klass: type) -> Optional[str]:
+        type_ref = "{0}:{1}".format(klass.__module__, klass.__qualname__)
+        try:
+            if _resolve_type(type_ref) is klass:
+                return type_ref
+        except (ImportError, AttributeError):
+            pass
+
+        # Locally defined or parametrized generic classes can't be imported
+        return None
+
+    def encode(self, obj: object) -> Optional[bytes]:
+        if not isinstance(obj, BaseModel):
+            return None
+
+        type_ref = self.type_ref(obj.__class__)
+        if not type_ref:
+            return None
+
+        try:
+            fields = obj.json()
+        except TypeError:
+            # A field isn't JSON serializable (e.g. a function)
+            return None
+
+        return '{{"t":{0},"f":{1}}}'.format(json.dumps(type_ref), fields).encode()
+
+    def decode(self, data: bytes) -> object:
+        payload = json.loads(data)
+        return _resolve_type(payload["t"]).parse_obj(payload["f"])
+
+
+class RegistryCodec(Codec):
+    """Encode registered tasks as their registry ID and field values."""
+
+    format_id = 3
+    name = "registry"
+
+    def encode(self, obj: object) -> Optional[bytes]:
+        task_id = get_task_id(obj.__class__)
+        if not task_id:
+            return None
+
+        try:
+            fields = obj.json()
+        except TypeError:
+            # A field isn't JSON serializable, fall back to another codec
+            return None
+
+        return '{{"r":{0},"f":{1}}}'.format(json.dumps(task_id), fields).encode()
+
+    def decode(self, data: bytes) -> object:
+        payload = json.loads(data)
+        klass = get_task_type(payload["r"])
+        if not klass:
+            raise PayloadDecodeError("Unknown task {0}".format(payload["r"]))
+
+        return klass.parse_obj(payload["f"])
+
+
+_CODECS: List[Codec] = [RegistryCodec(), PydanticJsonCodec(), PickleCodec()]
+_CODECS_BY_FORMAT: Dict[int, Codec] = {codec.format_id: codec for codec in _CODECS}
+
+
+def register_codec(codec: Codec):
+    """Register a codec, tried before the ones already registered."""
+    assert 0 < codec.format_id < 0x10, "Codec format IDs must fit in 4 bits."
+    assert codec.format_id not in _CODECS_BY_FORMAT, "Duplicate codec format ID."
+
+    _CODECS.insert(0, codec)
+    _CODECS_BY_FORMAT[codec.format_id] = codec
+
+
+def _compress(data: bytes):
+    if len(data) < _COMPRESSION_THRESHOLD:
+        return _COMPRESSION_NONE, data
+
+    if zstandard:
+        compression, compressed = _COMPRESSION_ZSTD, zstandard.compress(data)
+    else:
+        compression, compressed = _COMPRESSION_ZLIB, zlib.compress(data)
+
+    if len(compressed) >= len(data):
+        return _COMPRESSION_NONE, data
+    return compression, compressed
+
+
+def _decompress(compression: int, data: bytes) -> bytes:
+    if compression == _COMPRESSION_NONE:
+        return data
+    if compression == _COMPRESSION_ZLIB:
+        return zlib.decompress(data)
+    if compression == _COMPRESSION_ZSTD and zstandard:
+        return zstandard.decompress(data)
+
+    raise PayloadDecodeError("Unsupported compression {0}".format(compression))
+
+
+def encode(obj: object) -> bytes:
+    """Encode a task with the first codec able to handle it."""
+    for codec in _CODECS:
+        data = codec.encode(obj)
+        if data is not None:
+            break
+    else:
+        raise TypeError("No codec can encode {0!r}".format(obj))
+
+    compression, compressed = _compress(data)
+    task_class = obj.__class__.__qualname__
+
+    metrics.observe_encoded(task_class, codec.name, len(data), len(compressed) + 1)
+    _logger.debug(
+        "task_payload_encoded",
+        task_class=task_class,
+        codec=codec.name,
+        compression=compression,
+        raw_bytes=len(data),
+        encoded_bytes=len(compressed) + 1,
+    )
+
+    return bytes((compression << 4 | codec.format_id,)) + compressed
+
+
+def decode(data: bytes) -> object:
+    """Decode a task encoded by encode() (or a raw pickle)."""
+    if not data:
+        raise PayloadDecodeError("Empty payload")
+
+    header = data[0]
+    if header == _LEGACY_PICKLE_HEADER:
+        return pickle.loads(data)
+
+    codec = _CODECS_BY_FORMAT.get(header & 0x0F)
+    if not codec:
+        raise PayloadDecodeError("Unknown payload format {0}".format(header))
+
+    return codec.decode(_decompress(header >> 4, data[1:]))
+
+
+def decode_stream(stream: BinaryIO) -> object:
+    """Decode a task from a file object.
+
+    Uncompressed pickles are unpickled straight from the stream, anything else
+    is read in full first.
+    """
+    header = stream.read(1)
+    if header and header[0] == PickleCodec.format_id:
+        return pickle.load(stream)
+
+    return decode(header + stream.read())
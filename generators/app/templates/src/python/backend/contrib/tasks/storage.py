@@ -0,0 +1,289 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import BinaryIO, Iterator, Optional
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+_DEFAULT_BACKEND = "backend.contrib.tasks.storage.DatabasePayloadStore"
+_DEFAULT_CHUNK_SIZE = 512 * 1024
+
+# Cloud Tasks keeps tasks for at most 31 days, any payload older than that
+# can't be referenced by a task anymore.
+_DEFAULT_RETENTION = timedelta(days=31)
+
+
+class PayloadNotFound(Exception):
+    """Raised when a payload is not (or no longer) in the store."""
+
+
+class _ChunkReader(io.RawIOBase):
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._buffer = b""
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        self.bytes_read += n
+        return n
+
+
+class PayloadStore(ABC):
+    """Content-addressed storage for task payloads too large for Cloud Tasks.
+
+    Payloads are keyed by their SHA-256 digest, so storing the same payload
+    twice only adds a reference to it. Each task references the payload by a
+    key of its own and releases that reference once it's done, which makes
+    releasing idempotent when a task is delivered more than once. The payload
+    is deleted when no references are left. Payloads that are never released
+    are deleted by sweep() once expired.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = _DEFAULT_CHUNK_SIZE,
+        retention: timedelta = _DEFAULT_RETENTION,
+    ):
+        self.chunk_size = chunk_size
+        self.retention = retention
+
+    @abstractmethod
+    def put(self, data: bytes, reference: str) -> str:
+        """Store the payload (or add a reference to it), return its digest."""
+
+    @abstractmethod
+    def iter_chunks(self, digest: str) -> Iterator[bytes]:
+        pass
+
+    @abstractmethod
+    def release(self, digest: str, reference: str):
+        """Drop a reference to the payload, deleting it if it was the last.
+
+        Releasing a reference that's already gone does nothing.
+        """
+
+    @abstractmethod
+    def sweep(self, now: Optional[datetime] = None) -> int:
+        """Delete expired and orphaned payloads, return how many were deleted."""
+
+    def open(self, digest: str) -> BinaryIO:
+        """Return a file object streaming the payload chunk by chunk."""
+        return io.BufferedReader(_ChunkReader(self.iter_chunks(digest)))
+
+    def read(self, digest: str) -> bytes:
+        return b"".join(self.iter_chunks(digest))
+
+    def _digest(self, data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def _expires_at(self) -> datetime:
+        return timezone.now() + self.retention
+
+
+class DatabasePayloadStore(PayloadStore):
+    """Store payloads in the database, split over PayloadChunk rows."""
+
+    def _add_reference(self, digest: str, reference: str, expires_at: datetime):
+        # Inline import to support importing this module before Django is initialized
+        from .models import PayloadBlob, PayloadReference
+
+        # Updating the blob locks it against a concurrent release() deleting it
+        if not PayloadBlob.objects.filter(digest=digest).update(expires_at=expires_at):
+            return False
+
+        PayloadReference.objects.create(key=reference, blob_id=digest)
+        return True
+
+    def put(self, data: bytes, reference: str) -> str:
+        from .models import PayloadBlob, PayloadChunk, PayloadReference
+
+        digest = self._digest(data)
+        expires_at = self._expires_at()
+
+        try:
+            with transaction.atomic():
+                if self._add_reference(digest, reference, expires_at):
+                    return digest
+
+                blob = PayloadBlob.objects.create(
+                    digest=digest,
+                    size=len(data),
+                    expires_at=expires_at,
+                )
+                chunks = []
+                for offset in range(0, len(data), self.chunk_size):
+                    end = offset + self.chunk_size
+                    chunks.append(data[offset:end])
+                PayloadChunk.objects.bulk_create(
+                    PayloadChunk(blob=blob, index=i, data=chunk)
+                    for i, chunk in enumerate(chunks)
+                )
+                PayloadReference.objects.create(key=reference, blob=blob)
+        except IntegrityError:
+            # The same payload was stored concurrently, reference that one
+            with transaction.atomic():
+                if not self._add_reference(digest, reference, expires_at):
+                    raise
+
+        return digest
+
+    def iter_chunks(self, digest: str) -> Iterator[bytes]:
+        from .models import PayloadBlob, PayloadChunk
+
+        if not PayloadBlob.objects.filter(digest=digest).exists():
+            raise PayloadNotFound(digest)
+
+        # Fetch chunks one at a time through a server-side cursor
+        chunks = (
+            PayloadChunk.objects.filter(blob_id=digest)
+            .order_by("index")
+            .values_list("data", flat=True)
+            .iterator(chunk_size=1)
+        )
+        return (bytes(chunk) for chunk in chunks)
+
+    def release(self, digest: str, reference: str):
+        from .models import PayloadBlob, PayloadReference
+
+        with transaction.atomic():
+            # Lock the blob, so no reference is added while it's being deleted
+            if not PayloadBlob.objects.select_for_update().filter(digest=digest):
+                return
+
+            deleted, _ = PayloadReference.objects.filter(
+                key=reference, blob_id=digest
+            ).delete()
+            if deleted and not PayloadReference.objects.filter(blob_id=digest).exists():
+                PayloadBlob.objects.filter(digest=digest).delete()
+
+    def sweep(self, now: Optional[datetime] = None) -> int:
+        from .models import PayloadBlob
+
+        _, deleted = PayloadBlob.objects.filter(
+            Q(expires_at__lte=now or timezone.now()) | Q(references__isnull=True)
+        ).delete()
+        return deleted.get(PayloadBlob._meta.label, 0)
+
+
+class FileSystemPayloadStore(PayloadStore):
+    """Store payloads as files in a local directory (for development and tests).
+
+    Each payload is stored as <digest>.bin next to a <digest>.json file holding
+    its references and expiry time.
+    """
+
+    def __init__(self, root: str, **kwargs):
+        super().__init__(**kwargs)
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.root, "{0}.{1}".format(digest, ext))
+
+    def _read_meta(self, digest: str) -> Optional[dict]:
+        try:
+            with open(self._path(digest, "json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self, digest: str, meta: dict):
+        with open(self._path(digest, "json"), "w") as f:
+            json.dump(meta, f)
+
+    def _delete(self, digest: str):
+        for ext in ("bin", "json"):
+            try:
+                os.remove(self._path(digest, ext))
+            except FileNotFoundError:
+                pass
+
+    def put(self, data: bytes, reference: str) -> str:
+        digest = self._digest(data)
+
+        with self._lock:
+            meta = self._read_meta(digest)
+            if meta is None:
+                meta = {"references": []}
+                with open(self._path(digest, "bin"), "wb") as f:
+                    f.write(data)
+
+            meta["references"].append(reference)
+            meta["expires_at"] = self._expires_at().isoformat()
+            self._write_meta(digest, meta)
+
+        return digest
+
+    def iter_chunks(self, digest: str) -> Iterator[bytes]:
+        try:
+            f = open(self._path(digest, "bin"), "rb")
+        except FileNotFoundError:
+            raise PayloadNotFound(digest)
+
+        def chunks():
+            with f:
+                while chunk := f.read(self.chunk_size):
+                    yield chunk
+
+        return chunks()
+
+    def release(self, digest: str, reference: str):
+        with self._lock:
+            meta = self._read_meta(digest)
+            if meta is None or reference not in meta["references"]:
+                return
+
+            meta["references"].remove(reference)
+            if not meta["references"]:
+                self._delete(digest)
+            else:
+                self._write_meta(digest, meta)
+
+    def sweep(self, now: Optional[datetime] = None) -> int:
+        now = now or timezone.now()
+        deleted = 0
+
+        with self._lock:
+            for filename in os.listdir(self.root):
+                digest, ext = os.path.splitext(filename)
+                if ext != ".json":
+                    continue
+
+                meta = self._read_meta(digest)
+                if meta is None:
+                    continue
+
+                expires_at = datetime.fromisoformat(meta["expires_at"])
+                if expires_at <= now or not meta["references"]:
+                    self._delete(digest)
+                    deleted += 1
+
+        return deleted
+
+
+def get_payload_store() -> PayloadStore:
+    """Return the payload store configured by settings.TASKS_PAYLOAD_STORE."""
+    config = getattr(settings, "TASKS_PAYLOAD_STORE", {})
+    store_class = import_string(config.get("BACKEND", _DEFAULT_BACKEND))
+    return store_class(**config.get("OPTIONS", {}))
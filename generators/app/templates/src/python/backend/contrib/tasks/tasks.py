@@ -1,11 +1,21 @@
+import asyncio
 import functools
-import pickle
+import hashlib
+import json
+import re
+import threading
+import time
 import uuid
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any, Optional
+from datetime import timezone as dt_timezone
+from typing import Any, Iterable, List, Optional, Tuple
 from urllib.parse import unquote
 
 import structlog
+from asgiref.sync import sync_to_async
 from django.db import connections
 from django.urls import reverse
 from django.utils import timezone
@@ -13,15 +23,25 @@ from google.api_core import exceptions
 from google.cloud import tasks_v2
 from google.protobuf.timestamp_pb2 import Timestamp
 
+from . import metrics, serialization
 from .environment import google_cloud_project, tasks_location
-from .schema import TaskOptions
+from .schema import DeferResult, TaskOptions
+from .storage import PayloadNotFound, get_payload_store
 
 _logger = structlog.get_logger(__name__)
 
 
 _TASKQUEUE_HEADERS = {"Content-Type": "application/octet-stream"}
+_CREATED_AT_HEADER = "X-Task-Created-At"
 _CLOUD_TASKS_PROJECT = google_cloud_project()
 _CLOUD_TASKS_LOCATION = tasks_location()
+_DEFAULT_MAX_CONCURRENT_CREATES = 16
+_TASK_NAME_MAX_LENGTH = 500
+_INVALID_TASK_NAME_CHARACTERS = re.compile(r"[^A-Za-z0-9_-]")
+_RECENT_TASK_NAMES_TTL = 10 * 60
+_RECENT_TASK_NAMES_MAX_SIZE = 10000
+
+_async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
 
 
 class TaskError(Exception):
@@ -32,35 +52,61 @@ class PermanentTaskError(TaskError):
     """Indicates that a task failed, and will never succeed."""
 
 
-def _run_from_database(deferred_task_id):
-    """Retrieve a task from the database and execute it."""
-
-    def run(data):
-        # Unpickle and execute task.
-        try:
-            service_instance = pickle.loads(data)
-        except Exception as e:
-            raise PermanentTaskError(e)
-        else:
-            return service_instance.run()
+def _run_from_store(digest: str, reference: Optional[str]):
+    """Retrieve a task from the payload store and execute it."""
+    store = get_payload_store()
 
-    # Inline import to support importing this module before Django is initialized
-    from .models import LargeDeferredTask
+    def release():
+        # Payloads of tasks without a reference are left for sweep()
+        if reference:
+            store.release(digest, reference)
 
-    entity = LargeDeferredTask.objects.filter(pk=deferred_task_id).first()
-    if not entity:
+    try:
+        with store.open(digest) as stream:
+            service_instance = serialization.decode_stream(stream)
+            payload_bytes = stream.raw.bytes_read
+    except PayloadNotFound:
         raise PermanentTaskError()
+    except Exception as e:
+        release()
+        raise PermanentTaskError(e)
+
+    execution = metrics.current_execution()
+    if execution:
+        # Report the stored task rather than the stand-in
+        execution.task_class = service_instance.__class__.__qualname__
+        execution.payload_bytes = payload_bytes
 
     try:
-        run(entity.data)
-        entity.delete()
+        service_instance.run()
+        release()
     except PermanentTaskError:
-        entity.delete()
+        release()
         raise
 
 
+class _DeferredFromStore:
+    """Task body standing in for a payload too large for Cloud Tasks."""
+
+    # Unset on tasks stored before references were tracked per task
+    reference: Optional[str] = None
+
+    def __init__(self, digest: str, reference: str):
+        self.digest = digest
+        self.reference = reference
+
+    def run(self):
+        return _run_from_store(self.digest, self.reference)
+
+
 def _serialize(obj: object):
-    return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    return serialization.encode(obj)
+
+
+def _sanitize_task_name(name: str) -> str:
+    # Cloud Tasks names may only contain letters, numbers, underscores and
+    # hyphens
+    return _INVALID_TASK_NAME_CHARACTERS.sub("-", name)[:_TASK_NAME_MAX_LENGTH]
 
 
 def _get_task_name(obj: Any, task_created_at: datetime) -> str:
@@ -76,21 +122,115 @@ def _get_task_name(obj: Any, task_created_at: datetime) -> str:
     else:
         name = "{0}:{1}-{2}".format(klass.__qualname__, task_created_at, task_id)
 
-    return name
+    return _sanitize_task_name(name)
 
 
-def _schedule_task(pickled_data: bytes, task_options: TaskOptions):
-    client = tasks_v2.CloudTasksClient()
-    deferred_task = None
+def _get_idempotent_task_name(
+    obj: Any,
+    pickled_data: bytes,
+    bucket: Optional[int] = None,
+) -> str:
+    """Derive a deterministic task name from the task type and arguments."""
+    klass = obj.__class__
+    type_name = "{0}.{1}".format(klass.__module__, klass.__qualname__)
+    digest = hashlib.sha256(type_name.encode() + pickled_data).hexdigest()[:32]
+    if bucket is not None:
+        digest = "{0}-{1}".format(digest, bucket)
+
+    # The hash comes first: Cloud Tasks recommends against sequential prefixes
+    return _sanitize_task_name("{0}-{1}".format(digest, type_name))
+
+
+def _coalesce(obj: Any, pickled_data: bytes, task_options: TaskOptions):
+    """Name and schedule the task after the coalesce window it falls in."""
+    window = task_options.coalesce_window
+    bucket = int(timezone.now().timestamp()) // window
+
+    task_options.idempotent = True
+    task_options.name = _get_idempotent_task_name(obj, pickled_data, bucket)
+    task_options.countdown = None
+    task_options.eta = datetime.fromtimestamp(
+        (bucket + 1) * window,
+        tz=dt_timezone.utc,
+    )
+
+
+class _RecentTaskNames:
+    """Names of the tasks recently enqueued by this process."""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.names: "OrderedDict[str, float]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __evict(self, now: float):
+        while self.names:
+            name, expires_at = next(iter(self.names.items()))
+            if expires_at > now and len(self.names) <= self.max_size:
+                break
+            del self.names[name]
+
+    def __contains__(self, name: str) -> bool:
+        with self.lock:
+            self.__evict(time.monotonic())
+            return name in self.names
+
+    def add(self, name: str):
+        with self.lock:
+            now = time.monotonic()
+            self.names.pop(name, None)
+            self.names[name] = now + self.ttl
+            self.__evict(now)
+
+
+_recent_task_names = _RecentTaskNames(
+    _RECENT_TASK_NAMES_TTL,
+    _RECENT_TASK_NAMES_MAX_SIZE,
+)
+
+# Set whenever tasks are committed to the outbox, wakes up the dispatcher thread
+_outbox_wakeup = threading.Event()
+
+
+@functools.lru_cache(maxsize=None)
+def _get_client() -> tasks_v2.CloudTasksClient:
+    """Return the process-wide Cloud Tasks client.
+
+    Constructing a client opens a new gRPC channel, so a single (thread-safe)
+    instance is shared by every enqueue in the process.
+    """
+    return tasks_v2.CloudTasksClient()
+
 
-    path = client.queue_path(
+def _get_async_client() -> tasks_v2.CloudTasksAsyncClient:
+    """Return the Cloud Tasks async client for the running event loop.
+
+    Async gRPC channels are bound to the loop they were created on, so one
+    client is shared per event loop rather than per process.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = tasks_v2.CloudTasksAsyncClient()
+    return client
+
+
+def _task_headers(task_options: TaskOptions) -> dict:
+    headers = dict(_TASKQUEUE_HEADERS)
+    headers[_CREATED_AT_HEADER] = "{0:.6f}".format(task_options.created_at.timestamp())
+    headers.update(task_options.extra_task_headers)
+    return headers
+
+
+def _build_task(pickled_data: bytes, task_options: TaskOptions) -> Tuple[str, dict]:
+    path = tasks_v2.CloudTasksClient.queue_path(
         _CLOUD_TASKS_PROJECT,
         _CLOUD_TASKS_LOCATION,
         task_options.queue,
     )
 
-    task_headers = dict(_TASKQUEUE_HEADERS)
-    task_headers.update(task_options.extra_task_headers)
+    task_headers = _task_headers(task_options)
 
     schedule_time = task_options.eta
     if task_options.countdown:
@@ -121,77 +261,304 @@ def _schedule_task(pickled_data: bytes, task_options: TaskOptions):
         },
     }
 
+    return path, task
+
+
+def _is_task_too_large(e: exceptions.InvalidArgument, task_options: TaskOptions):
+    # Fallback to the payload store unless this has been explicitly marked as
+    # a small task
+    return "Task size too large" in str(e) and not task_options.small_task
+
+
+def _store_large_task(pickled_data: bytes) -> Tuple[str, str, bytes]:
+    """Store a task payload, return its digest, the reference held by the task
+    running it and the body of that task."""
+    reference = uuid.uuid4().hex
+    digest = get_payload_store().put(pickled_data, reference)
+
+    # Replace the task body with one containing a function to run the
+    # original task body which is stored in the payload store.
+    return digest, reference, _serialize(_DeferredFromStore(digest, reference))
+
+
+def _schedule_task(pickled_data: bytes, task_options: TaskOptions):
+    client = _get_client()
+    path, task = _build_task(pickled_data, task_options)
+
     try:
         # Defer the task
-        task = client.create_task(parent=path, task=task)  # FIXME: Handle transactional
-
-        # Delete the key as it wasn't needed
-        if deferred_task:
-            deferred_task.delete()
+        client.create_task(parent=path, task=task)
+    except exceptions.AlreadyExists:
+        _logger.info("Task already exists", task_name=task_options.name)
     except exceptions.InvalidArgument as e:
-        if "Task size too large" not in str(e):
+        if not _is_task_too_large(e, task_options):
             raise
 
-        # Create a db entity unless this has been explicitly marked as a small task
-        if task_options.small_task:
-            raise
+        digest, reference, body = _store_large_task(pickled_data)
+        task["app_engine_http_request"]["body"] = body
 
-        # Inline import to support importing this module before Django is initialized
-        from .models import LargeDeferredTask
+        try:
+            client.create_task(parent=path, task=task)
+        except exceptions.AlreadyExists:
+            get_payload_store().release(digest, reference)
+        except:  # noqa
+            # Any other exception? Release the payload
+            get_payload_store().release(digest, reference)
+            raise
 
-        deferred_task = LargeDeferredTask.objects.create(data=pickled_data)
 
-        # Replace the task body with one containing a function to run the
-        # original task body which is stored in the datastore entity.
-        task["body"] = _serialize(_run_from_database, deferred_task.pk)
+async def _schedule_task_async(pickled_data: bytes, task_options: TaskOptions):
+    client = _get_async_client()
+    path, task = _build_task(pickled_data, task_options)
 
-        client.create_task(path, task)  # FIXME: Handle transactional
-    except:  # noqa
-        # Any other exception? Delete the key
-        if deferred_task:
-            deferred_task.delete()
-        raise
+    try:
+        # Defer the task
+        await client.create_task(parent=path, task=task)
+    except exceptions.AlreadyExists:
+        _logger.info("Task already exists", task_name=task_options.name)
+    except exceptions.InvalidArgument as e:
+        if not _is_task_too_large(e, task_options):
+            raise
 
+        digest, reference, body = await sync_to_async(_store_large_task)(pickled_data)
+        task["app_engine_http_request"]["body"] = body
 
-def defer(obj: object, task_options: Optional[TaskOptions] = None):
-    """
-    This is a reimplementation of the defer() function that historically shipped
-    with App Engine Standard before the Python 3 runtime.
+        try:
+            await client.create_task(parent=path, task=task)
+        except exceptions.AlreadyExists:
+            await sync_to_async(get_payload_store().release)(digest, reference)
+        except:  # noqa
+            # Any other exception? Release the payload
+            await sync_to_async(get_payload_store().release)(digest, reference)
+            raise
 
-    It fixes a number of bugs in that implementation, but has some subtle
-    differences. In particular, the _transactional flag is not entirely atomic
-    - deferred tasks will run on successful commit, but they're not *guaranteed*
-    to run if there is an error submitting them.
 
-    If the task is too large to be serialized and passed in the request it uses
-    a Django model instance to tempoarilly store the payload. The small task
-    limit is 100K.
-    """
+def _prepare_task(
+    obj: object,
+    task_options: Optional[TaskOptions],
+    created_at: datetime,
+) -> Tuple[bytes, TaskOptions]:
     assert callable(getattr(obj, "run")), "Task 'obj' must have a run() method."
 
+    # Inline import, resumable.py imports this module
+    from .resumable import ResumableTask
+
     task_options = task_options.copy() if task_options else TaskOptions()
+    if isinstance(obj, ResumableTask):
+        obj = obj.with_task_options(task_options)
+    pickled = _serialize(obj)
 
     # Populate task name unless custom name given
-    created_at = datetime.now()
     task_options.created_at = task_options.created_at or created_at
+    if not task_options.name and task_options.coalesce_window:
+        _coalesce(obj, pickled, task_options)
+    if not task_options.name and task_options.idempotent:
+        task_options.name = _get_idempotent_task_name(obj, pickled)
     task_options.name = task_options.name or _get_task_name(
         obj,
         task_options.created_at,
     )
 
+    return pickled, task_options
+
+
+def _is_duplicate(task_options: TaskOptions) -> bool:
+    if task_options.idempotent and task_options.name in _recent_task_names:
+        _logger.info("Dropping duplicate task", task_name=task_options.name)
+        return True
+    return False
+
+
+def _schedule_once(pickled_data: bytes, task_options: TaskOptions) -> bool:
+    """Schedule the task unless it was recently enqueued (if idempotent).
+
+    Return False if the task was dropped as a duplicate.
+    """
+    if _is_duplicate(task_options):
+        return False
+
+    _schedule_task(pickled_data, task_options)
+
+    if task_options.idempotent:
+        _recent_task_names.add(task_options.name)
+    return True
+
+
+async def _schedule_once_async(pickled_data: bytes, task_options: TaskOptions):
+    if _is_duplicate(task_options):
+        return False
+
+    await _schedule_task_async(pickled_data, task_options)
+
+    if task_options.idempotent:
+        _recent_task_names.add(task_options.name)
+    return True
+
+
+def _is_transactional(task_options: TaskOptions) -> bool:
     # Determine if we run the task at the end of the current transaction
     connection = connections[task_options.using]
-    task_options.transactional = (
+    return (
         task_options.transactional
         if task_options.transactional is not None
         else connection.in_atomic_block
     )
 
-    pickled = _serialize(obj)
 
-    if task_options.transactional:
+def _add_to_outbox(tasks: List[Tuple[bytes, TaskOptions]]):
+    # Inline import to support importing this module before Django is initialized
+    from .models import OutboxTask
+
+    using = tasks[0][1].using
+    entries = []
+    for pickled, task_options in tasks:
+        task_options = task_options.copy()
+        if task_options.countdown:
+            # The countdown starts now, not when the task is dispatched
+            task_options.eta = timezone.now() + timedelta(
+                seconds=task_options.countdown,
+            )
+            task_options.countdown = None
+        task_options.outbox = False
+        task_options.transactional = False
+
+        entries.append(
+            OutboxTask(payload=pickled, options=json.loads(task_options.json()))
+        )
+
+    OutboxTask.objects.using(using).bulk_create(entries)
+    connections[using].on_commit(_outbox_wakeup.set)
+
+
+def defer(obj: object, task_options: Optional[TaskOptions] = None):
+    """
+    This is a reimplementation of the defer() function that historically shipped
+    with App Engine Standard before the Python 3 runtime.
+
+    It fixes a number of bugs in that implementation, but has some subtle
+    differences. In particular, the _transactional flag is not entirely atomic
+    - deferred tasks will run on successful commit, but they're not *guaranteed*
+    to run if there is an error submitting them.
+
+    If the task is too large to be serialized and passed in the request it uses
+    the payload store (see storage.py) to temporarily store the payload. The
+    small task limit is 100K.
+
+    Idempotent tasks (see TaskOptions.idempotent) are named after their type
+    and arguments, so deferring the same task twice only enqueues it once.
+    With TaskOptions.coalesce_window, the same holds within each window and
+    the task runs once the window ends.
+
+    With TaskOptions.outbox, the task is written to the outbox table instead,
+    atomically with the current transaction, and enqueued by the outbox
+    dispatcher (see outbox.py).
+    """
+    pickled, task_options = _prepare_task(obj, task_options, datetime.now())
+    task_options.transactional = _is_transactional(task_options)
+
+    if task_options.outbox:
+        _add_to_outbox([(pickled, task_options)])
+    elif task_options.transactional:
         # Django connections have an on_commit message that run things on
         # post-commit.
-        connection.on_commit(functools.partial(_schedule_task, pickled, task_options))
+        connection = connections[task_options.using]
+        connection.on_commit(functools.partial(_schedule_once, pickled, task_options))
+    else:
+        _schedule_once(pickled, task_options)
+
+
+async def defer_async(obj: object, task_options: Optional[TaskOptions] = None):
+    """Awaitable version of defer() for async views and asyncio fan-outs.
+
+    The task is created with the Cloud Tasks async client so the event loop is
+    free while the RPC is in flight. Transactional tasks are still submitted
+    by the synchronous path once the transaction commits.
+    """
+    pickled, task_options = _prepare_task(obj, task_options, datetime.now())
+    task_options.transactional = _is_transactional(task_options)
+
+    if task_options.outbox:
+        await sync_to_async(_add_to_outbox)([(pickled, task_options)])
+    elif task_options.transactional:
+        connection = connections[task_options.using]
+        connection.on_commit(functools.partial(_schedule_once, pickled, task_options))
     else:
-        _schedule_task(pickled, task_options)
+        await _schedule_once_async(pickled, task_options)
+
+
+def _schedule_many(
+    tasks: List[Tuple[bytes, TaskOptions]],
+    results: List[DeferResult],
+    max_concurrency: int,
+):
+    def schedule(pickled: bytes, task_options: TaskOptions, result: DeferResult):
+        try:
+            result.duplicate = not _schedule_once(pickled, task_options)
+        except Exception as e:
+            _logger.exception("Failed to enqueue task", task_name=task_options.name)
+            result.success = False
+            result.error = e
+        else:
+            result.success = True
+
+    def schedule_in_thread(*args):
+        try:
+            schedule(*args)
+        finally:
+            # Worker threads get their own DB connections (used by the large
+            # task fallback), close them before the thread is recycled
+            connections.close_all()
+
+    if max_concurrency <= 1 or len(tasks) <= 1:
+        for (pickled, task_options), result in zip(tasks, results):
+            schedule(pickled, task_options, result)
+        return
+
+    with ThreadPoolExecutor(
+        max_workers=min(max_concurrency, len(tasks)),
+        thread_name_prefix="defer-many",
+    ) as executor:
+        for (pickled, task_options), result in zip(tasks, results):
+            executor.submit(schedule_in_thread, pickled, task_options, result)
+
+
+def defer_many(
+    objs: Iterable[object],
+    task_options: Optional[TaskOptions] = None,
+    max_concurrency: int = _DEFAULT_MAX_CONCURRENT_CREATES,
+) -> List[DeferResult]:
+    """Defer a batch of tasks sharing the same task options.
+
+    Tasks are created over the shared Cloud Tasks client with at most
+    max_concurrency requests in flight. A failure to enqueue one task does not
+    prevent the others from being enqueued; the outcome of each task is
+    reported in the returned list, in the same order as objs.
+
+    If the tasks are transactional, the whole batch is submitted once the
+    transaction commits and the results are filled in at that point (success
+    is None until then). Nothing is submitted if the transaction rolls back.
+    Outbox tasks are written to the outbox table in a single insert and their
+    success stays None.
+    """
+    created_at = datetime.now()
+    tasks = [_prepare_task(obj, task_options, created_at) for obj in objs]
+    results = [DeferResult(name=options.name) for _, options in tasks]
+
+    if not tasks:
+        return results
+
+    if tasks[0][1].outbox:
+        _add_to_outbox(tasks)
+        return results
+
+    transactional = _is_transactional(tasks[0][1])
+    for _, options in tasks:
+        options.transactional = transactional
+
+    schedule = functools.partial(_schedule_many, tasks, results, max_concurrency)
+    if transactional:
+        connections[tasks[0][1].using].on_commit(schedule)
+    else:
+        schedule()
+
+    return results
@@ -1,26 +1,142 @@
 import atexit
+import base64
 import datetime
+import heapq
+import itertools
+import json
 import os
-import pickle
 import threading
 import time
-from typing import Callable, Dict, List, Optional
+import uuid
+from typing import Callable, Dict, List, Optional, Union
+from urllib.parse import unquote
 
 import jsonpickle
+import requests
+from django.test import Client
+from django.urls import reverse
 from structlog.stdlib import get_logger
 
-from .schema import TaskOptions
+from . import metrics, serialization
+from .middleware import (
+    _QUEUE_NAME_HEADER,
+    _TASK_ETA_HEADER,
+    _TASK_EXECUTION_COUNT_HEADER,
+    _TASK_NAME_HEADER,
+    _TASK_RETRY_COUNT_HEADER,
+)
+from .schema import QueueOptions, TaskOptions
+from .tasks import _CREATED_AT_HEADER, _task_headers
 
 _logger = get_logger(__name__)
 
 
-def patch_tasks_emulator(persistence=True):
-    def _handler(pickled_data: bytes, queue_name: str):
-        service_obj = pickle.loads(pickled_data)
+_JOURNAL_FILE = os.path.abspath("emulator-task-queue.journal")
+
+
+class TaskDispatchError(Exception):
+    """Raised when a task handler responds with a non-2xx status code."""
+
+
+def _meta_to_header(meta_key: str) -> str:
+    # HTTP_X_APPENGINE_TASKNAME -> X-Appengine-Taskname
+    return "-".join(part.capitalize() for part in meta_key[5:].split("_"))
+
+
+def _direct_handler(task: "_Task"):
+    try:
+        created_at = float(task.headers.get(_CREATED_AT_HEADER))
+    except (TypeError, ValueError):
+        created_at = None
+
+    with metrics.track_execution(
+        task.queue_name,
+        len(task.payload),
+        created_at=created_at,
+        eta=task.scheduled_for,
+    ) as execution:
+        service_obj = serialization.decode(task.payload)
+        execution.task_class = service_obj.__class__.__qualname__
         _logger.info("Executing task: {0}".format(service_obj))
         service_obj.run()
 
-    emulator = Emulator(_handler, hibernation=persistence)
+
+def _http_handler(http_target: Optional[str] = None):
+    """Return a handler POSTing tasks to their handler URL like Cloud Tasks.
+
+    Tasks are sent through the Django test client, or to a running server if
+    http_target (e.g. http://localhost:8000) is given.
+    """
+
+    def handler(task: "_Task"):
+        headers = {
+            "Content-Type": "application/octet-stream",
+            **task.headers,
+            _meta_to_header(_TASK_NAME_HEADER): task.name or task.task_id,
+            _meta_to_header(_QUEUE_NAME_HEADER): task.queue_name,
+            _meta_to_header(_TASK_RETRY_COUNT_HEADER): str(task.retry_count),
+            _meta_to_header(_TASK_EXECUTION_COUNT_HEADER): str(task.execution_count),
+            _meta_to_header(_TASK_ETA_HEADER): "{0:.6f}".format(task.scheduled_for),
+        }
+        _logger.info("Dispatching task: {0}".format(task.name))
+
+        if http_target:
+            status_code = requests.post(
+                http_target + task.relative_uri,
+                data=task.payload,
+                headers=headers,
+            ).status_code
+        else:
+            status_code = (
+                Client(raise_request_exception=False)
+                .post(
+                    task.relative_uri,
+                    data=task.payload,
+                    content_type=headers.pop("Content-Type"),
+                    headers=headers,
+                )
+                .status_code
+            )
+
+        # Like Cloud Tasks, only count attempts the handler responded to
+        task.execution_count += 1
+        if not 200 <= status_code < 300:
+            raise TaskDispatchError(
+                "Task {0} failed with status {1}".format(task.name, status_code)
+            )
+
+    return handler
+
+
+def patch_tasks_emulator(
+    persistence: Union[bool, str] = True,
+    queues: Optional[Dict[str, QueueOptions]] = None,
+    default_queue_options: Optional[QueueOptions] = None,
+    dispatch: str = "direct",
+    http_target: Optional[str] = None,
+):
+    """Patch the tasks module to send tasks to an in-process emulator.
+
+    :param persistence: True (or "hibernate") to persist queue state at
+        shutdown, "journal" to persist every enqueue and ack as it happens (so
+        tasks survive crashes) or False to not persist tasks at all.
+    :param queues: Dispatch settings per queue name
+    :param default_queue_options: Dispatch settings for the other queues
+    :param dispatch: "direct" to run tasks by calling their run() method, or
+        "http" to POST them to their handler URL with the App Engine task
+        headers, going through the middleware and the real task handler.
+    :param http_target: Base URL of the server receiving tasks in "http"
+        dispatch mode. Tasks go through the Django test client by default.
+    """
+    assert dispatch in ("direct", "http"), "Unknown dispatch mode"
+
+    emulator = Emulator(
+        _direct_handler if dispatch == "direct" else _http_handler(http_target),
+        hibernation=persistence in (True, "hibernate"),
+        journal_file=_JOURNAL_FILE if persistence == "journal" else None,
+        queues=queues,
+        default_queue_options=default_queue_options,
+    )
 
     def _schedule_emulator_task(pickled_data: bytes, task_options: TaskOptions):
         _logger.info("Enquing task: {0}".format(task_options.name))
@@ -30,19 +146,204 @@ def patch_tasks_emulator(persistence=True):
                 seconds=task_options.countdown
             )
 
-        emulator.create_task(task_options.queue, pickled_data, schedule_time)
+        emulator.create_task(
+            task_options.queue,
+            pickled_data,
+            schedule_time,
+            name=task_options.name,
+            relative_uri=unquote(reverse(task_options.handler_url)),
+            headers=_task_headers(task_options),
+        )
+
+    async def _schedule_emulator_task_async(
+        pickled_data: bytes, task_options: TaskOptions
+    ):
+        _schedule_emulator_task(pickled_data, task_options)
 
     import backend.contrib.tasks
 
-    # Monkey patch _schedule task function
+    # Monkey patch _schedule task functions
     backend.contrib.tasks.tasks._schedule_task = _schedule_emulator_task
+    backend.contrib.tasks.tasks._schedule_task_async = _schedule_emulator_task_async
+
+
+_task_sequence = itertools.count()
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst,
+                self.tokens + (now - self.updated_at) * self.rate,
+            )
+            self.updated_at = now
+
+            # Tokens are taken in advance, so concurrent callers queue up
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait:
+            time.sleep(wait)
 
 
 class _Task:
-    def __init__(self, payload, queue_name, scheduled_for: float = None):
+    # Defaults for tasks hibernated by earlier versions of the emulator
+    name: Optional[str] = None
+    relative_uri: Optional[str] = None
+    headers: Dict[str, str] = {}
+    retry_count = 0
+    execution_count = 0
+
+    def __init__(
+        self,
+        payload,
+        queue_name,
+        scheduled_for: float = None,
+        task_id: Optional[str] = None,
+        name: Optional[str] = None,
+        relative_uri: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ):
         self.payload = payload
         self.scheduled_for = scheduled_for or time.time()
         self.queue_name = queue_name
+        self.sequence = next(_task_sequence)
+        self.task_id = task_id or uuid.uuid4().hex
+        self.name = name
+        self.relative_uri = relative_uri
+        self.headers = dict(headers or {})
+        self.retry_count = 0
+        self.execution_count = 0
+
+    def __lt__(self, other: "_Task"):
+        # Tasks scheduled for the same time are delivered in enqueue order
+        return (self.scheduled_for, getattr(self, "sequence", 0)) < (
+            other.scheduled_for,
+            getattr(other, "sequence", 0),
+        )
+
+
+class _Journal:
+    """Append-only log of task enqueues and acks.
+
+    Every record is written (and flushed) as it happens, so pending tasks
+    survive a crash. Once enough tasks have been acked, a background thread
+    compacts the journal by rewriting it with pending tasks only, which keeps
+    startup time proportional to the backlog.
+    """
+
+    compaction_threshold = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pending: Dict[str, str] = {}
+        self.acks_since_compaction = 0
+        self.compaction_needed = threading.Event()
+
+        self.__load()
+        self.__compact()
+        self.file = open(self.path, "a")
+
+        threading.Thread(
+            target=self.__compact_in_background,
+            name="Thread-emulator-journal",
+            daemon=True,
+        ).start()
+
+    def __load(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Partially written record, the process crashed
+                        continue
+
+                    if record["op"] == "put":
+                        self.pending[record["id"]] = line.rstrip("\n")
+                    else:
+                        self.pending.pop(record["id"], None)
+        except FileNotFoundError:
+            pass
+
+    def __compact(self):
+        tmp_path = "{0}.tmp".format(self.path)
+        with open(tmp_path, "w") as f:
+            for line in self.pending.values():
+                f.write(line + "\n")
+        os.replace(tmp_path, self.path)
+        self.acks_since_compaction = 0
+
+    def __compact_in_background(self):
+        while True:
+            self.compaction_needed.wait()
+            self.compaction_needed.clear()
+            with self.lock:
+                self.file.close()
+                self.__compact()
+                self.file = open(self.path, "a")
+
+    def __append(self, line: str):
+        self.file.write(line + "\n")
+        self.file.flush()
+
+    def tasks(self) -> List[_Task]:
+        tasks = []
+        for line in self.pending.values():
+            record = json.loads(line)
+            tasks.append(
+                _Task(
+                    base64.b64decode(record["payload"]),
+                    record["queue"],
+                    record["scheduled_for"],
+                    task_id=record["id"],
+                    name=record.get("name"),
+                    relative_uri=record.get("relative_uri"),
+                    headers=record.get("headers"),
+                )
+            )
+        return tasks
+
+    def put(self, task: _Task):
+        line = json.dumps(
+            {
+                "op": "put",
+                "id": task.task_id,
+                "queue": task.queue_name,
+                "scheduled_for": task.scheduled_for,
+                "name": task.name,
+                "relative_uri": task.relative_uri,
+                "headers": task.headers,
+                "payload": base64.b64encode(task.payload).decode(),
+            }
+        )
+        with self.lock:
+            self.pending[task.task_id] = line
+            self.__append(line)
+
+    def ack(self, task: _Task):
+        with self.lock:
+            self.pending.pop(task.task_id, None)
+            self.__append(json.dumps({"op": "ack", "id": task.task_id}))
+
+            self.acks_since_compaction += 1
+            if self.acks_since_compaction >= max(
+                self.compaction_threshold,
+                len(self.pending),
+            ):
+                self.compaction_needed.set()
 
 
 class Emulator:
@@ -50,29 +351,61 @@ class Emulator:
     The queues in the Emulator are not FIFO. Rather, they are priority queues:
     Elements are popped in the order of the time they are scheduled for, and
     only after the scheduled time.
+
+    Each queue is a heap processed by a pool of worker threads, which sleep on
+    a condition until the next task is due or a new task is enqueued. Tasks are
+    dispatched at the rate allowed by the queue's token bucket, if any.
+
+    A task fails if the handler raises. Failed tasks are retried with
+    exponential backoff until the queue's max_attempts is reached.
     """
 
     __hibernation_file = os.path.abspath("hibernate-emulator-task-queue.json")
 
-    def __init__(self, task_handler: Callable[[bytes, str], None], hibernation=True):
+    def __init__(
+        self,
+        task_handler: Callable[[_Task], None],
+        hibernation=True,
+        queues: Optional[Dict[str, QueueOptions]] = None,
+        default_queue_options: Optional[QueueOptions] = None,
+        journal_file: Optional[str] = None,
+    ):
         """
         :param task_handler: A callback function: It will receive the tasks
         :param hibernation: If True, queue state will be persisted at shutdown
             and reloaded at startup. If False, neither will be done.
+        :param journal_file: If given, enqueues and acks are persisted to this
+            journal as they happen, and pending tasks are reloaded from it at
+            startup. Hibernation is disabled.
+        :param queues: Dispatch settings per queue name
+        :param default_queue_options: Dispatch settings for the other queues
         """
         assert task_handler, "Need a task handler function"
         self.__lock = threading.Lock()
         self.__task_handler = task_handler
         self.__queues: Dict[str, List[_Task]] = {}
-        if hibernation:
+        self.__conditions: Dict[str, threading.Condition] = {}
+        self.__queue_options = dict(queues or {})
+        self.__default_queue_options = default_queue_options or QueueOptions()
+        self.__rate_limiters: Dict[str, Optional[_TokenBucket]] = {}
+        self.__journal: Optional[_Journal] = None
+        if journal_file:
+            self.__journal = _Journal(journal_file)
+            for task in self.__journal.tasks():
+                self.__queues.setdefault(task.queue_name, []).append(task)
+            for queue in self.__queues.values():
+                heapq.heapify(queue)
+        elif hibernation:
             atexit.register(self._hibernate)
             self.__queues = self.__load_from_hibernation()
+            for queue in self.__queues.values():
+                heapq.heapify(queue)
 
         tot = self.total_enqueued_tasks()
         if tot:  # Walrus in Python 3.8!
             _logger.info("Loaded %d tasks in %s queues", tot, len(self.__queues))
 
-        self.__queue_threads: dict[str, threading.Thread] = {}
+        self.__queue_threads: dict[str, List[threading.Thread]] = {}
 
         # Remove hibernation file whether we just loaded or are skipping hubernation.
         self.__remove_hibernation_file()
@@ -100,27 +433,68 @@ class Emulator:
                 f.write(json_s)
                 _logger.info("Persisted queue state to %s", self.__hibernation_file)
 
-    def __process_queue(self, queue_path):
-        while True:
-            task: Optional[_Task]
-            task = None
-            with self.__lock:
-                queue = self.__queues[queue_path]
+    def __next_task(self, queue_name) -> _Task:
+        condition = self.__conditions[queue_name]
+        with condition:
+            queue = self.__queues[queue_name]
+            while True:
+                timeout = None
                 if queue:
-                    peek = queue[0]
-                    now: float = time.time()
-                    if peek.scheduled_for <= now:
-                        task = queue.pop(0)  # Pop from the beginning; push to the end
-            if task:
-                self.__task_handler(task.payload, task.queue_name)
+                    timeout = queue[0].scheduled_for - time.time()
+                    if timeout <= 0:
+                        task = heapq.heappop(queue)
+                        if queue:
+                            # Let another idle worker look at the new head
+                            condition.notify()
+                        return task
+
+                # Sleep until the head of the queue is due, or until a task is
+                # enqueued (it could be due before the current head)
+                condition.wait(timeout)
+
+    def __process_queue(self, queue_name):
+        rate_limiter = self.__rate_limiters[queue_name]
+        while True:
+            task = self.__next_task(queue_name)
+            if rate_limiter:
+                rate_limiter.acquire()
 
-            time.sleep(0.01)
+            try:
+                self.__task_handler(task)
+            except Exception:
+                _logger.exception("Task failed in queue %s", queue_name)
+                if self.__retry(task):
+                    continue
+
+            if self.__journal:
+                self.__journal.ack(task)
+
+    def __retry(self, task: _Task) -> bool:
+        options = self.queue_options(task.queue_name)
+        if task.retry_count + 1 >= options.max_attempts:
+            return False
+
+        backoff = min(
+            options.min_backoff * 2 ** min(task.retry_count, options.max_doublings),
+            options.max_backoff,
+        )
+        task.retry_count += 1
+        task.scheduled_for = time.time() + backoff
+
+        with self.__lock:
+            heapq.heappush(self.__queues[task.queue_name], task)
+            self.__conditions[task.queue_name].notify()
+
+        return True
 
     def create_task(
         self,
         queue_name: str,
         payload,
         scheduled_for: datetime.datetime,
+        name: Optional[str] = None,
+        relative_uri: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
     ):
         """
         Schedules a task.
@@ -131,26 +505,54 @@ class Emulator:
             payload: A string that will be passed to the handler.
             scheduled_for: When this should be delivered. If None or 0, will
                 schedule for immediate delivery.
+            name: The task name.
+            relative_uri: The URL of the task handler, used in HTTP dispatch.
+            headers: Extra request headers, used in HTTP dispatch.
         """
         scheduled_for = scheduled_for or datetime.datetime.now()
         with self.__lock:
             if queue_name not in self.__queues:
                 self.__queues[queue_name] = []
                 self.__launch_queue_thread(queue_name)
-            queue = self.__queues[queue_name]
-            task = _Task(payload, queue_name, scheduled_for.timestamp())
-            queue.append(task)
-            queue.sort(key=lambda t: t.scheduled_for)
+            task = _Task(
+                payload,
+                queue_name,
+                scheduled_for.timestamp(),
+                name=name,
+                relative_uri=relative_uri,
+                headers=headers,
+            )
+            if self.__journal:
+                self.__journal.put(task)
+            heapq.heappush(self.__queues[queue_name], task)
+            self.__conditions[queue_name].notify()
+
+    def queue_options(self, queue_name) -> QueueOptions:
+        return self.__queue_options.get(queue_name, self.__default_queue_options)
 
     def __launch_queue_thread(self, queue_name):
-        new_thread = threading.Thread(
-            target=self.__process_queue,
-            name=f"Thread-{queue_name}",
-            args=[queue_name],
-            daemon=True,
+        options = self.queue_options(queue_name)
+
+        self.__conditions[queue_name] = threading.Condition(self.__lock)
+        self.__rate_limiters[queue_name] = (
+            _TokenBucket(
+                options.max_dispatches_per_second,
+                options.max_burst_size or options.max_concurrent_dispatches,
+            )
+            if options.max_dispatches_per_second
+            else None
         )
-        self.__queue_threads[queue_name] = new_thread
-        new_thread.start()
+
+        self.__queue_threads[queue_name] = []
+        for i in range(options.max_concurrent_dispatches):
+            new_thread = threading.Thread(
+                target=self.__process_queue,
+                name=f"Thread-{queue_name}-{i}",
+                args=[queue_name],
+                daemon=True,
+            )
+            self.__queue_threads[queue_name].append(new_thread)
+            new_thread.start()
 
     def total_enqueued_tasks(self):
         return sum(len(q) for q in self.__queues.values())
@@ -1,15 +1,68 @@
-import pickle
-
 from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
+from structlog.stdlib import get_logger
+
+from . import metrics, serialization
+from .decorators import bearer_token_only, task_only
+from .environment import task_created_at, task_eta, task_queue_name
+from .groups import sweep_groups
+from .outbox import dispatch_outbox
+from .storage import get_payload_store
 
-from .decorators import task_only
+_logger = get_logger(__name__)
 
 
 @csrf_exempt
 @task_only
 def deferred_handler(request):
-    service_obj = pickle.loads(request.body)
-    service_obj.run()
+    with metrics.track_execution(
+        task_queue_name(),
+        len(request.body),
+        created_at=task_created_at(),
+        eta=task_eta(),
+    ) as execution:
+        service_obj = serialization.decode(request.body)
+        execution.task_class = service_obj.__class__.__qualname__
+        service_obj.run()
+
+    return HttpResponse("OK")
+
+
+@task_only
+def sweep_payloads(request):
+    """Delete expired and orphaned large task payloads."""
+    deleted = get_payload_store().sweep()
+    _logger.info("Swept task payloads", deleted=deleted)
+
+    return HttpResponse("OK")
+
+
+@task_only
+def sweep_task_groups(request):
+    """Fail the members of task groups which never finished."""
+    failed = sweep_groups()
+    _logger.info("Swept task groups", failed=failed)
+
+    return HttpResponse("OK")
+
+
+@bearer_token_only("TASKS_METRICS_TOKEN")
+def task_metrics(request):
+    """Expose task execution metrics in the Prometheus text format.
+
+    Scrapers authenticate with the TASKS_METRICS_TOKEN bearer token. Metrics
+    are kept per instance, so each scrape only reports the executions of the
+    instance serving it.
+    """
+    return HttpResponse(
+        metrics.render_metrics(),
+        content_type="text/plain; version=0.0.4",
+    )
+
+
+@task_only
+def dispatch_outbox_tasks(request):
+    """Enqueue the tasks waiting in the outbox."""
+    dispatch_outbox()
 
     return HttpResponse("OK")
@@ -1,6 +1,6 @@
 from logging import getLogger
 
-from backend.contrib.tasks import defer
+from backend.contrib.tasks import defer_async
 from ninja import NinjaAPI
 from structlog.stdlib import get_logger
 
@@ -13,7 +13,7 @@ _core_logger = getLogger(__name__)
 
 
 @api.post("/dummy-resource")
-def resource_with_background_task(request):
+async def resource_with_background_task(request):
     _logger.error("Hello world!")
     _core_logger.error("Hello Python")
-    defer(DummyBackgroundTask(some_param=1))
+    await defer_async(DummyBackgroundTask(some_param=1))
@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+
+
+class CoreConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "backend.core"
+
+    def ready(self):
+        from .tasks import PokemonFirestoreSync
+
+        # Delete the documents of deleted entities on the next sync
+        PokemonFirestoreSync().track_deletes()
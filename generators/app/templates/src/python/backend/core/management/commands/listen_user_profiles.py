@@ -0,0 +1,39 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from ...services.userbase import UserProfileListener
+
+
+class Command(BaseCommand):
+    help = (
+        "Listen to user profile documents in Firestore and apply their changes "
+        "to the database as they happen, until interrupted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Most changes applied per transaction",
+        )
+        parser.add_argument(
+            "--flush-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait for changes before applying them",
+        )
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        # Stop cleanly when the instance shuts down, as well as on Ctrl-C
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stop.set())
+
+        self.stdout.write("Listening to user profiles")
+        UserProfileListener(
+            batch_size=options["batch_size"],
+            flush_interval=options["flush_interval"],
+        ).run(stop)
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_firestore_sync_watermarks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FirestoreDocumentHash',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('collection', models.CharField(max_length=128)),
+                ('key', models.CharField(max_length=1500)),
+                ('digest', models.CharField(max_length=64)),
+                ('field_digests', models.JSONField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='firestoredocumenthash',
+            constraint=models.UniqueConstraint(fields=('collection', 'key'), name='unique_for_collection_key'),
+        ),
+    ]
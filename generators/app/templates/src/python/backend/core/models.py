@@ -83,3 +83,53 @@ class EndUser(Entity):
         "list (we shouldn't subsequently re-add them).",
     )
     mailing_list_id = models.CharField(max_length=30, blank=True, null=True)
+
+
+class FirestoreSyncWatermark(models.Model):
+    """The last entity synced to a Firestore collection, see FirestoreModelSync.
+
+    Entities are synced in (modified_at, id) order, so every entity up to and
+    including this one has been synced.
+    """
+
+    collection = models.CharField(
+        max_length=FIRESTORE_STRING_MAX_LENGTH,
+        primary_key=True,
+    )
+    modified_at = models.DateTimeField()
+    entity_id = models.UUIDField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class FirestoreDocumentHash(models.Model):
+    """Digests of the last data written to a Firestore document.
+
+    FirestoreModelSync skips writing documents whose digest is unchanged, and
+    compares field digests to only write the changed fields in merge mode.
+    """
+
+    collection = models.CharField(max_length=FIRESTORE_STRING_MAX_LENGTH)
+    key = models.CharField(max_length=1500)
+    digest = models.CharField(max_length=64)
+    field_digests = models.JSONField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("collection", "key"),
+                name="unique_for_collection_key",
+            )
+        ]
+
+
+class FirestoreTombstone(models.Model):
+    """A Firestore document whose entity was deleted, see FirestoreModelSync.
+
+    Recorded by a post_delete signal handler in the transaction deleting the
+    entity, and removed once the document is deleted.
+    """
+
+    collection = models.CharField(max_length=FIRESTORE_STRING_MAX_LENGTH)
+    key = models.CharField(max_length=1500)
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
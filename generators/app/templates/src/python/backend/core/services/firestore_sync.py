@@ -1,51 +1,293 @@
-from typing import Callable, Generic, TypeVar
+import hashlib
+import json
+import time
+from abc import abstractmethod
+from datetime import datetime, timedelta
+from typing import Any, Dict, Generic, List, Optional, TypeVar
 
 from backend.contrib.model_utils import Entity
-from backend.core.models import PokePokemon
-from backend.core.schemas import FsPokemon
-from django.core.paginator import Paginator
+from backend.contrib.tasks import ResumableTask
+from backend.core.models import (
+    FirestoreDocumentHash,
+    FirestoreSyncWatermark,
+    FirestoreTombstone,
+)
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import Q
+from django.db.models.signals import post_delete
 from django.utils import timezone
 from firebase_admin import firestore
-from pydantic import BaseModel
+from pydantic import BaseModel, conint
+from structlog.stdlib import get_logger
 
-_DEFAULT_BATCH_SIZE = 100
+from .firestore_writer import MAX_BATCH_SIZE, FirestoreBatchWriter
+
+_logger = get_logger(__name__)
+
+_DEFAULT_MAX_CONCURRENCY = 8
+# Entities read, written and checkpointed by each process_batch() call
+_BATCHES_PER_CHECKPOINT = 10
+# Entities modified more recently are left for the next run, as transactions
+# still in flight may yet commit entities modified before them
+_SETTLE_TIME = timedelta(minutes=1)
 
 
 _EntityModelType = TypeVar("_EntityModelType", bound=Entity)
 _PydanticModelType = TypeVar("_PydanticModelType", bound=BaseModel)
 
 
-class FirestoreModelSync(BaseModel, Generic[_EntityModelType, _PydanticModelType]):
-    batch_size: int = _DEFAULT_BATCH_SIZE
+def _digest(value: Any) -> str:
+    # Canonical JSON, so equal values always have the same digest
+    return hashlib.sha256(
+        json.dumps(
+            value, sort_keys=True, separators=(",", ":"), cls=DjangoJSONEncoder
+        ).encode()
+    ).hexdigest()
+
+
+class FirestoreModelSync(ResumableTask, Generic[_EntityModelType, _PydanticModelType]):
+    """Write the entities of a queryset to a Firestore collection.
+
+    Subclasses implement get_queryset(), get_key() and map_schema(), and are
+    registered with register_task() so they are deferred by ID. They can
+    override map_documents() to build the documents of a batch of entities
+    at once instead.
+
+    Only entities modified since the last run are written, in (modified_at,
+    id) order. Entities are streamed from the database through a server-side
+    cursor, mapped, and written by up to max_concurrency Firestore batches
+    committed concurrently, see FirestoreBatchWriter. Every few batches, the
+    last entity written is saved as the collection's watermark, so an
+    interrupted run resumes from there. Related rows are only synced once the
+    entity itself is saved.
+
+    The digest of each document written is kept in FirestoreDocumentHash, and
+    documents whose data is unchanged are not written again. With merge, only
+    the fields which changed are written.
+
+    Once track_deletes() is called, deleting an entity records a
+    FirestoreTombstone, and the next run deletes its document before writing
+    modified entities.
+    """
+
+    # Writes per Firestore batch
+    batch_size: conint(gt=0, le=MAX_BATCH_SIZE) = MAX_BATCH_SIZE
+    max_concurrency: conint(gt=0) = _DEFAULT_MAX_CONCURRENCY
     firestore_collection: str
-    get_queryset: Callable[[], models.QuerySet[_EntityModelType]]
-    get_key: Callable[[_EntityModelType], str]
-    map_schema: Callable[[_EntityModelType], _PydanticModelType]
+    # Write every entity, not only those modified since the last run, even if
+    # its document is unchanged
+    full: bool = False
+    # Only write the changed fields of documents
+    merge: bool = False
+
+    @abstractmethod
+    def get_queryset(self) -> models.QuerySet[_EntityModelType]:
+        pass
+
+    @abstractmethod
+    def get_key(self, entity: _EntityModelType) -> str:
+        pass
+
+    @abstractmethod
+    def map_schema(self, entity: _EntityModelType) -> _PydanticModelType:
+        pass
+
+    def map_documents(self, entities: List[_EntityModelType]) -> Dict[str, dict]:
+        """Map a batch of entities to the data of their documents, by key."""
+        return {
+            self.get_key(entity): self.map_schema(entity).dict() for entity in entities
+        }
+
+    def track_deletes(self):
+        """Record a tombstone whenever an entity of the queryset's model is
+        deleted, typically called from AppConfig.ready().
+        """
+
+        def record_tombstone(sender, instance: _EntityModelType, **kwargs):
+            FirestoreTombstone.objects.create(
+                collection=self.firestore_collection,
+                key=self.get_key(instance),
+            )
+
+        post_delete.connect(
+            record_tombstone,
+            sender=self.get_queryset().model,
+            weak=False,
+            dispatch_uid="firestore_tombstone:{0}".format(self.firestore_collection),
+        )
+
+    def _start(self) -> Dict[str, Any]:
+        cursor: Dict[str, Any] = {"until": timezone.now() - _SETTLE_TIME, "after": None}
+        if not self.full:
+            watermark = FirestoreSyncWatermark.objects.filter(
+                collection=self.firestore_collection
+            ).first()
+            if watermark:
+                cursor["after"] = [watermark.modified_at, watermark.entity_id]
 
-    def run(self):
-        sync_timestamp = timezone.now()
+        return cursor
 
-        queryset = self.get_queryset()
-        queryset.filter(modified_lte=sync_timestamp)
+    def process_batch(
+        self, cursor: Optional[Dict[str, Any]]
+    ) -> Optional[Dict[str, Any]]:
+        # The cursor holds the (modified_at, id) of the last entity written and
+        # the modification time up to which this run syncs entities
+        if cursor is None:
+            cursor = self._start()
 
-        paginator = Paginator(queryset, _DEFAULT_BATCH_SIZE)
+        # Deletes come first, so the document of an entity deleted then
+        # created again with the same key ends up written
+        if self._delete_tombstones(cursor["until"]):
+            return cursor
 
+        queryset = self.get_queryset().filter(modified_at__lte=cursor["until"])
+        if cursor["after"]:
+            modified_at, entity_id = cursor["after"]
+            # The first filter on its own lets the modified_at index narrow
+            # down the scan
+            queryset = queryset.filter(modified_at__gte=modified_at).filter(
+                Q(modified_at__gt=modified_at) | Q(pk__gt=entity_id)
+            )
+
+        # A server-side cursor streams the entities, batches are committed in
+        # the background while the next entities are read and mapped
+        entities = queryset.order_by("modified_at", "pk")[
+            : self.batch_size * _BATCHES_PER_CHECKPOINT
+        ].iterator(chunk_size=self.batch_size)
+
+        started = time.monotonic()
+        last = None
+        synced = 0
+        chunk: List[_EntityModelType] = []
+        hashes: List[FirestoreDocumentHash] = []
         store = firestore.client()
 
-        for i in paginator.page_range:
-            batch = store.batch()
-            page = paginator.page(i)
-
-            for entity in page:
-                batch.set(
-                    store.document(
-                        "{}{}".format(
-                            self.firestore_collection,
-                            self.get_key(entity),
-                        ),
-                    ),
-                    self.map_schema(entity).dict(),
+        with FirestoreBatchWriter(
+            store, self.batch_size, self.max_concurrency
+        ) as writer:
+            for last in entities:
+                synced += 1
+                chunk.append(last)
+                if len(chunk) >= self.batch_size:
+                    hashes.extend(self._write_changed(writer, store, chunk))
+                    chunk = []
+            if chunk:
+                hashes.extend(self._write_changed(writer, store, chunk))
+
+        if last is None:
+            return None
+
+        # Only saved once their documents are committed
+        FirestoreDocumentHash.objects.bulk_create(
+            hashes,
+            update_conflicts=True,
+            unique_fields=("collection", "key"),
+            update_fields=("digest", "field_digests", "updated_at"),
+        )
+
+        elapsed = time.monotonic() - started
+        _logger.info(
+            "Synced entities to Firestore",
+            collection=self.firestore_collection,
+            documents=writer.written,
+            unchanged=synced - len(hashes),
+            documents_per_second=round(writer.written / elapsed, 1),
+        )
+
+        FirestoreSyncWatermark.objects.update_or_create(
+            collection=self.firestore_collection,
+            defaults={"modified_at": last.modified_at, "entity_id": last.pk},
+        )
+
+        return {"until": cursor["until"], "after": [last.modified_at, last.pk]}
+
+    def _delete_tombstones(self, until: datetime) -> int:
+        # Delete the documents of a batch of tombstones recorded until then,
+        # and return the number of tombstones
+        tombstones = list(
+            FirestoreTombstone.objects.filter(
+                collection=self.firestore_collection,
+                deleted_at__lte=until,
+            ).order_by("pk")[: self.batch_size * _BATCHES_PER_CHECKPOINT]
+        )
+        if not tombstones:
+            return 0
+
+        keys = {tombstone.key for tombstone in tombstones}
+        store = firestore.client()
+        collection = store.collection(self.firestore_collection)
+        with FirestoreBatchWriter(
+            store, self.batch_size, self.max_concurrency
+        ) as writer:
+            for key in keys:
+                writer.delete(collection.document(key))
+
+        FirestoreDocumentHash.objects.filter(
+            collection=self.firestore_collection,
+            key__in=keys,
+        ).delete()
+        FirestoreTombstone.objects.filter(
+            pk__in=[tombstone.pk for tombstone in tombstones]
+        ).delete()
+        _logger.info(
+            "Deleted documents from Firestore",
+            collection=self.firestore_collection,
+            documents=len(keys),
+        )
+
+        return len(tombstones)
+
+    def _write_changed(
+        self,
+        writer: FirestoreBatchWriter,
+        store,
+        entities: List[_EntityModelType],
+    ) -> List[FirestoreDocumentHash]:
+        # Write the documents of entities whose data changed since they were
+        # last written, and return their new digests
+        documents = self.map_documents(entities)
+        previous = {}
+        if not self.full:
+            previous = {
+                document_hash.key: document_hash
+                for document_hash in FirestoreDocumentHash.objects.filter(
+                    collection=self.firestore_collection,
+                    key__in=documents.keys(),
+                )
+            }
+
+        collection = store.collection(self.firestore_collection)
+        hashes = []
+        for key, data in documents.items():
+            field_digests = {field: _digest(value) for field, value in data.items()}
+            digest = _digest(field_digests)
+            document_hash = previous.get(key)
+            if document_hash and document_hash.digest == digest:
+                continue
+
+            if self.merge and document_hash:
+                changed = {
+                    field: value
+                    for field, value in data.items()
+                    if document_hash.field_digests.get(field) != field_digests[field]
+                }
+                # Fields no longer in the schema are removed from the document
+                for field in document_hash.field_digests.keys() - data.keys():
+                    changed[field] = firestore.DELETE_FIELD
+                # Merged by field path, so changed fields are replaced whole,
+                # rather than merged key by key into nested maps
+                writer.set(collection.document(key), changed, merge=list(changed))
+            else:
+                writer.set(collection.document(key), data)
+
+            hashes.append(
+                FirestoreDocumentHash(
+                    collection=self.firestore_collection,
+                    key=key,
+                    digest=digest,
+                    field_digests=field_digests,
                 )
+            )
 
-            batch.commit()
+        return hashes
@@ -0,0 +1,147 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Union
+
+from google.api_core import exceptions
+from structlog.stdlib import get_logger
+
+_logger = get_logger(__name__)
+
+# Firestore rejects batches of more than 500 writes
+MAX_BATCH_SIZE = 500
+_DEFAULT_MAX_CONCURRENCY = 8
+_DEFAULT_MAX_ATTEMPTS = 5
+_MIN_BACKOFF = 0.5
+_MAX_BACKOFF = 8
+
+# Contention and transient errors, worth retrying the batch for
+_RETRIED_ERRORS = (
+    exceptions.Aborted,
+    exceptions.DeadlineExceeded,
+    exceptions.ResourceExhausted,
+    exceptions.ServiceUnavailable,
+)
+
+# Adds a write to a batch
+_Write = Callable[[Any], None]
+
+
+class FirestoreBatchWriter:
+    """Write documents to Firestore in batches committed concurrently.
+
+    Writes are grouped in batches of batch_size (at most 500), each committed
+    by one of max_concurrency threads while the caller keeps adding writes.
+    Adding a write blocks while max_concurrency batches are in flight, so a
+    slow Firestore slows down the caller instead of piling up batches.
+    Batches failing with contention or transient errors are retried with
+    exponential backoff.
+
+    Use as a context manager, which waits for every batch to be committed on
+    exit and raises the first error, if any.
+    """
+
+    def __init__(
+        self,
+        client,
+        batch_size: int = MAX_BATCH_SIZE,
+        max_concurrency: int = _DEFAULT_MAX_CONCURRENCY,
+        max_attempts: int = _DEFAULT_MAX_ATTEMPTS,
+    ):
+        assert batch_size > 0 and max_concurrency > 0, "Sizes must be positive."
+
+        self.client = client
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.max_attempts = max_attempts
+        self.written = 0
+        self.__writes: List[_Write] = []
+        self.__slots = threading.BoundedSemaphore(max_concurrency)
+        self.__executor = ThreadPoolExecutor(
+            max_workers=max_concurrency,
+            thread_name_prefix="firestore-writer",
+        )
+        self.__futures: List[Future] = []
+        self.__lock = threading.Lock()
+
+    def __commit(self, writes: List[_Write]):
+        try:
+            for attempt in range(self.max_attempts):
+                # A batch which failed to commit is rebuilt from scratch
+                batch = self.client.batch()
+                for write in writes:
+                    write(batch)
+
+                try:
+                    batch.commit()
+                    break
+                except _RETRIED_ERRORS as e:
+                    if attempt + 1 >= self.max_attempts:
+                        raise
+
+                    backoff = min(_MIN_BACKOFF * 2**attempt, _MAX_BACKOFF)
+                    _logger.warning(
+                        "Firestore batch failed, retrying",
+                        error=str(e),
+                        attempt=attempt + 1,
+                        backoff=backoff,
+                    )
+                    time.sleep(backoff)
+
+            with self.__lock:
+                self.written += len(writes)
+        finally:
+            self.__slots.release()
+
+    def __raise_first_error(self, futures: List[Future]):
+        for future in futures:
+            error = future.exception()
+            if error:
+                raise error
+
+    def __submit(self):
+        # Stop adding batches once one has failed for good
+        self.__raise_first_error([future for future in self.__futures if future.done()])
+
+        writes, self.__writes = self.__writes, []
+        self.__slots.acquire()
+        self.__futures.append(self.__executor.submit(self.__commit, writes))
+
+    def __add(self, write: _Write):
+        self.__writes.append(write)
+        if len(self.__writes) >= self.batch_size:
+            self.__submit()
+
+    def set(self, reference, data: dict, merge: Union[bool, List[str]] = False):
+        """Add a write of data to the document reference.
+
+        With merge, only the fields in data are written, the other fields of
+        the document are left as they are. merge can also list the field paths
+        to write, which are replaced whole.
+        """
+        self.__add(lambda batch: batch.set(reference, data, merge=merge))
+
+    def delete(self, reference):
+        """Add a delete of the document reference."""
+        self.__add(lambda batch: batch.delete(reference))
+
+    def flush(self):
+        """Wait for every write added so far to be committed."""
+        if self.__writes:
+            self.__submit()
+
+        futures, self.__futures = self.__futures, []
+        self.__raise_first_error(futures)
+
+    def close(self):
+        self.__executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> Optional[bool]:
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self.close()
+        return False
@@ -2,9 +2,11 @@ from typing import Type, TypeVar
 
 import requests
 from backend.contrib.l10n.models import Language, Name, NamesMixin
-from backend.contrib.tasks import defer
+from backend.contrib.ratelimit import rate_limit
+from backend.contrib.tasks import Group, TaskOptions, defer, defer_group
 from django.db import models
 from pydantic import BaseModel
+from structlog.stdlib import get_logger
 
 from ..models import (
     PokeColor,
@@ -22,6 +24,12 @@ from ..schemas import (
     PokePokemonIn,
     PokeSpeciesIn,
 )
+from ..tasks import PokemonFirestoreSync
+
+_logger = get_logger(__name__)
+
+# Generations synced within this many seconds only sync Firestore once
+_FIRESTORE_SYNC_COALESCE_WINDOW = 60
 
 _PydanticModelType = TypeVar("_PydanticModelType", bound=BaseModel)
 
@@ -31,7 +39,8 @@ API_URL = "https://pokeapi.co/api/v2"
 def _fetch_entity(
     entity_url: str, schema_class: Type[_PydanticModelType]
 ) -> _PydanticModelType:
-    res = requests.get(entity_url)
+    with rate_limit(entity_url):
+        res = requests.get(entity_url)
     res.raise_for_status()
     return schema_class.parse_raw(res.text)
 
@@ -63,8 +72,30 @@ class PokeSync(BaseModel):
                 PokeGenerationIn,
             )
 
-            for desc in generation.pokemon_species:
-                defer(PokeSpeciesSync(api_entity_url=desc.url))
+            defer_group(
+                Group(
+                    (
+                        PokeSpeciesSync(api_entity_url=desc.url)
+                        for desc in generation.pokemon_species
+                    ),
+                    callback=PokeGenerationSynced(generation_name=generation_name),
+                )
+            )
+
+
+class PokeGenerationSynced(BaseModel):
+    """Runs once every species of a generation has been synced, and syncs the
+    new entities to Firestore.
+    """
+
+    generation_name: str
+
+    def run(self):
+        _logger.info("Generation synced", generation_name=self.generation_name)
+        defer(
+            PokemonFirestoreSync(),
+            TaskOptions(coalesce_window=_FIRESTORE_SYNC_COALESCE_WINDOW),
+        )
 
 
 class PokeSpeciesSync(BaseModel):
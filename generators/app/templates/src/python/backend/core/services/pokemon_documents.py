@@ -0,0 +1,112 @@
+"""Build FsPokemon documents in the database with PostgreSQL's JSON functions.
+
+Mapping model instances to FsPokemon loads each Pokémon with its species,
+color, habitat, types and all of their localised names and languages, and
+most of the time goes into building those instances. Here a single query
+builds each document with json_build_object() and json_agg(), and rows are
+streamed through a server-side cursor and validated against FsPokemon.
+"""
+from typing import Iterator
+
+from backend.contrib.l10n.models import Language, Name
+from django.db import connections
+from django.db.models import QuerySet
+
+from ..models import (
+    PokeColor,
+    PokeHabitat,
+    PokePokemon,
+    PokeSpecies,
+    PokeType,
+    PokeTypeSlot,
+)
+from ..schemas import FsPokemon
+
+_CHUNK_SIZE = 2000
+
+# The FsNames of the row with the given ID in the table of a NamesMixin model,
+# like get_names_schema(): en is the English name, or the first name when
+# there's none
+_NAMES_SQL = """
+    (
+        SELECT json_build_object(
+            'en', COALESCE(
+                MAX(n.name) FILTER (WHERE l.name = 'en'),
+                (array_agg(n.name ORDER BY m.id))[1]
+            ),
+            'l10n', json_object_agg(l.name, n.name ORDER BY m.id)
+        )
+        FROM {names_table} m
+        JOIN {name_table} n ON n.id = m.{name_column}
+        JOIN {language_table} l ON l.id = n.language_id
+        WHERE m.{entity_column} = {entity_id}
+    )
+"""
+
+_DOCUMENTS_SQL = """
+    SELECT json_build_object(
+        'name', p.name,
+        'height', p.height,
+        'weight', p.weight,
+        'base_experience', p.base_experience,
+        'base_happiness', s.base_happiness,
+        'is_baby', s.is_baby,
+        'is_legendary', s.is_legendary,
+        'is_mythical', s.is_mythical,
+        'species', {species_names},
+        'color', {color_names},
+        'habitat', CASE WHEN s.habitat_id IS NULL THEN NULL ELSE {habitat_names} END,
+        'types', COALESCE(
+            (
+                SELECT json_agg({type_names} ORDER BY ts.slot)
+                FROM {type_slot_table} ts
+                WHERE ts.pokemon_id = p.id
+            ),
+            '[]'
+        )
+    )
+    FROM {pokemon_table} p
+    JOIN {species_table} s ON s.id = p.species_id
+    WHERE p.id IN ({pokemon_ids})
+"""
+
+
+def _names_sql(model, entity_id: str) -> str:
+    field = model._meta.get_field("names")
+    return _NAMES_SQL.format(
+        names_table=field.remote_field.through._meta.db_table,
+        name_table=Name._meta.db_table,
+        language_table=Language._meta.db_table,
+        name_column=field.m2m_reverse_name(),
+        entity_column=field.m2m_column_name(),
+        entity_id=entity_id,
+    )
+
+
+def stream_pokemon_documents(
+    queryset: QuerySet[PokePokemon], chunk_size: int = _CHUNK_SIZE
+) -> Iterator[dict]:
+    """Yield the FsPokemon document data of the Pokémon in queryset.
+
+    Documents are equal to map_schema(pokemon).dict() of PokemonFirestoreSync,
+    with types in slot order. They are yielded in no particular order, and
+    a document which isn't a valid FsPokemon (say, of an entity without names)
+    raises ValidationError, like map_schema() fails on it.
+    """
+    pokemon_ids, params = queryset.values("pk").query.sql_with_params()
+    sql = _DOCUMENTS_SQL.format(
+        species_names=_names_sql(PokeSpecies, "s.id"),
+        color_names=_names_sql(PokeColor, "s.color_id"),
+        habitat_names=_names_sql(PokeHabitat, "s.habitat_id"),
+        type_names=_names_sql(PokeType, "ts.type_id"),
+        type_slot_table=PokeTypeSlot._meta.db_table,
+        pokemon_table=PokePokemon._meta.db_table,
+        species_table=PokeSpecies._meta.db_table,
+        pokemon_ids=pokemon_ids,
+    )
+
+    with connections[queryset.db].chunked_cursor() as cursor:
+        cursor.execute(sql, params)
+        while rows := cursor.fetchmany(chunk_size):
+            for (document,) in rows:
+                yield FsPokemon.parse_obj(document).dict()
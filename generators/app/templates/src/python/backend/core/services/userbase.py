@@ -1,18 +1,32 @@
-from datetime import datetime
-from typing import Optional
+import queue
+import threading
+from datetime import datetime, timedelta
+from typing import Any, List, Optional
 
+from backend.contrib.ratelimit import rate_limit
 from backend.contrib.service_base import ServiceResult, catch_service_errors
+from backend.contrib.tasks import ResumableTask
+from backend.contrib.tasks.models import TaskCheckpoint
 from django.conf import settings
 from django.core.paginator import Paginator
 from django.db import transaction
 from firebase_admin import firestore
 from mailerlite import MailerLiteApi
-from ninja import Schema
+from structlog.stdlib import get_logger
 
 from ..models import EndUser
 from ..schemas import FsUserProfile
 
 _MAILERLITE_API_PAGE_SIZE = 50
+_MAILERLITE_API_HOST = "api.mailerlite.com"
+_USER_SYNC_BATCH_SIZE = 100
+_LISTENER_CHECKPOINT_KEY = "core.user_profile_listener"
+_LISTENER_FLUSH_INTERVAL = 1.0
+# Profiles created this long before the last one applied are listened to
+# again on restart, in case their documents were written late
+_LISTENER_RESUME_MARGIN = timedelta(minutes=5)
+
+_logger = get_logger(__name__)
 
 
 class SyncMailingList:
@@ -22,13 +36,15 @@ class SyncMailingList:
         group = settings.MAILERLITE_GROUP
 
         # Check group exists, get ID, create it if necessary
-        all_groups = client.groups.all()
+        with rate_limit(_MAILERLITE_API_HOST):
+            all_groups = client.groups.all()
         group_matches = [g for g in all_groups if g.name == group]
 
         if group_matches:
             group_id = group_matches[0].id
         else:
-            new_group = client.groups.create(name=group)
+            with rate_limit(_MAILERLITE_API_HOST):
+                new_group = client.groups.create(name=group)
             group_id = new_group.id
 
         # Query for new users, paginate, bulk subscribe users using client
@@ -43,12 +59,15 @@ class SyncMailingList:
         for page_num in range(1, pages.num_pages + 1):
             page = pages.page(page_num)
 
-            new_subscribers = client.groups.add_subscribers(
-                group_id=group_id,
-                subscribers_data=[{"email": email, "name": email} for email in page],
-                autoresponders=False,
-                resubscribe=True,
-            )
+            with rate_limit(_MAILERLITE_API_HOST):
+                new_subscribers = client.groups.add_subscribers(
+                    group_id=group_id,
+                    subscribers_data=[
+                        {"email": email, "name": email} for email in page
+                    ],
+                    autoresponders=False,
+                    resubscribe=True,
+                )
 
             # Update flag and Mailerlite ID on models for successful subscribe
             for sub in new_subscribers:
@@ -61,45 +80,171 @@ class SyncMailingList:
         return ServiceResult(success=True)
 
 
-class SyncNewUsers(Schema):
+class SyncNewUsers(ResumableTask):
     """Sync user profile documents from Firestore.
 
-    This creates user profiles in the backend database.
+    This creates user profiles in the backend database. Users are synced in
+    batches, in order of creation, resuming after the last batch synced if the
+    task is interrupted.
     """
 
     sync_all: bool = False
     sync_from: Optional[datetime]
+    batch_size: int = _USER_SYNC_BATCH_SIZE
 
     @catch_service_errors
     def run(self) -> ServiceResult[None]:
-        last_sync_timestamp = self.sync_from or (
-            EndUser.objects.values_list("created_at", flat=True)
-            .order_by("-created_at")
-            .first()
-        )
+        super().run()
+
+        return ServiceResult(success=True)
 
+    def process_batch(self, cursor: Optional[str]) -> Optional[str]:
         store = firestore.client()
+        users = store.collection("users")
+
+        # The cursor is the creation time of the last user synced
+        if cursor is not None:
+            users = users.where("created", ">", datetime.fromisoformat(cursor))
+        elif not self.sync_all:
+            last_sync_timestamp = self.sync_from or (
+                EndUser.objects.values_list("created_at", flat=True)
+                .order_by("-created_at")
+                .first()
+            )
+            if last_sync_timestamp is not None:
+                users = users.where("created", ">=", last_sync_timestamp)
+
+        fb_users = list(users.order_by("created").limit(self.batch_size).stream())
+        if not fb_users:
+            return None
+
+        # The next batch starts after the creation time of the last user, so
+        # users created at the same time are synced in this batch
+        last_created = fb_users[-1].to_dict()["created"]
+        fb_users += (
+            store.collection("users").where("created", "==", last_created).stream()
+        )
 
-        if self.sync_all or last_sync_timestamp is None:
-            fb_users = store.collection("users").get()
-        else:
-            fb_users = (
-                store.collection("users")
-                .where("created", ">=", last_sync_timestamp)
-                .stream()
+        # Each batch is synced in the same transaction as its cursor is saved,
+        # so no user profiles fall down the cracks if the sync is interrupted
+        for user in {user.id: user for user in fb_users}.values():
+            user_profile = FsUserProfile(**user.to_dict())
+
+            EndUser.objects.get_or_create(
+                firebase_auth_id=user.reference.id,
+                defaults={
+                    "email": user_profile.email,
+                    "opt_in_communications": user_profile.opt_in_communications,
+                },
             )
 
-        # Successfully sync all users or none at all
-        # This is so we can retry whole syncs after fixing an error and no
-        # user profiles fall down the cracks
-        with transaction.atomic():
-            for user in fb_users:
-                user_profile = FsUserProfile(**user.to_dict())
+        return last_created.isoformat()
 
-                EndUser.objects.get_or_create(
-                    uid=user.reference.id,
-                    email=user_profile.email,
-                    opt_in_communications=user_profile.opt_in_communications,
+
+class UserProfileListener:
+    """Apply changes to user profile documents in Firestore as they happen.
+
+    run() listens to the users collection with on_snapshot(), and applies the
+    changes received to EndUser in micro-batches of batch_size changes, or of
+    whatever was received within flush_interval seconds.
+
+    The creation time of the newest profile applied is saved with each batch.
+    On restart, the listener only queries profiles created since then, so it
+    doesn't load the whole collection again. Changes to older profiles made
+    while the listener was down are not picked up, SyncNewUsers(sync_all=True)
+    backfills them.
+
+    Removed profiles are skipped rather than deleting their EndUser: profiles
+    which no longer match the query are reported as removed too.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = _USER_SYNC_BATCH_SIZE,
+        flush_interval: float = _LISTENER_FLUSH_INTERVAL,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Changes of each snapshot, put by the listener's thread
+        self.__snapshots: "queue.Queue[List[Any]]" = queue.Queue()
+
+    def handle_snapshot(self, snapshot, changes, read_time):
+        """on_snapshot() callback, queueing changes for apply_changes()."""
+        if changes:
+            self.__snapshots.put(list(changes))
+
+    def apply_changes(self, timeout: float = 0) -> int:
+        """Apply the changes received so far in a transaction, waiting up to
+        timeout seconds for some, and return the number of changes applied.
+
+        Changes of a snapshot are applied together, so the saved creation time
+        only moves past the profiles of a snapshot once all are applied.
+        """
+        changes = []
+        try:
+            changes += self.__snapshots.get(block=timeout > 0, timeout=timeout)
+            while len(changes) < self.batch_size:
+                changes += self.__snapshots.get_nowait()
+        except queue.Empty:
+            pass
+
+        if not changes:
+            return 0
+
+        with transaction.atomic():
+            created = []
+            for change in changes:
+                document = change.document
+                if change.type.name == "REMOVED":
+                    # Also reported for profiles dropping out of the query, so
+                    # it doesn't mean the profile was deleted
+                    _logger.info("Skipped removed user profile", id=document.id)
+                    continue
+
+                user_profile = FsUserProfile(**document.to_dict())
+                EndUser.objects.update_or_create(
+                    firebase_auth_id=document.id,
+                    defaults={
+                        "email": user_profile.email,
+                        "opt_in_communications": user_profile.opt_in_communications,
+                    },
+                )
+                created.append(user_profile.created)
+
+            last_created = self._last_created()
+            if last_created:
+                created.append(last_created)
+            if created:
+                TaskCheckpoint.objects.update_or_create(
+                    key=_LISTENER_CHECKPOINT_KEY,
+                    defaults={"cursor": max(created).isoformat()},
                 )
 
-        return ServiceResult(success=True)
+        _logger.info("Applied user profile changes", changes=len(changes))
+        return len(changes)
+
+    def _last_created(self) -> Optional[datetime]:
+        # Creation time of the newest profile applied, if any
+        checkpoint = TaskCheckpoint.objects.filter(key=_LISTENER_CHECKPOINT_KEY).first()
+        return datetime.fromisoformat(checkpoint.cursor) if checkpoint else None
+
+    def get_query(self):
+        """Query of the profiles to listen to."""
+        users = firestore.client().collection("users")
+        last_created = self._last_created()
+        if last_created:
+            users = users.where("created", ">=", last_created - _LISTENER_RESUME_MARGIN)
+
+        return users
+
+    def run(self, stop: threading.Event):
+        """Listen to changes until stop is set."""
+        watch = self.get_query().on_snapshot(self.handle_snapshot)
+        try:
+            while not stop.is_set():
+                self.apply_changes(timeout=self.flush_interval)
+        finally:
+            watch.unsubscribe()
+            # Apply what was received before unsubscribing
+            while self.apply_changes():
+                pass
@@ -0,0 +1,76 @@
+from typing import Dict, List
+
+from backend.contrib.tasks import register_task
+from django.db.models import Prefetch, QuerySet
+
+from .models import PokePokemon, PokeType
+from .schemas import FsPokemon
+from .services.firestore_sync import FirestoreModelSync
+from .services.pokemon_documents import stream_pokemon_documents
+
+
+@register_task("core.pokemon_firestore_sync")
+class PokemonFirestoreSync(FirestoreModelSync[PokePokemon, FsPokemon]):
+    firestore_collection: str = "pokemon"
+    # Build documents in the database, see pokemon_documents.py, rather than
+    # from model instances with map_schema()
+    sql_documents: bool = True
+
+    def get_queryset(self) -> QuerySet[PokePokemon]:
+        if self.sql_documents:
+            return PokePokemon.objects.only("id", "modified_at", "name")
+
+        return (
+            PokePokemon.objects.select_related(
+                "species__growth_rate",
+                "species__color",
+                "species__habitat",
+            )
+            .prefetch_related(
+                "species__names__language",
+                "species__color__names__language",
+                "species__habitat__names__language",
+                # In slot order, like the documents built in SQL
+                Prefetch(
+                    "types",
+                    queryset=PokeType.objects.order_by("poketypeslot__slot"),
+                ),
+                "types__names__language",
+            )
+            .all()
+        )
+
+    def get_key(self, entity: PokePokemon) -> str:
+        return entity.name
+
+    def map_documents(self, entities: List[PokePokemon]) -> Dict[str, dict]:
+        if not self.sql_documents:
+            return super().map_documents(entities)
+
+        documents = stream_pokemon_documents(
+            PokePokemon.objects.filter(pk__in=[entity.pk for entity in entities])
+        )
+        # Documents are keyed by name, see get_key()
+        return {document["name"]: document for document in documents}
+
+    def map_schema(self, entity: PokePokemon) -> FsPokemon:
+        return FsPokemon(
+            name=entity.name,
+            height=entity.height,
+            weight=entity.weight,
+            base_experience=entity.base_experience,
+            base_happiness=entity.species.base_happiness,
+            is_baby=entity.species.is_baby,
+            is_legendary=entity.species.is_legendary,
+            is_mythical=entity.species.is_mythical,
+            species=entity.species.get_names_schema(),
+            color=entity.species.color.get_names_schema(),
+            habitat=(
+                entity.species.habitat.get_names_schema()
+                if entity.species.habitat
+                else None
+            ),
+            types=[
+                pokemon_type.get_names_schema() for pokemon_type in entity.types.all()
+            ],
+        )
@@ -92,6 +92,7 @@ ROOT_URLCONF = "backend.urls"
 INSTALLED_APPS = [
     "backend.contrib.tasks",
     "backend.contrib.l10n",
+    "backend.contrib.ratelimit",
     "backend.core",
 ]
 MIDDLEWARE = [
@@ -105,6 +106,29 @@ MIDDLEWARE = [
 ]
 
 
+# TASKS
+
+# Storage for task payloads too large to be sent to Cloud Tasks
+TASKS_PAYLOAD_STORE = {
+    "BACKEND": "backend.contrib.tasks.storage.DatabasePayloadStore",
+}
+# Bearer token to scrape task metrics with, metrics can't be scraped without
+TASKS_METRICS_TOKEN = _env("TASKS_METRICS_TOKEN", default=None)
+# Drain the task outbox from a thread in every process, on top of the cron job
+TASKS_OUTBOX_DISPATCHER_THREAD = False
+
+
+# RATE LIMITS
+
+# Calls per second (and bursts) allowed to upstream APIs, by host name
+RATE_LIMITS = {
+    "pokeapi.co": {"RATE": 100 / 60, "BURST": 10},
+    "api.mailerlite.com": {"RATE": 120 / 60, "BURST": 10},
+}
+# Share rate limits between every instance of the application
+RATE_LIMIT_BACKEND = "backend.contrib.ratelimit.backends.DatabaseRateLimitBackend"
+
+
 # INTERNATIONALIZATION
 
 LANGUAGE_CODE = "en-us"
@@ -65,6 +65,12 @@ structlog.configure(
 )
 
 
+# RATE LIMITS
+
+# Local development runs in a single process
+RATE_LIMIT_BACKEND = "backend.contrib.ratelimit.backends.LocalRateLimitBackend"
+
+
 # Static files (CSS, JavaScript, Images)
 STATIC_ROOT = os.path.abspath(os.path.join(BASE_DIR, "static"))
 STATIC_URL = "/static/"
@@ -1,4 +1,11 @@
 from backend.contrib.debug.views import debug, debug_raise_exception
+from backend.contrib.tasks.views import (
+    deferred_handler,
+    dispatch_outbox_tasks,
+    sweep_payloads,
+    sweep_task_groups,
+    task_metrics,
+)
 from backend.core.api import api
 from backend.core.cron_tasks import dummy_defer_task, dummy_task
 from django.urls import include, path
@@ -7,6 +14,13 @@ urlpatterns_cron_tasks = [
     path("dummy-task/", dummy_task, name="dummy-task"),
     path("dummy-defer-task/", dummy_defer_task, name="dummy-defer-task"),
     path("sync-pokemon/", dummy_defer_task, name="sync-pokemon"),
+    path("sweep-task-payloads/", sweep_payloads, name="sweep-task-payloads"),
+    path("sweep-task-groups/", sweep_task_groups, name="sweep-task-groups"),
+    path(
+        "dispatch-task-outbox/",
+        dispatch_outbox_tasks,
+        name="dispatch-task-outbox",
+    ),
 ]
 
 urlpatterns = [
@@ -15,6 +29,12 @@ urlpatterns = [
         "cron-tasks/",
         include((urlpatterns_cron_tasks, "core"), namespace="tasks"),
     ),
+    path(
+        "_ah/tasks/deferred/",
+        deferred_handler,
+        name="tasks_deferred_handler",
+    ),
+    path("_ah/tasks/metrics/", task_metrics, name="tasks_metrics"),
     path("debug/", debug, name="debug"),
     path("debug/raise-exception/", debug_raise_exception, name="debug-raise-exception"),
 ]
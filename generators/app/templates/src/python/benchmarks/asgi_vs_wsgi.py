@@ -0,0 +1,152 @@
+"""Compare requests/sec served over WSGI (gunicorn) and ASGI (uvicorn).
+
+Each server gets the same number of worker processes and is hit by the same
+number of concurrent clients. The benchmark views wait on a simulated upstream
+call: blocking in the sync view, awaited in the async view.
+
+Run from src/python (with the usual .env for the local settings):
+
+    python -m benchmarks.asgi_vs_wsgi --requests 2000 --concurrency 64
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+_HOST = "127.0.0.1"
+
+_SERVERS = {
+    "wsgi": [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "--workers",
+        "{workers}",
+        "--bind",
+        "{host}:{port}",
+        "backend.wsgi:application",
+    ],
+    "asgi": [
+        sys.executable,
+        "-m",
+        "uvicorn",
+        "--workers",
+        "{workers}",
+        "--host",
+        "{host}",
+        "--port",
+        "{port}",
+        "--no-access-log",
+        "backend.asgi:application",
+    ],
+}
+
+
+def _start_server(kind: str, port: int, workers: int, latency: float):
+    command = [
+        arg.format(workers=workers, host=_HOST, port=port) for arg in _SERVERS[kind]
+    ]
+    env = dict(
+        os.environ,
+        DJANGO_SETTINGS_MODULE="benchmarks.settings",
+        BENCHMARK_UPSTREAM_LATENCY=str(latency),
+    )
+    server = subprocess.Popen(
+        command,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    url = "http://{0}:{1}/benchmark/sync/".format(_HOST, port)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline and server.poll() is None:
+        try:
+            requests.get(url, timeout=5)
+            return server
+        except requests.RequestException:
+            time.sleep(0.2)
+
+    server.terminate()
+    raise RuntimeError("The {0} server did not start".format(kind))
+
+
+def _run_load(url: str, total: int, concurrency: int):
+    def worker(count: int):
+        latencies = []
+        with requests.Session() as session:
+            for _ in range(count):
+                start = time.perf_counter()
+                session.get(url).raise_for_status()
+                latencies.append(time.perf_counter() - start)
+        return latencies
+
+    counts = [
+        total // concurrency + (1 if i < total % concurrency else 0)
+        for i in range(concurrency)
+    ]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = [
+            latency for result in executor.map(worker, counts) for latency in result
+        ]
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "rps": total / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.05,
+        help="Simulated upstream latency in seconds",
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(
+        "{0} requests, {1} concurrent clients, {2} workers, {3}ms upstream".format(
+            args.requests, args.concurrency, args.workers, args.latency * 1000
+        )
+    )
+    print(
+        "{0:<6} {1:<6} {2:>10} {3:>10} {4:>10}".format(
+            "server", "view", "req/s", "p50 ms", "p99 ms"
+        )
+    )
+
+    for kind in ("wsgi", "asgi"):
+        server = _start_server(kind, args.port, args.workers, args.latency)
+        try:
+            for view in ("sync", "async"):
+                url = "http://{0}:{1}/benchmark/{2}/".format(_HOST, args.port, view)
+                _run_load(url, args.concurrency, args.concurrency)  # Warm up
+                result = _run_load(url, args.requests, args.concurrency)
+                print(
+                    "{0:<6} {1:<6} {rps:>10.1f} {p50:>10.1f} {p99:>10.1f}".format(
+                        kind, view, **result
+                    )
+                )
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
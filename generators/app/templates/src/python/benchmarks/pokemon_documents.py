@@ -0,0 +1,187 @@
+"""Compare building FsPokemon documents with the ORM and with SQL JSON functions.
+
+Fills a throwaway test database with synthetic Pokémon, each with its own
+species and localised names, then times both mappers over every row: the
+ORM path maps prefetched model instances with map_schema(), the SQL path
+streams the documents built by stream_pokemon_documents().
+
+Run from src/python (with the usual .env for the local settings):
+
+    python -m benchmarks.pokemon_documents --rows 10000 100000
+"""
+
+import argparse
+import os
+import random
+import time
+import uuid
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+django.setup()
+
+from backend.contrib.l10n.models import Language, Name  # noqa: E402
+from backend.core.models import (  # noqa: E402
+    PokeColor,
+    PokeGrowthRate,
+    PokeHabitat,
+    PokePokemon,
+    PokeSpecies,
+    PokeType,
+    PokeTypeSlot,
+)
+from backend.core.services.pokemon_documents import (  # noqa: E402
+    stream_pokemon_documents,
+)
+from backend.core.tasks import PokemonFirestoreSync  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_databases, teardown_databases  # noqa: E402
+
+_LANGUAGES = ("en", "fr", "de", "es", "it", "ja")
+_COLORS = 10
+_HABITATS = 9
+_TYPES = 18
+_BATCH_SIZE = 500
+
+
+def _create_named(model, start: int, count: int, languages, **fields):
+    # Create count instances of a NamesMixin model, with a name per language
+    instances = model.objects.bulk_create(
+        model(
+            id=uuid.uuid4(),
+            name="{0}-{1}".format(model._meta.model_name, start + i),
+            poke_api_id=str(start + i),
+            **{
+                field: value(i) if callable(value) else value
+                for field, value in fields.items()
+            },
+        )
+        for i in range(count)
+    )
+    names = Name.objects.bulk_create(
+        Name(
+            id=uuid.uuid4(),
+            name="{0} ({1})".format(instance.name, language.name),
+            language=language,
+        )
+        for instance in instances
+        for language in languages
+    )
+    through = model.names.through
+    through.objects.bulk_create(
+        through(**{model._meta.model_name: instance, "name": name})
+        for instance, name in zip(
+            (instance for instance in instances for _ in languages), names
+        )
+    )
+
+    return instances
+
+
+def _create_lookups():
+    languages = Language.objects.bulk_create(
+        Language(id=uuid.uuid4(), name=name) for name in _LANGUAGES
+    )
+    growth_rate = PokeGrowthRate.objects.create(
+        id=uuid.uuid4(),
+        poke_api_id="1",
+        name="slow",
+        formula="\\frac{5x^3}{4}",
+        levels=[],
+    )
+    colors = _create_named(PokeColor, 0, _COLORS, languages)
+    habitats = _create_named(PokeHabitat, 0, _HABITATS, languages)
+    types = _create_named(PokeType, 0, _TYPES, languages)
+
+    return languages, growth_rate, colors, habitats, types
+
+
+def _create_pokemon(start: int, count: int, lookups):
+    languages, growth_rate, colors, habitats, types = lookups
+    rng = random.Random(start)
+    for offset in range(start, start + count, 10000):
+        size = min(10000, start + count - offset)
+        species = _create_named(
+            PokeSpecies,
+            offset,
+            size,
+            languages,
+            base_happiness=70,
+            is_baby=False,
+            is_legendary=False,
+            is_mythical=False,
+            growth_rate=growth_rate,
+            color=lambda i: rng.choice(colors),
+            # Some species have no habitat
+            habitat=lambda i: rng.choice([*habitats, None]),
+        )
+        pokemon = _create_named(
+            PokePokemon,
+            offset,
+            size,
+            languages,
+            base_experience=64,
+            height=7,
+            weight=69,
+            species=lambda i: species[i],
+        )
+        PokeTypeSlot.objects.bulk_create(
+            PokeTypeSlot(id=uuid.uuid4(), pokemon=entity, type=type, slot=slot)
+            for entity in pokemon
+            for slot, type in enumerate(rng.sample(types, rng.randint(1, 2)), 1)
+        )
+
+
+def _orm_documents():
+    task = PokemonFirestoreSync(sql_documents=False)
+    for entity in task.get_queryset().iterator(chunk_size=_BATCH_SIZE):
+        yield task.map_schema(entity).dict()
+
+
+def _sql_documents():
+    return stream_pokemon_documents(PokePokemon.objects.all(), _BATCH_SIZE)
+
+
+def _time(documents) -> float:
+    start = time.perf_counter()
+    count = sum(1 for _ in documents)
+    elapsed = time.perf_counter() - start
+    assert count == PokePokemon.objects.count()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    args = parser.parse_args()
+
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        lookups = _create_lookups()
+        print(
+            "{0:>8} {1:>10} {2:>10} {3:>10} {4:>10} {5:>8}".format(
+                "rows", "orm s", "orm doc/s", "sql s", "sql doc/s", "speedup"
+            )
+        )
+        rows = 0
+        for target in sorted(args.rows):
+            _create_pokemon(rows, target - rows, lookups)
+            rows = target
+            # Plan queries with statistics, like on a live database
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+            orm = _time(_orm_documents())
+            sql = _time(_sql_documents())
+            print(
+                "{0:>8} {1:>10.2f} {2:>10.0f} {3:>10.2f} {4:>10.0f} {5:>7.1f}x".format(
+                    rows, orm, rows / orm, sql, rows / sql, orm / sql
+                )
+            )
+    finally:
+        teardown_databases(old_config, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
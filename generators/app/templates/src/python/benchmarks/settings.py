@@ -0,0 +1,10 @@
+"""Settings for benchmarks: the local settings plus the benchmark views."""
+
+from backend.settings_local import *  # noqa: F401, F403
+
+ROOT_URLCONF = "benchmarks.urls"
+DEBUG = False
+ALLOWED_HOSTS = ["*"]
+
+# Keep the benchmarks from measuring console logging
+LOGGING = {"version": 1, "disable_existing_loggers": True}
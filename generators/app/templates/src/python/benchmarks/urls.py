@@ -0,0 +1,27 @@
+import asyncio
+import os
+import time
+
+from backend.urls import urlpatterns as backend_urlpatterns
+from django.http import HttpResponse
+from django.urls import path
+
+# Simulated latency of an upstream call (Firestore, MailerLite, Cloud Tasks)
+_UPSTREAM_LATENCY = float(os.environ.get("BENCHMARK_UPSTREAM_LATENCY", "0.05"))
+
+
+def sync_upstream(request):
+    time.sleep(_UPSTREAM_LATENCY)
+    return HttpResponse("OK")
+
+
+async def async_upstream(request):
+    await asyncio.sleep(_UPSTREAM_LATENCY)
+    return HttpResponse("OK")
+
+
+urlpatterns = [
+    path("benchmark/sync/", sync_upstream),
+    path("benchmark/async/", async_upstream),
+    *backend_urlpatterns,
+]
@@ -1,4 +1,5 @@
 import pytest
+from backend.contrib.tasks.storage import get_payload_store
 from backend.contrib.tasks.tasks_emulator import patch_tasks_emulator
 from tests import factories
 
@@ -10,6 +11,16 @@ def tasks_emulator(request):
     patch_tasks_emulator()
 
 
+@pytest.fixture
+def payload_store(settings, tmp_path):
+    """Store large task payloads in a temporary directory."""
+    settings.TASKS_PAYLOAD_STORE = {
+        "BACKEND": "backend.contrib.tasks.storage.FileSystemPayloadStore",
+        "OPTIONS": {"root": str(tmp_path / "payloads"), "chunk_size": 64},
+    }
+    return get_payload_store()
+
+
 @pytest.fixture
 def fs_user_profile_factory():
     """Generate fake Firestore user profile documents."""
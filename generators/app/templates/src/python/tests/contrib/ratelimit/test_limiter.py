@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+from backend.contrib.ratelimit import RateLimiter, rate_limit
+from backend.contrib.ratelimit.backends import (
+    DatabaseRateLimitBackend,
+    LocalRateLimitBackend,
+)
+from backend.contrib.ratelimit.models import TokenBucket
+from backend.contrib.tasks import metrics
+from django.db import connections, transaction
+from django.utils import timezone
+
+
+@pytest.fixture(params=["local", "database"])
+def backend(request):
+    if request.param == "database":
+        request.getfixturevalue("db")
+        return DatabaseRateLimitBackend()
+    return LocalRateLimitBackend()
+
+
+def test_burst_then_rate(backend):
+    limiter = RateLimiter("api.example.com", rate=10, burst=3, backend=backend)
+
+    # Freeze time, so no tokens are refilled between calls
+    now = timezone.now()
+    with patch("backend.contrib.ratelimit.backends.timezone.now", return_value=now):
+        with patch("backend.contrib.ratelimit.backends.time.monotonic", return_value=0):
+            with patch("backend.contrib.ratelimit.limiter.time.sleep") as mock_sleep:
+                waits = [limiter.acquire() for _ in range(5)]
+
+    # The burst goes through, then calls are spaced out by 1 / rate
+    assert waits[:3] == [0, 0, 0]
+    assert waits[3] == pytest.approx(0.1)
+    assert waits[4] == pytest.approx(0.2)
+    assert mock_sleep.call_count == 2
+
+
+def test_keys_are_independent(backend):
+    first = RateLimiter("first", rate=1, backend=backend)
+    second = RateLimiter("second", rate=1, backend=backend)
+
+    assert first.acquire() == 0
+    assert second.acquire() == 0
+
+
+@pytest.mark.django_db
+def test_database_backend_is_shared():
+    # Limiters in different processes share the row of their key
+    RateLimiter("shared", rate=1, backend=DatabaseRateLimitBackend()).acquire()
+
+    with patch("backend.contrib.ratelimit.limiter.time.sleep"):
+        wait = RateLimiter(
+            "shared",
+            rate=1,
+            backend=DatabaseRateLimitBackend(),
+        ).acquire()
+
+    assert wait == pytest.approx(1, abs=0.1)
+    assert TokenBucket.objects.get(key="shared").tokens < 0
+
+
+@pytest.mark.django_db
+def test_database_backend_does_not_lock_in_callers_transaction():
+    def lock_bucket():
+        # Another instance reserving from the same bucket
+        try:
+            with transaction.atomic():
+                return (
+                    TokenBucket.objects.select_for_update(nowait=True)
+                    .filter(key="in-transaction")
+                    .count()
+                )
+        finally:
+            connections.close_all()
+
+    with transaction.atomic():
+        DatabaseRateLimitBackend().reserve("in-transaction", rate=1, burst=1)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            assert executor.submit(lock_bucket).result() == 1
+
+
+def test_decorator_and_wait_metric():
+    limiter = RateLimiter("decorated", rate=10, backend=LocalRateLimitBackend())
+    calls = []
+
+    @limiter
+    def call_upstream():
+        calls.append(True)
+
+    with patch("backend.contrib.ratelimit.limiter.time.sleep"):
+        with metrics.track_execution("default", 0) as execution:
+            call_upstream()
+            call_upstream()
+
+    assert len(calls) == 2
+    assert execution.rate_limit_wait == pytest.approx(0.1, abs=0.01)
+
+
+def test_rate_limit_by_host(settings):
+    settings.RATE_LIMITS = {"pokeapi.co": {"RATE": 5, "BURST": 2}}
+
+    limiter = rate_limit("https://pokeapi.co/api/v2/generation/1/")
+    assert isinstance(limiter, RateLimiter)
+    assert (limiter.key, limiter.rate, limiter.burst) == ("pokeapi.co", 5, 2)
+
+    # Hosts without a limit aren't limited
+    assert not isinstance(rate_limit("https://example.com/"), RateLimiter)
@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+from backend.contrib.tasks.cron import (
+    CronJob,
+    CronJobError,
+    CronScheduler,
+    InvalidScheduleError,
+    cron_dispatcher,
+    parse_schedule,
+)
+
+# A sunday
+_START = datetime(2023, 1, 1, 10, 7, tzinfo=timezone.utc)
+
+
+def _utc(*args) -> datetime:
+    return datetime(*args).replace(tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize(
+    "schedule, expected",
+    [
+        ("every 5 minutes", _utc(2023, 1, 1, 10, 12)),
+        ("every 2 hours", _utc(2023, 1, 1, 12, 7)),
+        ("every 12 hours synchronized", _utc(2023, 1, 1, 12, 0)),
+        ("every 30 mins from 12:00 to 13:00", _utc(2023, 1, 1, 12, 0)),
+        ("every 5 minutes from 09:00 to 10:10", _utc(2023, 1, 1, 10, 10)),
+        ("every 5 minutes from 09:00 to 10:05", _utc(2023, 1, 2, 9, 0)),
+        ("every day 10:00", _utc(2023, 1, 2, 10, 0)),
+        ("every monday 09:00", _utc(2023, 1, 2, 9, 0)),
+        ("every sat, sun 11:00", _utc(2023, 1, 1, 11, 0)),
+        ("2nd,third mon of month 17:00", _utc(2023, 1, 9, 17, 0)),
+        ("1st tuesday of feb,mar 00:00", _utc(2023, 2, 7, 0, 0)),
+        ("1,15 of month 00:00", _utc(2023, 1, 15, 0, 0)),
+        ("29 of feb 00:00", _utc(2024, 2, 29, 0, 0)),
+    ],
+)
+def test_next_run(schedule, expected):
+    assert parse_schedule(schedule).next_run(_START) == expected
+
+
+def test_next_run_in_timezone():
+    schedule = parse_schedule("every day 09:00", "Europe/London")
+    assert schedule.next_run(_utc(2023, 7, 1)) == _utc(2023, 7, 1, 8, 0)
+
+
+@pytest.mark.parametrize(
+    "schedule",
+    ["every 0 minutes", "every fortnight", "every day 25:00", "6th mon of month 09:00"],
+)
+def test_invalid_schedule(schedule):
+    with pytest.raises(InvalidScheduleError):
+        parse_schedule(schedule)
+
+
+def test_runs_replay_a_day_in_order():
+    scheduler = CronScheduler(
+        [
+            CronJob(url="/often/", schedule="every 5 minutes"),
+            CronJob(url="/daily/", schedule="every day 00:00"),
+        ],
+        dispatch=lambda job: None,
+        start=_utc(2023, 1, 1),
+    )
+
+    runs = list(scheduler.runs(until=_utc(2023, 1, 2)))
+
+    assert [run_at for run_at, _ in runs] == sorted(run_at for run_at, _ in runs)
+    assert sum(job.url == "/often/" for _, job in runs) == 24 * 12
+    assert [run_at for run_at, job in runs if job.url == "/daily/"] == [
+        _utc(2023, 1, 2)
+    ]
+
+
+def test_run_is_accelerated():
+    dispatched = []
+    scheduler = CronScheduler(
+        [CronJob(url="/often/", schedule="every 1 minutes")],
+        dispatch=dispatched.append,
+        speed=3600,
+    )
+
+    with patch("backend.contrib.tasks.cron.time.sleep") as mock_sleep:
+        scheduler.run(until=scheduler.start + timedelta(minutes=10))
+
+    assert len(dispatched) == 10
+    # The clock doesn't move while sleep is patched, so the last sleep covers
+    # the whole 10 simulated minutes
+    assert mock_sleep.call_args.args[0] == pytest.approx(10 * 60 / 3600, abs=0.01)
+
+
+@pytest.mark.django_db
+def test_dispatch_sends_cron_header():
+    dispatch = cron_dispatcher()
+
+    # Only cron requests are allowed to dispatch the outbox
+    dispatch(CronJob(url="/cron-tasks/dispatch-task-outbox/", schedule="every 1 mins"))
+
+    with pytest.raises(CronJobError):
+        dispatch(CronJob(url="/cron-tasks/unknown/", schedule="every 1 mins"))
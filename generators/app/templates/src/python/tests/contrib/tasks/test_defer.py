@@ -0,0 +1,173 @@
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+from backend.contrib.tasks import TaskOptions, defer_async, defer_many
+from backend.contrib.tasks.tasks import (
+    _recent_task_names,
+    _schedule_task,
+    _schedule_task_async,
+)
+from backend.core.services.dummy import DummyBackgroundTask
+from django.db import transaction
+from google.api_core import exceptions
+
+
+def test_defer_many():
+    with patch("backend.contrib.tasks.tasks._schedule_task") as mock_schedule:
+        results = defer_many(DummyBackgroundTask(some_param=i) for i in range(20))
+
+    assert mock_schedule.call_count == 20
+    assert len(results) == 20
+    assert all(result.success for result in results)
+    assert len({result.name for result in results}) == 20
+
+
+def test_defer_many_reports_failures():
+    with patch("backend.contrib.tasks.tasks._schedule_task") as mock_schedule:
+        mock_schedule.side_effect = [None, Exception("Enqueue failed"), None]
+        results = defer_many(
+            [DummyBackgroundTask(some_param=i) for i in range(3)],
+            max_concurrency=1,
+        )
+
+    assert [result.success for result in results] == [True, False, True]
+    assert isinstance(results[1].error, Exception)
+
+
+@pytest.mark.django_db
+def test_defer_many_transactional(django_capture_on_commit_callbacks):
+    with patch("backend.contrib.tasks.tasks._schedule_task") as mock_schedule:
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                results = defer_many(
+                    [DummyBackgroundTask(some_param=i) for i in range(5)],
+                    TaskOptions(transactional=True),
+                )
+
+                # Nothing is sent until the transaction commits
+                mock_schedule.assert_not_called()
+                assert all(result.success is None for result in results)
+
+    # The whole group is submitted by a single commit hook
+    assert len(callbacks) == 1
+    assert mock_schedule.call_count == 5
+    assert all(result.success for result in results)
+
+
+def test_defer_async():
+    with patch(
+        "backend.contrib.tasks.tasks._schedule_task_async",
+        new_callable=AsyncMock,
+    ) as mock_schedule:
+        asyncio.run(defer_async(DummyBackgroundTask(some_param=1)))
+
+    mock_schedule.assert_awaited_once()
+    assert mock_schedule.call_args.args[1].name.startswith(
+        "backend-core-services-dummy-DummyBackgroundTask",
+    )
+
+
+def test_schedule_task_async_falls_back_to_database():
+    client = AsyncMock()
+    client.create_task.side_effect = [
+        exceptions.InvalidArgument("Task size too large"),
+        None,
+    ]
+
+    with patch("backend.contrib.tasks.tasks._get_async_client") as mock_get_client:
+        mock_get_client.return_value = client
+        with patch("backend.contrib.tasks.tasks._store_large_task") as mock_store:
+            mock_store.return_value = ("digest", "reference", b"small body")
+            asyncio.run(
+                _schedule_task_async(
+                    b"large body",
+                    TaskOptions(
+                        name="large-task",
+                        created_at=datetime.now(),
+                        countdown=10,
+                        handler_url="debug",
+                    ),
+                )
+            )
+
+    mock_store.assert_called_once_with(b"large body")
+    assert client.create_task.await_count == 2
+
+    task = client.create_task.call_args.kwargs["task"]
+    assert task["name"].endswith("/tasks/large-task")
+    assert task["schedule_time"]
+    assert task["app_engine_http_request"]["body"] == b"small body"
+
+
+def test_idempotent_task_names():
+    options = TaskOptions(idempotent=True)
+    with patch("backend.contrib.tasks.tasks._schedule_task"):
+        first = defer_many([DummyBackgroundTask(some_param=1)], options)[0]
+        other = defer_many([DummyBackgroundTask(some_param=2)], options)[0]
+
+    assert first.name != other.name
+    assert len(first.name) <= 500
+    assert all(c.isalnum() or c in "-_" for c in first.name)
+    assert first.name.endswith("backend-core-services-dummy-DummyBackgroundTask")
+
+
+def test_idempotent_duplicates_are_dropped(monkeypatch):
+    monkeypatch.setattr(_recent_task_names, "names", OrderedDict())
+    options = TaskOptions(idempotent=True)
+
+    with patch("backend.contrib.tasks.tasks._schedule_task") as mock_schedule:
+        results = defer_many(
+            [DummyBackgroundTask(some_param=1) for _ in range(3)],
+            options,
+            max_concurrency=1,
+        )
+
+    mock_schedule.assert_called_once()
+    assert [result.duplicate for result in results] == [False, True, True]
+    assert len({result.name for result in results}) == 1
+
+
+def test_schedule_task_already_exists_is_success():
+    client = Mock()
+    client.create_task.side_effect = exceptions.AlreadyExists("Task exists")
+
+    with patch("backend.contrib.tasks.tasks._get_client") as mock_get_client:
+        mock_get_client.return_value = client
+        _schedule_task(
+            b"payload",
+            TaskOptions(name="some-task", created_at=datetime.now()),
+        )
+
+    client.create_task.assert_called_once()
+
+
+def test_coalesce_window(monkeypatch):
+    monkeypatch.setattr(_recent_task_names, "names", OrderedDict())
+    options = TaskOptions(coalesce_window=60, countdown=5)
+    now = datetime(2023, 1, 1, 12, 0, 10, tzinfo=dt_timezone.utc)
+
+    with patch("backend.contrib.tasks.tasks._schedule_task") as mock_schedule:
+        with patch("django.utils.timezone.now", return_value=now):
+            results = defer_many(
+                [DummyBackgroundTask(some_param=1) for _ in range(3)],
+                options,
+                max_concurrency=1,
+            )
+        with patch(
+            "django.utils.timezone.now",
+            return_value=now + timedelta(minutes=1),
+        ):
+            later = defer_many([DummyBackgroundTask(some_param=1)], options)[0]
+
+    # One run per window, scheduled at the end of it
+    assert mock_schedule.call_count == 2
+    assert [result.duplicate for result in results] == [False, True, True]
+    assert later.name != results[0].name
+
+    scheduled = mock_schedule.call_args_list[0].args[1]
+    assert scheduled.eta == datetime(2023, 1, 1, 12, 1, tzinfo=dt_timezone.utc)
+    assert scheduled.countdown is None
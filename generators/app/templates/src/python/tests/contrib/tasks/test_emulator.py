@@ -0,0 +1,259 @@
+import datetime
+import threading
+import time
+from unittest.mock import Mock, patch
+
+import requests
+from backend.contrib.tasks import environment
+from backend.contrib.tasks.schema import QueueOptions
+from backend.contrib.tasks.serialization import encode
+from backend.contrib.tasks.tasks_emulator import Emulator, _http_handler
+from backend.core.services.dummy import DummyBackgroundTask
+from django.urls import reverse
+
+
+def _recording_emulator(expected_tasks: int, **kwargs):
+    handled = []
+    done = threading.Event()
+
+    def handler(task):
+        handled.append(task.payload)
+        if len(handled) == expected_tasks:
+            done.set()
+
+    return Emulator(handler, hibernation=False, **kwargs), handled, done
+
+
+def test_tasks_are_delivered_in_schedule_order():
+    emulator, handled, done = _recording_emulator(3)
+    now = datetime.datetime.now()
+
+    emulator.create_task("default", b"third", now + datetime.timedelta(seconds=0.3))
+    emulator.create_task("default", b"second", now + datetime.timedelta(seconds=0.1))
+    emulator.create_task("default", b"first", None)
+
+    assert done.wait(timeout=5)
+    assert handled == [b"first", b"second", b"third"]
+    assert emulator.total_enqueued_tasks() == 0
+
+
+def test_enqueue_wakes_up_sleeping_queue():
+    emulator, handled, done = _recording_emulator(1)
+    now = datetime.datetime.now()
+
+    # The queue thread sleeps until the first task is due in an hour...
+    emulator.create_task("default", b"later", now + datetime.timedelta(hours=1))
+
+    # ...but is woken up by a task due immediately
+    emulator.create_task("default", b"now", None)
+
+    assert done.wait(timeout=5)
+    assert handled == [b"now"]
+    assert emulator.total_enqueued_tasks() == 1
+
+
+def test_failing_task_does_not_stop_queue():
+    handled = []
+    done = threading.Event()
+
+    def handler(task):
+        if task.payload == b"fail":
+            raise Exception("Task failed")
+        handled.append(task.payload)
+        done.set()
+
+    emulator = Emulator(handler, hibernation=False)
+    emulator.create_task("default", b"fail", None)
+    emulator.create_task("default", b"ok", None)
+
+    assert done.wait(timeout=5)
+    assert handled == [b"ok"]
+
+
+def test_concurrent_dispatches():
+    workers = 3
+    barrier = threading.Barrier(workers)
+    passed = []
+
+    def handler(task):
+        # Only returns once all workers are running a task at the same time
+        barrier.wait(timeout=5)
+        passed.append(task.payload)
+
+    emulator = Emulator(
+        handler,
+        hibernation=False,
+        queues={"parallel": QueueOptions(max_concurrent_dispatches=workers)},
+    )
+    for i in range(workers):
+        emulator.create_task("parallel", i, None)
+
+    deadline = time.monotonic() + 5
+    while len(passed) < workers and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert sorted(passed) == [0, 1, 2]
+
+
+def test_dispatch_rate_limit():
+    emulator, handled, done = _recording_emulator(
+        5,
+        default_queue_options=QueueOptions(
+            max_dispatches_per_second=20,
+            max_burst_size=1,
+        ),
+    )
+
+    started = time.monotonic()
+    for i in range(5):
+        emulator.create_task("limited", i, None)
+
+    assert done.wait(timeout=5)
+
+    # The first task uses the burst, the other 4 wait for a token each
+    assert time.monotonic() - started >= 4 / 20
+
+
+def test_journal_reloads_pending_tasks(tmp_path):
+    journal_file = str(tmp_path / "tasks.journal")
+    emulator, handled, done = _recording_emulator(1, journal_file=journal_file)
+    later = datetime.datetime.now() + datetime.timedelta(hours=1)
+
+    emulator.create_task("default", b"pending", later)
+    emulator.create_task("default", b"acked", None)
+    assert done.wait(timeout=5)
+
+    # Simulate a crash: a new emulator only reloads the pending task
+    restarted, handled, done = _recording_emulator(1, journal_file=journal_file)
+
+    assert restarted.total_enqueued_tasks() == 1
+
+
+def test_journal_compaction(tmp_path):
+    journal_file = tmp_path / "tasks.journal"
+    emulator, handled, done = _recording_emulator(10, journal_file=str(journal_file))
+    emulator._Emulator__journal.compaction_threshold = 5
+
+    for i in range(10):
+        emulator.create_task("default", str(i).encode(), None)
+    assert done.wait(timeout=5)
+
+    def journal_lines():
+        return len(journal_file.read_text().splitlines())
+
+    # Acked tasks are eventually compacted away: only the puts and acks since
+    # the last compaction are left
+    deadline = time.monotonic() + 5
+    while journal_lines() >= 20 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert journal_lines() < 20
+
+
+def test_failed_tasks_are_retried_with_backoff():
+    attempts = []
+    done = threading.Event()
+
+    def handler(task):
+        attempts.append((task.retry_count, time.monotonic()))
+        if len(attempts) < 3:
+            raise Exception("Task failed")
+        done.set()
+
+    emulator = Emulator(
+        handler,
+        hibernation=False,
+        default_queue_options=QueueOptions(max_attempts=3, min_backoff=0.05),
+    )
+    emulator.create_task("default", b"flaky", None)
+
+    assert done.wait(timeout=5)
+    assert [retry_count for retry_count, _ in attempts] == [0, 1, 2]
+
+    # Backoff doubles between attempts
+    assert attempts[1][1] - attempts[0][1] >= 0.05
+    assert attempts[2][1] - attempts[1][1] >= 0.1
+
+
+def test_http_dispatch():
+    environments = []
+    done = threading.Event()
+
+    def run(self):
+        environments.append(
+            (
+                environment.task_name(),
+                environment.task_queue_name(),
+                environment.task_retry_count(),
+            )
+        )
+        done.set()
+
+    emulator = Emulator(_http_handler(), hibernation=False)
+
+    with patch.object(DummyBackgroundTask, "run", run):
+        emulator.create_task(
+            "default",
+            encode(DummyBackgroundTask(some_param=1)),
+            None,
+            name="dummy-task",
+            relative_uri=reverse("tasks_deferred_handler"),
+        )
+        assert done.wait(timeout=5)
+
+    assert environments == [("dummy-task", "default", 0)]
+
+
+def test_http_dispatch_counts_executions_with_a_response():
+    sent_headers = []
+    done = threading.Event()
+
+    def post(url, data, headers):
+        sent_headers.append(headers)
+        if len(sent_headers) == 1:
+            raise requests.ConnectionError()
+        if len(sent_headers) == 2:
+            return Mock(status_code=500)
+        done.set()
+        return Mock(status_code=200)
+
+    emulator = Emulator(
+        _http_handler("http://localhost:8000"),
+        hibernation=False,
+        default_queue_options=QueueOptions(max_attempts=3, min_backoff=0.01),
+    )
+    with patch("backend.contrib.tasks.tasks_emulator.requests.post", post):
+        emulator.create_task("default", b"flaky", None, relative_uri="/task")
+        assert done.wait(timeout=5)
+
+    assert [
+        (
+            headers["X-Appengine-Taskretrycount"],
+            headers["X-Appengine-Taskexecutioncount"],
+        )
+        for headers in sent_headers
+    ] == [("0", "0"), ("1", "0"), ("2", "1")]
+
+
+def test_http_dispatch_fails_on_error_status():
+    failed = threading.Event()
+    handler = _http_handler()
+
+    def failing_handler(task):
+        try:
+            handler(task)
+        except Exception:
+            failed.set()
+            raise
+
+    emulator = Emulator(failing_handler, hibernation=False)
+
+    with patch.object(DummyBackgroundTask, "run", side_effect=Exception("Boom")):
+        emulator.create_task(
+            "default",
+            encode(DummyBackgroundTask(some_param=1)),
+            None,
+            name="failing-task",
+            relative_uri=reverse("tasks_deferred_handler"),
+        )
+        assert failed.wait(timeout=5)
@@ -0,0 +1,173 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+import pytest
+from backend.contrib.tasks import DeferResult, Group, defer_group
+from backend.contrib.tasks.groups import sweep_groups
+from backend.contrib.tasks.models import TaskGroup
+from backend.contrib.tasks.tasks import PermanentTaskError
+from backend.core.services.dummy import DummyBackgroundTask
+
+
+def _defer_group(group: Group):
+    """Defer the group, return its members instead of enqueuing them."""
+    with patch("backend.contrib.tasks.groups.defer_many") as mock_defer_many:
+        group_id = defer_group(group)
+    return group_id, list(mock_defer_many.call_args.args[0])
+
+
+@pytest.mark.django_db
+def test_callback_runs_once_after_last_member():
+    group_id, members = _defer_group(
+        Group(
+            [DummyBackgroundTask(some_param=i) for i in range(3)],
+            callback=DummyBackgroundTask(some_param=100),
+        )
+    )
+    assert len(members) == 3
+
+    with patch("backend.contrib.tasks.groups.defer") as mock_defer:
+        members[0].run()
+        members[1].run()
+        mock_defer.assert_not_called()
+
+        members[2].run()
+        # Members delivered twice are only counted once
+        members[2].run()
+        members[0].run()
+
+    mock_defer.assert_called_once()
+    assert mock_defer.call_args.args[0] == DummyBackgroundTask(some_param=100)
+
+    task_group = TaskGroup.objects.get(pk=group_id)
+    assert task_group.pending == 0
+    assert task_group.completed_at and task_group.succeeded
+
+
+@pytest.mark.django_db
+def test_nested_groups():
+    group_id, members = _defer_group(
+        Group(
+            [
+                DummyBackgroundTask(some_param=1),
+                Group(
+                    [DummyBackgroundTask(some_param=i) for i in range(2, 4)],
+                    callback=DummyBackgroundTask(some_param=200),
+                ),
+                Group([]),
+            ],
+            callback=DummyBackgroundTask(some_param=100),
+        )
+    )
+    assert len(members) == 3
+
+    with patch("backend.contrib.tasks.groups.defer") as mock_defer:
+        for member in members:
+            member.run()
+
+    assert [call.args[0].some_param for call in mock_defer.call_args_list] == [
+        200,
+        100,
+    ]
+    assert TaskGroup.objects.get(pk=group_id).succeeded
+
+
+@pytest.mark.django_db
+def test_failure_policy_ignore():
+    _, members = _defer_group(
+        Group(
+            [DummyBackgroundTask(some_param=i) for i in range(2)],
+            callback=DummyBackgroundTask(some_param=100),
+        )
+    )
+
+    with patch("backend.contrib.tasks.groups.defer") as mock_defer:
+        with patch.object(DummyBackgroundTask, "run", side_effect=PermanentTaskError):
+            members[0].run()
+        members[1].run()
+
+    mock_defer.assert_called_once()
+    assert TaskGroup.objects.get().failed == 1
+
+
+@pytest.mark.django_db
+def test_failure_policy_fail():
+    group_id, members = _defer_group(
+        Group(
+            [
+                Group(
+                    [DummyBackgroundTask(some_param=i) for i in range(2)],
+                    callback=DummyBackgroundTask(some_param=200),
+                    failure_policy="fail",
+                ),
+                DummyBackgroundTask(some_param=3),
+            ],
+            callback=DummyBackgroundTask(some_param=100),
+            errback=DummyBackgroundTask(some_param=-100),
+            failure_policy="fail",
+        )
+    )
+
+    with patch("backend.contrib.tasks.groups.defer") as mock_defer:
+        with patch.object(DummyBackgroundTask, "run", side_effect=PermanentTaskError):
+            members[0].run()
+        members[1].run()
+        members[2].run()
+
+    # The failure propagates up, the outer errback runs once
+    assert [call.args[0].some_param for call in mock_defer.call_args_list] == [-100]
+    assert TaskGroup.objects.get(pk=group_id).succeeded is False
+
+
+@pytest.mark.django_db
+def test_sweep_fails_members_which_never_finish():
+    group_id, members = _defer_group(
+        Group(
+            [DummyBackgroundTask(some_param=i) for i in range(2)],
+            callback=DummyBackgroundTask(some_param=100),
+        )
+    )
+    created_at = TaskGroup.objects.get(pk=group_id).created_at
+
+    with patch("backend.contrib.tasks.groups.defer") as mock_defer:
+        members[0].run()
+        # Any other error is retried, until Cloud Tasks gives up
+        with patch.object(DummyBackgroundTask, "run", side_effect=RuntimeError):
+            with pytest.raises(RuntimeError):
+                members[1].run()
+
+        assert sweep_groups(now=created_at + timedelta(hours=1)) == 0
+        assert sweep_groups(now=created_at + timedelta(days=2)) == 1
+        # A late run after the sweep is ignored
+        members[1].run()
+
+    mock_defer.assert_called_once()
+    task_group = TaskGroup.objects.get(pk=group_id)
+    assert task_group.failed == 1 and task_group.completed_at
+
+
+@pytest.mark.django_db
+def test_members_failing_to_enqueue_fail_straight_away(
+    django_capture_on_commit_callbacks,
+):
+    results = [
+        DeferResult(name="member-0", success=True),
+        DeferResult(name="member-1", success=False, error=RuntimeError()),
+    ]
+
+    with patch("backend.contrib.tasks.groups.defer_many", return_value=results):
+        with patch("backend.contrib.tasks.groups.defer") as mock_defer:
+            with django_capture_on_commit_callbacks(execute=True):
+                group_id = defer_group(
+                    Group(
+                        [DummyBackgroundTask(some_param=i) for i in range(2)],
+                        callback=DummyBackgroundTask(some_param=100),
+                        errback=DummyBackgroundTask(some_param=-100),
+                        failure_policy="fail",
+                    )
+                )
+
+    assert [call.args[0].some_param for call in mock_defer.call_args_list] == [-100]
+    task_group = TaskGroup.objects.get(pk=group_id)
+    assert task_group.pending == 1 and task_group.failed == 1
+    assert task_group.succeeded is False
@@ -0,0 +1,92 @@
+from unittest.mock import patch
+
+import pytest
+from backend.contrib.l10n.models import Language
+from backend.contrib.tasks import defer_iteration
+from backend.contrib.tasks.models import TaskGroup
+from backend.core.services.dummy import DummyBackgroundTask
+
+_seen = []
+
+
+def _collect(language: Language):
+    _seen.append(language.name)
+
+
+@pytest.fixture(autouse=True)
+def languages():
+    _seen.clear()
+    return Language.objects.bulk_create(
+        Language(name="l{0:02}".format(i)) for i in range(20)
+    )
+
+
+def _defer_iteration(*args, **kwargs):
+    with patch("backend.contrib.tasks.iteration.defer_many") as mock_defer_many:
+        defer_iteration(*args, **kwargs)
+    return mock_defer_many.call_args.args[0]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("key", ["pk", "created_at"])
+def test_shards_cover_the_queryset(key):
+    shards = _defer_iteration(Language.objects.all(), _collect, shards=4, key=key)
+    assert len(shards) == 4
+
+    for shard in shards:
+        shard.run()
+
+    assert sorted(_seen) == ["l{0:02}".format(i) for i in range(20)]
+
+
+@pytest.mark.django_db
+def test_shards_share_the_filter():
+    shards = _defer_iteration(
+        Language.objects.filter(name__lt="l10"),
+        _collect,
+        shards=3,
+    )
+
+    for shard in shards:
+        shard.run()
+
+    assert sorted(_seen) == ["l{0:02}".format(i) for i in range(10)]
+
+
+@pytest.mark.django_db
+def test_shard_continues_when_out_of_time():
+    (shard,) = _defer_iteration(
+        Language.objects.all(),
+        _collect,
+        shards=1,
+        key="created_at",
+        time_budget=0,
+    )
+
+    with patch("backend.contrib.tasks.iteration.defer") as mock_defer:
+        shard.run()
+        # Each continuation processes one instance, then re-defers itself
+        while mock_defer.called:
+            continuation = mock_defer.call_args.args[0]
+            mock_defer.reset_mock()
+            continuation.run()
+
+    assert sorted(_seen) == ["l{0:02}".format(i) for i in range(20)]
+
+
+@pytest.mark.django_db
+def test_finalize_runs_after_every_shard():
+    shards = _defer_iteration(
+        Language.objects.all(),
+        _collect,
+        shards=2,
+        finalize=DummyBackgroundTask(some_param=1),
+    )
+
+    with patch("backend.contrib.tasks.groups.defer") as mock_defer:
+        shards[0].run()
+        mock_defer.assert_not_called()
+        shards[1].run()
+
+    mock_defer.assert_called_once()
+    assert TaskGroup.objects.get().completed_at
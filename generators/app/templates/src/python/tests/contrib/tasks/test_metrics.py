@@ -0,0 +1,100 @@
+import time
+from unittest.mock import patch
+
+import pytest
+from backend.contrib.tasks import metrics
+from backend.contrib.tasks.models import PayloadBlob
+from backend.contrib.tasks.serialization import encode
+from backend.contrib.tasks.tasks import _DeferredFromStore
+from backend.core.services.dummy import DummyBackgroundTask
+from django.urls import reverse
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset_metrics()
+    yield
+    metrics.reset_metrics()
+
+
+@pytest.mark.django_db
+def test_track_execution():
+    with metrics.track_execution(
+        "default",
+        100,
+        created_at=time.time() - 30,
+        eta=time.time() - 10,
+    ) as execution:
+        execution.task_class = "SomeTask"
+        PayloadBlob.objects.count()
+        PayloadBlob.objects.count()
+
+    with pytest.raises(RuntimeError):
+        with metrics.track_execution("default", 100) as execution:
+            execution.task_class = "SomeTask"
+            raise RuntimeError()
+
+    rendered = metrics.render_metrics()
+    labels = 'task_class="SomeTask",queue="default"'
+    assert "task_wall_seconds_count{{{0}}} 2".format(labels) in rendered
+    assert 'task_db_queries_bucket{{{0},le="2.0"}} 2'.format(labels) in rendered
+    assert (
+        'task_created_lag_seconds_bucket{{{0},le="10.0"}} 0'.format(labels) in rendered
+    )
+    assert (
+        'task_created_lag_seconds_bucket{{{0},le="60.0"}} 1'.format(labels) in rendered
+    )
+    assert "task_schedule_lag_seconds_count{{{0}}} 1".format(labels) in rendered
+    assert 'tasks_total{{{0},outcome="success"}} 1'.format(labels) in rendered
+    assert 'tasks_total{{{0},outcome="error"}} 1'.format(labels) in rendered
+
+
+def test_deferred_handler_records_metrics(client):
+    payload = encode(DummyBackgroundTask(some_param=1))
+
+    response = client.post(
+        reverse("tasks_deferred_handler"),
+        data=payload,
+        content_type="application/octet-stream",
+        HTTP_X_APPENGINE_TASKNAME="some-task",
+        HTTP_X_APPENGINE_QUEUENAME="sync",
+        HTTP_X_TASK_CREATED_AT=str(time.time() - 5),
+    )
+    assert response.status_code == 200
+
+    rendered = metrics.render_metrics()
+    labels = 'task_class="DummyBackgroundTask",queue="sync"'
+    assert (
+        "task_payload_bytes_sum{{{0}}} {1}".format(labels, float(len(payload)))
+        in rendered
+    )
+    assert "task_created_lag_seconds_count{{{0}}} 1".format(labels) in rendered
+
+
+def test_stored_task_reports_its_own_class(payload_store):
+    payload = encode(DummyBackgroundTask(some_param=1))
+    digest = payload_store.put(payload, "task-1")
+
+    with patch.object(DummyBackgroundTask, "run"):
+        with metrics.track_execution("default", 50) as execution:
+            execution.task_class = "_DeferredFromStore"
+            _DeferredFromStore(digest, "task-1").run()
+
+    assert execution.task_class == "DummyBackgroundTask"
+    assert execution.payload_bytes == len(payload)
+
+
+def test_metrics_require_bearer_token(client, settings):
+    url = reverse("tasks_metrics")
+    settings.TASKS_METRICS_TOKEN = None
+    assert client.get(url, HTTP_AUTHORIZATION="Bearer ").status_code == 403
+
+    settings.TASKS_METRICS_TOKEN = "s3cret"
+    assert client.get(url).status_code == 403
+    assert client.get(url, HTTP_AUTHORIZATION="Bearer nope").status_code == 403
+    # Tasks get no special access
+    assert client.get(url, HTTP_X_APPENGINE_TASKNAME="task").status_code == 403
+
+    response = client.get(url, HTTP_AUTHORIZATION="Bearer s3cret")
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/plain")
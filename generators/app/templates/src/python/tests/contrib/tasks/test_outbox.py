@@ -0,0 +1,89 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+import pytest
+from backend.contrib.tasks import TaskOptions, defer, defer_many, outbox
+from backend.contrib.tasks.models import OutboxTask
+from backend.contrib.tasks.outbox import dispatch_outbox, start_outbox_dispatcher
+from backend.core.services.dummy import DummyBackgroundTask
+from django.apps import apps
+from django.db import transaction
+from django.utils import timezone
+
+
+@pytest.mark.django_db
+def test_outbox_is_atomic_with_the_transaction():
+    with patch("backend.contrib.tasks.tasks._schedule_task") as mock_schedule:
+        with transaction.atomic():
+            defer(DummyBackgroundTask(some_param=1), TaskOptions(outbox=True))
+
+        with pytest.raises(RuntimeError):
+            with transaction.atomic():
+                defer(DummyBackgroundTask(some_param=2), TaskOptions(outbox=True))
+                raise RuntimeError()
+
+    # Nothing is sent on the request path, only the committed task is stored
+    mock_schedule.assert_not_called()
+    assert OutboxTask.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_outbox_countdown_starts_when_deferred():
+    defer(DummyBackgroundTask(some_param=1), TaskOptions(outbox=True, countdown=60))
+
+    options = TaskOptions.parse_obj(OutboxTask.objects.get().options)
+    assert options.countdown is None
+    assert options.eta > timezone.now() + timedelta(seconds=50)
+
+
+@pytest.mark.django_db
+def test_dispatch_outbox():
+    results = defer_many(
+        [DummyBackgroundTask(some_param=i) for i in range(25)],
+        TaskOptions(outbox=True),
+    )
+    assert all(result.success is None for result in results)
+
+    with patch("backend.contrib.tasks.tasks._schedule_task") as mock_schedule:
+        assert dispatch_outbox(batch_size=10) == 25
+
+    assert mock_schedule.call_count == 25
+    assert {call.args[1].name for call in mock_schedule.call_args_list} == {
+        result.name for result in results
+    }
+    assert not OutboxTask.objects.exists()
+
+
+@pytest.mark.django_db
+def test_dispatch_outbox_backs_off_failed_tasks():
+    defer_many(
+        [DummyBackgroundTask(some_param=i) for i in range(3)],
+        TaskOptions(outbox=True),
+    )
+
+    with patch("backend.contrib.tasks.tasks._schedule_task") as mock_schedule:
+        mock_schedule.side_effect = [None, Exception("Enqueue failed"), None]
+        assert dispatch_outbox(max_concurrency=1) == 2
+
+        # The failed task isn't retried before its backoff expires
+        assert dispatch_outbox() == 0
+
+    failed = OutboxTask.objects.get()
+    assert failed.attempts == 1
+    assert "Enqueue failed" in failed.last_error
+    assert failed.available_at > timezone.now()
+
+
+def test_dispatcher_thread_starts_once(settings):
+    settings.TASKS_OUTBOX_DISPATCHER_THREAD = True
+
+    with patch("backend.contrib.tasks.outbox.dispatch_outbox"):
+        apps.get_app_config("tasks").ready()
+        thread = outbox._dispatcher_thread
+        try:
+            assert thread.is_alive()
+            assert start_outbox_dispatcher() is thread
+        finally:
+            thread.stop(timeout=5)
+
+    assert not thread.is_alive()
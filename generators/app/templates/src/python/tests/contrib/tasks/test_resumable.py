@@ -0,0 +1,132 @@
+from typing import Optional
+from unittest.mock import patch
+
+import pytest
+from backend.contrib.l10n.models import Language
+from backend.contrib.tasks import ResumableTask, TaskOptions, defer
+from backend.contrib.tasks.environment import _TASK_ENV, _TaskEnvironment
+from backend.contrib.tasks.models import TaskCheckpoint
+from backend.contrib.tasks.serialization import decode
+
+_seen = []
+
+
+class _LanguageNames(ResumableTask):
+    batch_size: int = 3
+    fail_after: Optional[int] = None
+
+    def process_batch(self, cursor: Optional[int]) -> Optional[int]:
+        queryset = Language.objects.order_by("pk")
+        if cursor is not None:
+            queryset = queryset.filter(pk__gt=cursor)
+
+        languages = list(queryset[: self.batch_size])
+        if not languages:
+            return None
+
+        if self.fail_after is not None and len(_seen) >= self.fail_after:
+            raise RuntimeError("Request killed")
+
+        _seen.extend(language.name for language in languages)
+        return languages[-1].pk
+
+
+@pytest.fixture(autouse=True)
+def languages():
+    _seen.clear()
+    return Language.objects.bulk_create(
+        Language(name="l{0:02}".format(i)) for i in range(10)
+    )
+
+
+@pytest.mark.django_db
+def test_runs_to_completion():
+    _LanguageNames().run()
+
+    assert sorted(_seen) == ["l{0:02}".format(i) for i in range(10)]
+    assert not TaskCheckpoint.objects.exists()
+
+
+@pytest.mark.django_db
+def test_continues_when_out_of_time():
+    with patch("backend.contrib.tasks.resumable.defer") as mock_defer:
+        _LanguageNames(time_budget=0).run()
+        # Each continuation processes one batch, then re-defers itself
+        continuations = 0
+        while mock_defer.called:
+            continuation = mock_defer.call_args.args[0]
+            mock_defer.reset_mock()
+            continuation.run()
+            continuations += 1
+
+    assert continuations == 4
+    assert sorted(_seen) == ["l{0:02}".format(i) for i in range(10)]
+    assert not TaskCheckpoint.objects.exists()
+
+
+@pytest.mark.django_db
+def test_retry_resumes_from_checkpoint():
+    token = _TASK_ENV.set(_TaskEnvironment(task_name="sync-languages"))
+    try:
+        with pytest.raises(RuntimeError):
+            _LanguageNames(fail_after=6).run()
+        assert TaskCheckpoint.objects.get(key="sync-languages").cursor
+
+        # Cloud Tasks retries the task under the same name
+        _LanguageNames().run()
+    finally:
+        _TASK_ENV.reset(token)
+
+    assert sorted(_seen) == ["l{0:02}".format(i) for i in range(10)]
+
+
+@pytest.mark.django_db
+def test_no_checkpoint_without_task_name():
+    # Run directly, e.g. by a cron handler, nothing could resume a checkpoint
+    with pytest.raises(RuntimeError):
+        _LanguageNames(fail_after=6).run()
+
+    assert not TaskCheckpoint.objects.exists()
+
+
+@pytest.mark.django_db
+def test_continuation_without_task_name_goes_through_outbox():
+    with patch("backend.contrib.tasks.resumable.defer") as mock_defer:
+        _LanguageNames(time_budget=0).run()
+
+    continuation, options = mock_defer.call_args.args
+    assert options.outbox
+    assert TaskCheckpoint.objects.get(key=continuation.checkpoint_key).cursor
+
+
+@pytest.mark.django_db
+def test_continuation_keeps_task_options():
+    options = TaskOptions(
+        queue="sync",
+        handler_url="tasks_deferred_handler",
+        extra_task_headers={"X-Sync": "1"},
+        countdown=30,
+    )
+
+    with patch("backend.contrib.tasks.tasks._schedule_task") as mock_schedule:
+        defer(_LanguageNames(time_budget=0), options)
+    task = decode(mock_schedule.call_args.args[0])
+
+    with patch("backend.contrib.tasks.resumable.defer") as mock_defer:
+        task.run()
+
+    _, continuation_options = mock_defer.call_args.args
+    assert continuation_options.queue == "sync"
+    assert continuation_options.extra_task_headers == {"X-Sync": "1"}
+    # Only the options describing where the task runs are kept
+    assert continuation_options.countdown is None
+    assert continuation_options.name.startswith("resume-")
+
+
+@pytest.mark.django_db
+def test_process_batch_must_be_implemented():
+    class _Incomplete(ResumableTask):
+        pass
+
+    with pytest.raises(TypeError):
+        _Incomplete()
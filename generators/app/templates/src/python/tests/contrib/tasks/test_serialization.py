@@ -0,0 +1,104 @@
+import pickle
+from typing import Callable
+
+import pytest
+from backend.contrib.tasks import metrics
+from backend.contrib.tasks.registry import register_task
+from backend.contrib.tasks.serialization import PayloadDecodeError, decode, encode
+from backend.core.services.dummy import DummyBackgroundTask
+from backend.core.services.poke import PokeSpeciesSync
+from pydantic import BaseModel
+
+
+class _PlainTask:
+    def __init__(self, value):
+        self.value = value
+
+    def run(self):
+        pass
+
+
+# Module level, so it can be pickled
+@register_task("tests.registered_callback")
+class _RegisteredCallbackTask(BaseModel):
+    callback: Callable
+
+    def run(self):
+        pass
+
+
+def test_pydantic_task_is_encoded_as_json():
+    task = PokeSpeciesSync(api_entity_url="https://pokeapi.co/api/v2/pokemon/1/")
+
+    data = encode(task)
+
+    assert data[0] == 0x02
+    assert len(data) < len(pickle.dumps(task, protocol=pickle.HIGHEST_PROTOCOL))
+    assert decode(data) == task
+
+
+def test_registered_task_is_encoded_by_id():
+    # Locally defined, so it couldn't be imported by its qualified name
+    @register_task("tests.registered")
+    class RegisteredTask(BaseModel):
+        value: int
+
+        def run(self):
+            pass
+
+    data = encode(RegisteredTask(value=1))
+
+    assert data[0] == 0x03
+    assert data[1:] == b'{"r":"tests.registered","f":{"value": 1}}'
+    assert decode(data) == RegisteredTask(value=1)
+
+
+def test_registered_task_falls_back_when_not_json_serializable():
+    data = encode(_RegisteredCallbackTask(callback=len))
+
+    assert data[0] == 0x01
+    assert decode(data).callback is len
+
+
+def test_encoded_sizes_are_recorded():
+    metrics.reset_metrics()
+
+    data = encode(DummyBackgroundTask(some_param=1))
+
+    rendered = metrics.render_metrics()
+    labels = 'task_class="DummyBackgroundTask",codec="json"'
+    assert "task_encoded_bytes_count{{{0}}} 1".format(labels) in rendered
+    assert (
+        "task_encoded_bytes_sum{{{0}}} {1}".format(labels, float(len(data))) in rendered
+    )
+    metrics.reset_metrics()
+
+
+def test_other_tasks_fall_back_to_pickle():
+    data = encode(_PlainTask(value=1))
+
+    assert data[0] == 0x01
+    assert decode(data).value == 1
+
+
+def test_large_payloads_are_compressed():
+    task = DummyBackgroundTask(some_param=1)
+    large_task = _PlainTask(value=[task] * 1000)
+
+    data = encode(large_task)
+
+    assert data[0] >> 4 != 0
+    assert len(data) < len(pickle.dumps(large_task))
+    assert decode(data).value == [task] * 1000
+
+
+def test_decode_legacy_pickle():
+    data = pickle.dumps(_PlainTask(value=2), protocol=pickle.HIGHEST_PROTOCOL)
+
+    assert decode(data).value == 2
+
+
+@pytest.mark.parametrize("data", [b"", b"\x0f{}", b'\x03{"r":"tests.unknown","f":{}}'])
+def test_decode_invalid_payload(data: bytes):
+    with pytest.raises(PayloadDecodeError):
+        decode(data)
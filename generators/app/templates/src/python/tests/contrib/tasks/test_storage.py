@@ -0,0 +1,129 @@
+from datetime import timedelta
+from unittest.mock import Mock, patch
+
+import pytest
+from backend.contrib.tasks.models import PayloadBlob, PayloadChunk
+from backend.contrib.tasks.serialization import decode
+from backend.contrib.tasks.storage import DatabasePayloadStore, PayloadNotFound
+from backend.contrib.tasks.tasks import _DeferredFromStore, _schedule_task, _serialize
+from backend.core.services.dummy import DummyBackgroundTask
+from django.utils import timezone
+from google.api_core import exceptions
+
+
+@pytest.fixture(params=["filesystem", "database"])
+def store(request, payload_store):
+    if request.param == "database":
+        request.getfixturevalue("db")
+        return DatabasePayloadStore(chunk_size=64)
+    return payload_store
+
+
+def test_put_and_stream(store):
+    data = bytes(range(256)) * 4
+
+    digest = store.put(data, "task-1")
+
+    chunks = list(store.iter_chunks(digest))
+    assert len(chunks) == 16
+    assert b"".join(chunks) == data
+
+    with store.open(digest) as stream:
+        assert stream.read(10) == data[:10]
+        assert stream.read() == data[10:]
+
+
+def test_put_deduplicates(store):
+    digest = store.put(b"payload", "task-1")
+    assert store.put(b"payload", "task-2") == digest
+
+    # One reference is left after the first release
+    store.release(digest, "task-1")
+    assert store.read(digest) == b"payload"
+
+    store.release(digest, "task-2")
+    with pytest.raises(PayloadNotFound):
+        store.read(digest)
+
+
+def test_release_is_idempotent(store):
+    digest = store.put(b"payload", "task-1")
+    store.put(b"payload", "task-2")
+
+    # A redelivered task releases its reference again
+    store.release(digest, "task-1")
+    store.release(digest, "task-1")
+    assert store.read(digest) == b"payload"
+
+    store.release(digest, "task-2")
+    store.release(digest, "task-2")
+    with pytest.raises(PayloadNotFound):
+        store.read(digest)
+
+
+def test_sweep(store):
+    expired = store.put(b"expired", "task-1")
+    current = store.put(b"current", "task-2")
+
+    assert store.sweep(now=timezone.now()) == 0
+    store.retention = timedelta(days=60)
+    store.put(b"current", "task-3")
+
+    assert store.sweep(now=timezone.now() + timedelta(days=45)) == 1
+    assert store.read(current) == b"current"
+    with pytest.raises(PayloadNotFound):
+        store.read(expired)
+
+
+@pytest.mark.django_db
+def test_database_store_chunks():
+    digest = DatabasePayloadStore(chunk_size=4).put(b"0123456789", "task-1")
+
+    assert PayloadBlob.objects.get(pk=digest).size == 10
+    assert list(
+        PayloadChunk.objects.filter(blob_id=digest)
+        .order_by("index")
+        .values_list("index", flat=True)
+    ) == [0, 1, 2]
+
+
+def test_large_task_runs_from_store(payload_store):
+    client = Mock()
+    client.create_task.side_effect = [
+        exceptions.InvalidArgument("Task size too large"),
+        None,
+    ]
+    task = DummyBackgroundTask(some_param=1)
+    options = Mock(small_task=False, extra_task_headers={})
+
+    with patch("backend.contrib.tasks.tasks._get_client", return_value=client):
+        with patch("backend.contrib.tasks.tasks._build_task") as mock_build:
+            mock_build.return_value = ("queue", {"app_engine_http_request": {}})
+            _schedule_task(_serialize(task), options)
+
+    body = client.create_task.call_args.kwargs["task"]["app_engine_http_request"][
+        "body"
+    ]
+    deferred = decode(body)
+
+    with patch.object(DummyBackgroundTask, "run") as mock_run:
+        deferred.run()
+        mock_run.assert_called_once()
+
+    # The payload is released once the task has run
+    with pytest.raises(PayloadNotFound):
+        payload_store.read(deferred.digest)
+
+
+def test_redelivered_large_task_keeps_shared_payload(payload_store):
+    task = DummyBackgroundTask(some_param=1)
+    payload = _serialize(task)
+    first = _DeferredFromStore(payload_store.put(payload, "task-1"), "task-1")
+    second = _DeferredFromStore(payload_store.put(payload, "task-2"), "task-2")
+
+    with patch.object(DummyBackgroundTask, "run") as mock_run:
+        first.run()
+        # Cloud Tasks delivers the first task again
+        first.run()
+        second.run()
+        assert mock_run.call_count == 3
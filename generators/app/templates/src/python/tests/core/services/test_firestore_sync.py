@@ -0,0 +1,140 @@
+from datetime import timedelta
+from unittest.mock import MagicMock, patch
+from uuid import uuid4
+
+import pytest
+from backend.core.models import (
+    FirestoreDocumentHash,
+    FirestoreSyncWatermark,
+    FirestoreTombstone,
+    PokePokemon,
+)
+from backend.core.tasks import PokemonFirestoreSync
+
+
+@pytest.fixture
+def firestore_client():
+    client = MagicMock()
+    with patch("firebase_admin.firestore.client", return_value=client), patch(
+        "backend.core.services.firestore_sync._SETTLE_TIME", timedelta(0)
+    ):
+        yield client
+
+
+def _synced_keys(firestore_client: MagicMock):
+    keys = [
+        call.args[0]
+        for call in firestore_client.collection.return_value.document.call_args_list
+    ]
+    firestore_client.reset_mock()
+    return sorted(keys)
+
+
+@pytest.mark.django_db
+def test_sync_only_writes_modified_entities(firestore_client, poke_pokemon_factory):
+    for name in ("bulbasaur", "charmander", "squirtle"):
+        poke_pokemon_factory(name=name, id=uuid4())
+
+    PokemonFirestoreSync(batch_size=2).run()
+
+    assert _synced_keys(firestore_client) == ["bulbasaur", "charmander", "squirtle"]
+    assert FirestoreSyncWatermark.objects.get(collection="pokemon")
+
+    PokemonFirestoreSync(batch_size=2).run()
+
+    assert _synced_keys(firestore_client) == []
+
+    PokePokemon.objects.filter(name="squirtle").update(weight=90)
+    PokePokemon.objects.get(name="charmander").save()
+    PokePokemon.objects.get(name="squirtle").save()
+    PokemonFirestoreSync(batch_size=2).run()
+
+    # Saved without changes, so charmander's document is left as it is
+    assert _synced_keys(firestore_client) == ["squirtle"]
+
+    PokemonFirestoreSync(batch_size=2, full=True).run()
+
+    assert _synced_keys(firestore_client) == ["bulbasaur", "charmander", "squirtle"]
+
+
+@pytest.mark.django_db
+def test_sync_breaks_modified_at_ties_by_id(firestore_client, poke_pokemon_factory):
+    for name in ("bulbasaur", "charmander", "squirtle"):
+        poke_pokemon_factory(name=name, id=uuid4())
+    PokePokemon.objects.update(modified_at=PokePokemon.objects.first().modified_at)
+
+    # Checkpoint after every entity
+    with patch("backend.core.services.firestore_sync._BATCHES_PER_CHECKPOINT", 1):
+        PokemonFirestoreSync(batch_size=1).run()
+
+    assert _synced_keys(firestore_client) == ["bulbasaur", "charmander", "squirtle"]
+
+
+@pytest.mark.django_db
+def test_sync_merges_changed_fields(firestore_client, poke_pokemon_factory):
+    pokemon = poke_pokemon_factory(name="bulbasaur", id=uuid4(), weight=69)
+    PokemonFirestoreSync(merge=True).run()
+
+    batch = firestore_client.batch.return_value
+    assert batch.set.call_args.args[1]["name"] == "bulbasaur"
+    assert batch.set.call_args.kwargs == {"merge": False}
+    assert FirestoreDocumentHash.objects.get(collection="pokemon", key="bulbasaur")
+    firestore_client.reset_mock()
+
+    pokemon.weight = 70
+    pokemon.save()
+    PokemonFirestoreSync(merge=True).run()
+
+    assert batch.set.call_args.args[1] == {"weight": 70}
+    assert batch.set.call_args.kwargs == {"merge": ["weight"]}
+
+
+@pytest.mark.django_db
+def test_sync_merge_replaces_nested_maps(firestore_client, poke_pokemon_factory):
+    pokemon = poke_pokemon_factory(name="bulbasaur", id=uuid4())
+    PokemonFirestoreSync(merge=True).run()
+    species = firestore_client.batch.return_value.set.call_args.args[1]["species"]
+    assert "fr" in species["l10n"]
+    firestore_client.reset_mock()
+
+    # A language drops out of the species' names
+    pokemon.species.names.remove(pokemon.species.names.get(language__name="fr"))
+    pokemon.save()
+    PokemonFirestoreSync(merge=True).run()
+
+    batch = firestore_client.batch.return_value
+    data = batch.set.call_args.args[1]
+    assert list(data) == ["species"]
+    assert "fr" not in data["species"]["l10n"]
+    # The species map is replaced, so the French name is removed from it
+    assert batch.set.call_args.kwargs == {"merge": ["species"]}
+
+
+@pytest.mark.django_db
+def test_sync_deletes_documents_of_deleted_entities(
+    firestore_client, poke_pokemon_factory
+):
+    for name in ("bulbasaur", "charmander"):
+        poke_pokemon_factory(name=name, id=uuid4())
+    PokemonFirestoreSync().run()
+    _synced_keys(firestore_client)
+
+    charmander = PokePokemon.objects.get(name="charmander")
+    charmander.delete()
+    assert FirestoreTombstone.objects.get(collection="pokemon", key="charmander")
+
+    PokemonFirestoreSync().run()
+
+    document = firestore_client.collection.return_value.document
+    document.assert_called_once_with("charmander")
+    batch = firestore_client.batch.return_value
+    batch.delete.assert_called_once_with(document.return_value)
+    assert not FirestoreTombstone.objects.exists()
+    firestore_client.reset_mock()
+
+    # Created again with the same data, the document is written again
+    poke_pokemon_factory(name="charmander", id=uuid4(), species=charmander.species)
+    PokemonFirestoreSync().run()
+
+    assert _synced_keys(firestore_client) == ["charmander"]
+    assert not batch.delete.called
@@ -0,0 +1,108 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from backend.core.services.firestore_writer import FirestoreBatchWriter
+from google.api_core import exceptions
+
+
+def _committed_batch_sizes(client: MagicMock):
+    return sorted(
+        len(batch.set.call_args_list)
+        for batch in client.batch.side_effect.batches
+        if batch.commit.called and not batch.commit.side_effect
+    )
+
+
+def _client(commit=None):
+    client = MagicMock()
+
+    def new_batch():
+        batch = MagicMock()
+        batch.commit.side_effect = commit
+        new_batch.batches.append(batch)
+        return batch
+
+    new_batch.batches = []
+    client.batch.side_effect = new_batch
+    return client
+
+
+def test_writes_are_batched():
+    client = _client()
+
+    with FirestoreBatchWriter(client, batch_size=2) as writer:
+        for i in range(5):
+            writer.set("doc{0}".format(i), {"i": i})
+
+    assert writer.written == 5
+    assert _committed_batch_sizes(client) == [1, 2, 2]
+
+
+def test_batch_size_is_capped():
+    assert FirestoreBatchWriter(_client(), batch_size=1000).batch_size == 500
+
+
+def test_concurrency_is_bounded():
+    in_flight = []
+    lock = threading.Lock()
+    active = 0
+
+    def commit():
+        nonlocal active
+        with lock:
+            active += 1
+            in_flight.append(active)
+        time.sleep(0.01)
+        with lock:
+            active -= 1
+
+    with FirestoreBatchWriter(_client(commit), batch_size=1, max_concurrency=3) as w:
+        for i in range(20):
+            w.set("doc{0}".format(i), {"i": i})
+
+    assert w.written == 20
+    assert max(in_flight) <= 3
+
+
+def test_contention_is_retried(monkeypatch):
+    monkeypatch.setattr(
+        "backend.core.services.firestore_writer.time.sleep", lambda _: None
+    )
+    failures = [exceptions.Aborted("Too much contention")]
+
+    def commit():
+        if failures:
+            raise failures.pop()
+
+    client = _client(commit)
+    with FirestoreBatchWriter(client, batch_size=2) as writer:
+        writer.set("doc1", {"i": 1})
+        writer.set("doc2", {"i": 2})
+
+    assert writer.written == 2
+    # The batch was rebuilt with the same writes for the retry
+    assert [
+        len(batch.set.call_args_list) for batch in client.batch.side_effect.batches
+    ] == [2, 2]
+
+
+def test_errors_are_raised():
+    client = _client(exceptions.PermissionDenied("Missing permissions"))
+
+    with pytest.raises(exceptions.PermissionDenied):
+        with FirestoreBatchWriter(client) as writer:
+            writer.set("doc1", {"i": 1})
+
+
+def test_deletes_are_batched():
+    client = _client()
+
+    with FirestoreBatchWriter(client, batch_size=2) as writer:
+        writer.set("doc1", {"i": 1})
+        writer.delete("doc2")
+
+    (batch,) = client.batch.side_effect.batches
+    batch.set.assert_called_once_with("doc1", {"i": 1}, merge=False)
+    batch.delete.assert_called_once_with("doc2")
@@ -20,11 +20,13 @@ from backend.core.schemas import (
     PokeSpeciesIn,
 )
 from backend.core.services.poke import (
+    PokeGenerationSynced,
     PokeSpeciesSync,
     PokeSync,
     _create_and_add_names,
     _fetch_entity,
 )
+from backend.core.tasks import PokemonFirestoreSync
 from ninja import Schema
 
 
@@ -68,16 +70,30 @@ def test_fetch_entity(entity_url: str, schema_class: Type[Schema]):
 
 @pytest.mark.vcr
 def test_poke_sync():
-    with patch("backend.core.services.poke.defer") as mock_defer:
+    with patch("backend.core.services.poke.defer_group") as mock_defer_group:
         PokeSync(generations_to_sync=["1"]).run()
-        assert mock_defer.call_count == 151  # Gotta catch them all...
+        mock_defer_group.assert_called_once()
+
+        group = mock_defer_group.call_args.args[0]
+        assert group.callback.generation_name == "1"
 
-        for call_args in mock_defer.call_args_list:
-            assert call_args.args[0].api_entity_url.startswith(
+        species_syncs = group.tasks
+        assert len(species_syncs) == 151  # Gotta catch them all...
+
+        for species_sync in species_syncs:
+            assert species_sync.api_entity_url.startswith(
                 "https://pokeapi.co/api/v2/pokemon-species/",
             )
 
 
+def test_generation_synced_defers_firestore_sync():
+    with patch("backend.core.services.poke.defer") as mock_defer:
+        PokeGenerationSynced(generation_name="1").run()
+
+    mock_defer.assert_called_once()
+    assert mock_defer.call_args.args[0] == PokemonFirestoreSync()
+
+
 @pytest.mark.django_db
 @pytest.mark.vcr
 def test_poke_species_sync():
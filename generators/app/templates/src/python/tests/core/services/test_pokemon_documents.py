@@ -0,0 +1,45 @@
+from uuid import uuid4
+
+import pytest
+from backend.core.models import PokePokemon
+from backend.core.services.pokemon_documents import stream_pokemon_documents
+from backend.core.tasks import PokemonFirestoreSync
+from pydantic import ValidationError
+
+
+@pytest.mark.django_db
+def test_documents_equal_mapped_schemas(
+    django_assert_num_queries, poke_pokemon_factory
+):
+    poke_pokemon_factory(name="bulbasaur", id=uuid4())
+    poke_pokemon_factory(
+        name="mew", id=uuid4(), species__id=uuid4(), species__habitat=None
+    )
+    task = PokemonFirestoreSync()
+
+    with django_assert_num_queries(1):
+        documents = list(stream_pokemon_documents(PokePokemon.objects.all()))
+
+    assert sorted(documents, key=lambda document: document["name"]) == [
+        task.map_schema(pokemon).dict()
+        for pokemon in task.get_queryset().order_by("name")
+    ]
+
+
+@pytest.mark.django_db
+def test_documents_of_queryset(poke_pokemon_factory):
+    for name in ("bulbasaur", "charmander"):
+        poke_pokemon_factory(name=name, id=uuid4())
+
+    documents = stream_pokemon_documents(PokePokemon.objects.filter(name="charmander"))
+
+    assert [document["name"] for document in documents] == ["charmander"]
+
+
+@pytest.mark.django_db
+def test_documents_are_validated(poke_pokemon_factory):
+    pokemon = poke_pokemon_factory(name="bulbasaur", id=uuid4())
+    pokemon.species.color.names.clear()
+
+    with pytest.raises(ValidationError):
+        list(stream_pokemon_documents(PokePokemon.objects.all()))
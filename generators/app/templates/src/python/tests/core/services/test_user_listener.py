@@ -0,0 +1,89 @@
+import threading
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+from zoneinfo import ZoneInfo
+
+import pytest
+from backend.contrib.tasks.models import TaskCheckpoint
+from backend.core.models import EndUser
+from backend.core.services.userbase import UserProfileListener
+from firebase_admin import firestore
+from google.cloud.firestore_v1.watch import ChangeType, DocumentChange
+from tests.utils import patch_firestore
+
+
+def _changes(change_type: ChangeType, *documents):
+    snapshots = [document.get() for document in documents]
+    return [DocumentChange(change_type, snapshot, -1, -1) for snapshot in snapshots]
+
+
+@pytest.mark.django_db
+@patch_firestore
+def test_applies_changes(fs_user_profile_factory):
+    users = firestore.client().collection("users")
+    profiles = [
+        fs_user_profile_factory(
+            created=datetime(2022, 7, day, tzinfo=ZoneInfo("UTC")),
+            opt_in_communications=False,
+        )
+        for day in (18, 19)
+    ]
+    documents = [users.add(profile.dict())[1] for profile in profiles]
+    listener = UserProfileListener()
+
+    listener.handle_snapshot(None, _changes(ChangeType.ADDED, *documents), None)
+    assert listener.apply_changes() == 2
+
+    assert sorted(EndUser.objects.values_list("firebase_auth_id", flat=True)) == sorted(
+        document.id for document in documents
+    )
+    checkpoint = TaskCheckpoint.objects.get(key="core.user_profile_listener")
+    assert checkpoint.cursor == profiles[1].created.isoformat()
+
+    documents[0].update({"opt_in_communications": True})
+    listener.handle_snapshot(None, _changes(ChangeType.MODIFIED, documents[0]), None)
+    listener.handle_snapshot(None, _changes(ChangeType.REMOVED, documents[1]), None)
+    assert listener.apply_changes() == 2
+
+    # Removed profiles don't delete their EndUser
+    assert EndUser.objects.get(firebase_auth_id=documents[0].id).opt_in_communications
+    assert EndUser.objects.filter(firebase_auth_id=documents[1].id).exists()
+    assert listener.apply_changes() == 0
+
+
+@pytest.mark.django_db
+@patch_firestore
+def test_resumes_from_last_created(fs_user_profile_factory):
+    users = firestore.client().collection("users")
+    created = datetime(2022, 7, 18, tzinfo=ZoneInfo("UTC"))
+    old, new = [
+        users.add(
+            fs_user_profile_factory(
+                created=created + delta, opt_in_communications=False
+            ).dict()
+        )[1]
+        for delta in (timedelta(days=-1), timedelta(0))
+    ]
+    TaskCheckpoint.objects.create(
+        key="core.user_profile_listener", cursor=created.isoformat()
+    )
+
+    documents = UserProfileListener().get_query().stream()
+
+    assert [document.id for document in documents] == [new.id]
+
+
+@pytest.mark.django_db
+def test_run_applies_changes_until_stopped():
+    stop = threading.Event()
+    query = MagicMock()
+    listener = UserProfileListener(flush_interval=0.01)
+
+    with patch.object(listener, "get_query", return_value=query), patch.object(
+        listener, "apply_changes", side_effect=lambda timeout=0: stop.set() or 0
+    ) as apply_changes:
+        listener.run(stop)
+
+    query.on_snapshot.assert_called_once_with(listener.handle_snapshot)
+    query.on_snapshot.return_value.unsubscribe.assert_called_once()
+    assert apply_changes.call_args_list[0].kwargs == {"timeout": 0.01}
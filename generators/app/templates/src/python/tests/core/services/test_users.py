@@ -1,6 +1,9 @@
+from unittest.mock import patch
 from zoneinfo import ZoneInfo
 
 import pytest
+from backend.contrib.tasks.environment import _TASK_ENV, _TaskEnvironment
+from backend.contrib.tasks.models import TaskCheckpoint
 from backend.core.models import EndUser
 from backend.core.services.userbase import SyncNewUsers
 from django.utils.timezone import datetime
@@ -40,10 +43,13 @@ def test_sync_from(user_profile_factory, fs_user_profile_factory):
         created=datetime(2022, 6, 4, tzinfo=ZoneInfo("UTC")),
     )
     _, doc = fs_client.collection("users").add(existing_fs_user.dict())
-    user_profile_factory(
-        firebase_auth_user_id=doc.id,
+    existing_user = user_profile_factory(
+        firebase_auth_id=doc.id,
         email=existing_fs_user.email,
-        created_at=existing_fs_user.created,
+    )
+    # created_at is set on creation only
+    EndUser.objects.filter(pk=existing_user.pk).update(
+        created_at=existing_fs_user.created
     )
     new_fs_users = [
         fs_user_profile_factory(
@@ -64,3 +70,67 @@ def test_sync_from(user_profile_factory, fs_user_profile_factory):
 
     # We should have 5 users and not 6 (because one already exists)
     assert EndUser.objects.count() == len(fs_users)
+
+
+@pytest.mark.django_db
+@patch_firestore
+def test_sync_in_batches(fs_user_profile_factory):
+    """Users created at the same time are synced in the same batch."""
+    fs_client = firestore.client()
+    created = [
+        datetime(2022, 7, day, tzinfo=ZoneInfo("UTC")) for day in (1, 2, 2, 2, 3)
+    ]
+    for user_created in created:
+        fs_client.collection("users").add(
+            fs_user_profile_factory(created=user_created).dict()
+        )
+
+    with patch.object(
+        SyncNewUsers,
+        "process_batch",
+        autospec=True,
+        side_effect=SyncNewUsers.process_batch,
+    ) as process_batch:
+        result = SyncNewUsers(sync_all=True, batch_size=2).run()
+
+    assert result.success
+    assert EndUser.objects.count() == len(created)
+    # The first batch takes all 3 users created on the 2nd, the last is empty
+    assert process_batch.call_count == 3
+    assert not TaskCheckpoint.objects.exists()
+
+
+@pytest.mark.django_db
+@patch_firestore
+def test_sync_resumes_from_checkpoint(fs_user_profile_factory):
+    fs_client = firestore.client()
+    for day in range(1, 6):
+        fs_client.collection("users").add(
+            fs_user_profile_factory(
+                created=datetime(2022, 7, day, tzinfo=ZoneInfo("UTC"))
+            ).dict()
+        )
+
+    process_batch = SyncNewUsers.process_batch
+
+    def kill_second_batch(task, cursor):
+        if cursor is not None:
+            raise RuntimeError("Request killed")
+        return process_batch(task, cursor)
+
+    token = _TASK_ENV.set(_TaskEnvironment(task_name="sync-new-users"))
+    try:
+        with patch.object(SyncNewUsers, "process_batch", kill_second_batch):
+            result = SyncNewUsers(sync_all=True, batch_size=2).run()
+        assert not result.success
+        assert EndUser.objects.count() == 2
+        assert TaskCheckpoint.objects.get(key="sync-new-users").cursor
+
+        # Cloud Tasks retries the task under the same name
+        result = SyncNewUsers(sync_all=True, batch_size=2).run()
+    finally:
+        _TASK_ENV.reset(token)
+
+    assert result.success
+    assert EndUser.objects.count() == 5
+    assert not TaskCheckpoint.objects.exists()
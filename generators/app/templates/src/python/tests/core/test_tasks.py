@@ -0,0 +1,75 @@
+import pytest
+from backend.contrib.tasks.registry import get_task_type
+from backend.contrib.tasks.serialization import decode, encode
+from backend.core.tasks import PokemonFirestoreSync
+from tests.factories import PokePokemonFactory, PokeTypeSlotFactory
+
+
+@pytest.mark.django_db
+def test_pokemon_queryset_mapper(django_assert_num_queries, poke_pokemon_factory):
+    poke_pokemon_factory(name="bulbasaur")
+    poke_pokemon_factory(name="charmander")
+
+    with django_assert_num_queries(10):
+        task = PokemonFirestoreSync(sql_documents=False)
+        queryset = task.get_queryset()
+        entity = queryset.first()
+        assert entity
+        schema = task.map_schema(entity)
+
+    assert schema.name == entity.name
+    assert schema.height == entity.height
+    assert schema.weight == entity.weight
+    assert schema.base_experience == entity.base_experience
+    assert schema.base_happiness == entity.species.base_happiness
+    assert schema.is_baby == entity.species.is_baby
+    assert schema.is_legendary == entity.species.is_legendary
+    assert schema.is_mythical == entity.species.is_mythical
+
+    assert schema.species.en == entity.species.names.all()[0].name
+    for i, (lang, name) in enumerate(schema.species.l10n.items()):
+        assert name == entity.species.names.all()[i].name
+        assert lang == entity.species.names.all()[i].language.name
+
+    assert schema.color.en == entity.species.color.names.all()[0].name
+    for i, (lang, name) in enumerate(schema.color.l10n.items()):
+        assert name == entity.species.color.names.all()[i].name
+        assert lang == entity.species.color.names.all()[i].language.name
+
+    if entity.species.habitat:
+        assert schema.habitat
+        assert schema.habitat.en == entity.species.habitat.names.all()[0].name
+        for i, (lang, name) in enumerate(schema.habitat.l10n.items()):
+            assert name == entity.species.habitat.names.all()[i].name
+            assert lang == entity.species.habitat.names.all()[i].language.name
+
+    for i, type in enumerate(schema.types):
+        assert schema.types[i].en == entity.types.all()[0].names.all()[0].name
+        for j, (lang, name) in enumerate(type.l10n.items()):
+            assert name == entity.types.all()[i].names.all()[j].name
+            assert lang == entity.types.all()[i].names.all()[j].language.name
+
+
+@pytest.mark.django_db
+def test_pokemon_types_in_slot_order():
+    pokemon = PokePokemonFactory()
+    for slot in (2, 1):
+        PokeTypeSlotFactory(pokemon=pokemon, slot=slot)
+    task = PokemonFirestoreSync(sql_documents=False)
+
+    schema = task.map_schema(task.get_queryset().get())
+
+    assert [pokemon_type.en for pokemon_type in schema.types] == [
+        type_slot.type.get_names_schema().en
+        for type_slot in pokemon.poketypeslot_set.order_by("slot")
+    ]
+
+
+def test_pokemon_firestore_sync_is_deferred_by_id():
+    task = PokemonFirestoreSync()
+
+    data = encode(task)
+
+    assert b"core.pokemon_firestore_sync" in data
+    assert get_task_type("core.pokemon_firestore_sync") is PokemonFirestoreSync
+    assert decode(data) == task
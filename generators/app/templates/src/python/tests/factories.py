@@ -15,13 +15,14 @@ class FirestoreUserProfileFactory(factory.Factory):
         "date_time_between",
         start_date=datetime(2022, 4, 20),
     )
+    opt_in_communications = False
 
     class Meta:
         model = FsUserProfile
 
 
 class EndUserFactory(factory.django.DjangoModelFactory):
-    uid = factory.Sequence(lambda n: "{0}".format(n))
+    firebase_auth_id = factory.Sequence(lambda n: "{0}".format(n))
     email = factory.Sequence(
         lambda n: "testing+userprofile{0}@startupworx.net".format(n)
     )
@@ -29,7 +30,7 @@ class EndUserFactory(factory.django.DjangoModelFactory):
     class Meta:
         model = "core.EndUser"
         django_get_or_create = (
-            "uid",
+            "firebase_auth_id",
             "email",
         )
 